@@ -5,9 +5,10 @@ from dotenv import load_dotenv
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from app.database import MongoDBConnection
-from app.models.user import User
-from bson import ObjectId
+from app.cache import LRUCache
+from app.dependencies import get_user_repository
+from app.models.user import User, TokenUser
+from app.repositories.user_repository import UserRepository
 
 
 load_dotenv()
@@ -17,9 +18,20 @@ ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
-db_connection = MongoDBConnection()
-db = db_connection.get_db()
-users_collection = db["users"]
+
+# Versión vigente de los tokens por usuario; una revocación se ve en otros procesos al vencer el TTL
+token_versions = LRUCache(
+    max_size=int(os.getenv("TOKEN_VERSION_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("TOKEN_VERSION_CACHE_TTL_SECONDS", "30")),
+)
+
+
+def credentials_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -29,36 +41,73 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-async def verify_token(token: str = Depends(oauth2_scheme)) -> str:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
+def create_user_access_token(user: User, expires_delta: Optional[timedelta] = None):
+    """Genera un token que incluye los claims necesarios para autenticar sin consultar MongoDB."""
+    return create_access_token(
+        data={"sub": user.id, "name": user.name, "email": user.email, "ver": user.token_version},
+        expires_delta=expires_delta,
     )
+
+
+def decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-        return user_id
     except JWTError:
-        raise credentials_exception
+        raise credentials_exception()
+    if payload.get("sub") is None:
+        raise credentials_exception()
+    return payload
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+async def verify_token(token: str = Depends(oauth2_scheme)) -> str:
+    return decode_token(token)["sub"]
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme),
+                           user_repo: UserRepository = Depends(get_user_repository)) -> User:
     """Obtiene el usuario completo a partir del token JWT."""
     user_id = await verify_token(token)
 
     # Busca el usuario en la base de datos usando el user_id
-    user_data = await users_collection.find_one({"_id": ObjectId(user_id)})
+    user = await user_repo.get_user_by_id(user_id)
 
-    if user_data is None:
+    if user is None:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
-    # Convierte el documento de MongoDB a un objeto User
-    return User(
-        id=str(user_data["_id"]),
-        name=user_data["name"],
-        email=user_data["email"],
-        hashed_password=user_data["hashed_password"]
-    )
+    return user
+
+
+async def get_current_token_user(token: str = Depends(oauth2_scheme),
+                                 user_repo: UserRepository = Depends(get_user_repository)) -> TokenUser:
+    """
+    Obtiene el usuario a partir de los claims del JWT. Solo consulta MongoDB para conocer la
+    versión vigente de los tokens cuando no está en cache.
+    """
+    payload = decode_token(token)
+
+    # Tokens emitidos antes de incluir los claims: se usa la búsqueda completa
+    if "ver" not in payload or "name" not in payload or "email" not in payload:
+        user = await get_current_user(token, user_repo)
+        return TokenUser(id=user.id, name=user.name, email=user.email, token_version=user.token_version)
+
+    user_id = payload["sub"]
+    if payload["ver"] != await get_token_version(user_repo, user_id):
+        raise credentials_exception()
+
+    return TokenUser(id=user_id, name=payload["name"], email=payload["email"], token_version=payload["ver"])
+
+
+async def get_token_version(user_repo: UserRepository, user_id: str) -> int:
+    version = token_versions.get(user_id)
+    if version is None:
+        version = await user_repo.get_token_version(user_id)
+        if version is None:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        token_versions.set(user_id, version)
+    return version
+
+
+async def revoke_user_tokens(user_repo: UserRepository, user_id: str):
+    """Invalida todos los tokens emitidos para el usuario incrementando su versión."""
+    await user_repo.increment_token_version(user_id)
+    token_versions.invalidate(user_id)
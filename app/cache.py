@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+from dotenv import load_dotenv
+from pymongo.errors import PyMongoError
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Cache LRU acotado con expiración opcional (TTL) y contadores de uso."""
+
+    _MISSING = object()
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key, self._MISSING)
+        if entry is self._MISSING:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            # Entrada vencida: se trata como un fallo y se descarta
+            del self._entries[key]
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        if self._entries.pop(key, self._MISSING) is not self._MISSING:
+            self.invalidations += 1
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]):
+        for key in [key for key in self._entries if predicate(key)]:
+            self.invalidate(key)
+
+    def clear(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class ProductCache:
+    """
+    Cache en proceso del catálogo: documentos de producto por id, listados por categoría y
+    respuestas de listados ya serializadas. Los documentos se guardan con `_id` ya convertido a
+    string. Las claves de los listados y respuestas empiezan siempre por la categoría (`None`
+    para el catálogo completo).
+
+    `version` se incrementa con cada invalidación, de modo que quien construyó un valor a partir
+    de una lectura anterior a una escritura puede detectarlo y no guardarlo.
+    """
+
+    def __init__(self, max_products: int = 10000, max_lists: int = 256, ttl_seconds: Optional[float] = None):
+        self.products = LRUCache(max_size=max_products, ttl_seconds=ttl_seconds)
+        self.lists = LRUCache(max_size=max_lists, ttl_seconds=ttl_seconds)
+        self.responses = LRUCache(max_size=max_lists, ttl_seconds=ttl_seconds)
+        self.version = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["ProductCache"]:
+        """Crea el cache según las variables de entorno; `PRODUCT_CACHE_ENABLED=false` lo desactiva."""
+        if os.getenv("PRODUCT_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+            return None
+        ttl = float(os.getenv("PRODUCT_CACHE_TTL_SECONDS", "30"))
+        return cls(
+            max_products=int(os.getenv("PRODUCT_CACHE_MAX_PRODUCTS", "10000")),
+            max_lists=int(os.getenv("PRODUCT_CACHE_MAX_LISTS", "256")),
+            ttl_seconds=ttl if ttl > 0 else None,
+        )
+
+    def get_product(self, product_id: str) -> Optional[dict]:
+        product = self.products.get(product_id)
+        return dict(product) if product is not None else None
+
+    def set_product(self, product: dict):
+        self.products.set(product["_id"], dict(product))
+
+    @staticmethod
+    def list_key(category: Optional[str], *params: Hashable) -> tuple:
+        return (category,) + params
+
+    def get_list(self, key: Hashable) -> Optional[List[Any]]:
+        """Listado en cache. Las filas se comparten entre peticiones y no se deben modificar."""
+        products = self.lists.get(key)
+        return list(products) if products is not None else None
+
+    def set_list(self, key: Hashable, products: Iterable[Any]):
+        self.lists.set(key, tuple(products))
+
+    def get_response(self, key: Hashable) -> Any:
+        return self.responses.get(key)
+
+    def set_response(self, key: Hashable, response: Any, version: int):
+        """Guarda una respuesta serializada salvo que el catálogo haya cambiado desde `version`."""
+        if version == self.version:
+            self.responses.set(key, response)
+
+    def invalidate_product(self, product_id: str, category: Optional[str] = None):
+        """Invalida un producto y los listados que lo contienen (todos si no se conoce la categoría)."""
+        self.version += 1
+        self.products.invalidate(str(product_id))
+        if category is None:
+            self.lists.clear()
+            self.responses.clear()
+        else:
+            self.lists.invalidate_where(lambda key: key[0] in (None, category))
+            self.responses.invalidate_where(lambda key: key[0] in (None, category))
+
+    def invalidate_products(self, product_ids: Iterable[Any]):
+        self.version += 1
+        for product_id in product_ids:
+            self.products.invalidate(str(product_id))
+        self.lists.clear()
+        self.responses.clear()
+
+    def clear(self):
+        self.version += 1
+        self.products.clear()
+        self.lists.clear()
+        self.responses.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            "products": self.products.stats(),
+            "lists": self.lists.stats(),
+            "responses": self.responses.stats(),
+            "catalog": {"version": self.version},
+        }
+
+    async def watch_changes(self, collection):
+        """
+        Invalida el cache a partir del change stream de la colección de productos.
+        Requiere replica set; en un servidor standalone termina sin hacer nada.
+        """
+        try:
+            async with collection.watch() as stream:
+                async for change in stream:
+                    document_key = change.get("documentKey", {})
+                    if "_id" in document_key:
+                        self.invalidate_product(str(document_key["_id"]))
+                    else:
+                        self.clear()
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as err:
+            logger.warning("Change stream de productos no disponible: %s", err)
@@ -1,52 +1,115 @@
+import asyncio
+import logging
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
-from pymongo.errors import ServerSelectionTimeoutError
+from pymongo.errors import PyMongoError
+from app.indexes import reconcile_indexes
+from app.metrics import mongo_command_listener
 
 # Cargar las variables de entorno
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
-class MongoDBConnection:
-    _instance = None
 
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            mongo_url = os.getenv("MONGODB_URI")  # Cambiado para coincidir con tu .env
-            cls._instance.client = AsyncIOMotorClient(mongo_url)
-            cls._instance.db = cls._instance.client[os.getenv("DATABASE_NAME")]
+def client_options_from_env() -> dict:
+    """Opciones del pool de conexiones de Motor definidas por variables de entorno."""
+    options = {
+        "maxPoolSize": int(os.getenv("MONGODB_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    }
+    if os.getenv("MONGODB_MAX_IDLE_TIME_MS"):
+        options["maxIdleTimeMS"] = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS"))
+    if os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS"):
+        options["waitQueueTimeoutMS"] = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS"))
+    if os.getenv("MONGODB_COMPRESSORS"):
+        # Por ejemplo "zstd,snappy,zlib"; zstd y snappy requieren sus paquetes opcionales
+        options["compressors"] = os.getenv("MONGODB_COMPRESSORS")
+    return options
+
 
-            # Probar la conexión
-            try:
-                cls._instance.client.admin.command('ping')
-                print("Conexión a MongoDB Atlas exitosa.")
-            except ServerSelectionTimeoutError as err:
-                print(f"Error de conexión: {err}")
-                cls._instance = None  # Resetear la instancia para evitar problemas
+class MongoDBConnection:
+    """
+    Conexión a MongoDB de un proceso. El cliente de Motor se crea de forma perezosa en el primer
+    `get_db()`, por lo que importar la app no hace I/O, y se vuelve a crear si el proceso cambió
+    (por ejemplo, tras un fork de gunicorn), de modo que nunca se comparte entre procesos.
+    """
+    _client_factory = AsyncIOMotorClient
+
+    @classmethod
+    def configure(cls, client_factory):
+        """
+        Sustituye la fábrica del cliente, por ejemplo por un stand-in en memoria para benchmarks.
+        Recibe `(mongo_url, **options)` y se aplica a las conexiones creadas después.
+        """
+        cls._client_factory = client_factory
 
-            # Verificar y crear las colecciones si no existen
-            cls._instance.ensure_collections()
-        return cls._instance
+    def __init__(self):
+        self.options = client_options_from_env()
+        self.client = None
+        self.db = None
+        self._pid = None
 
     def get_db(self):
+        if self.client is None or self._pid != os.getpid():
+            mongo_url = os.getenv("MONGODB_URI")  # Cambiado para coincidir con tu .env
+            self.client = type(self)._client_factory(
+                mongo_url, event_listeners=[mongo_command_listener], **self.options
+            )
+            self.db = self.client[os.getenv("DATABASE_NAME")]
+            self._pid = os.getpid()
         return self.db
 
+    async def connect(self):
+        """Comprueba la conexión, crea colecciones e índices y precalienta el pool. Se llama al iniciar la app."""
+        await self.ping()
+        logger.info("Conexión a MongoDB Atlas exitosa.")
+        await self.ensure_collections()
+        await self.warmup()
+
+    async def ping(self, timeout: float = None):
+        self.get_db()
+        command = self.client.admin.command("ping")
+        if timeout is None:
+            return await command
+        return await asyncio.wait_for(command, timeout)
+
+    async def warmup(self):
+        """Abre `minPoolSize` conexiones por adelantado con pings concurrentes."""
+        connections = self.options.get("minPoolSize", 0)
+        if connections:
+            await asyncio.gather(*(self.client.admin.command("ping") for _ in range(connections)))
+            logger.info("Pool de MongoDB precalentado con %d conexiones.", connections)
+
+    async def is_ready(self, timeout: float = 1.0) -> bool:
+        try:
+            await self.ping(timeout=timeout)
+            return True
+        except (PyMongoError, asyncio.TimeoutError):
+            return False
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
     async def ensure_collections(self):
         """Verifica y crea las colecciones necesarias."""
+        self.get_db()
         existing_collections = await self.db.list_collection_names()
 
         # Crear colección "products" si no existe
         if "products" not in existing_collections:
             await self.db.create_collection("products")
-            print("Colección 'products' creada.")
+            logger.info("Colección 'products' creada.")
 
         # Crear colección "carts" si no existe
         if "carts" not in existing_collections:
             await self.db.create_collection("carts")
-            print("Colección 'carts' creada.")
+            logger.info("Colección 'carts' creada.")
 
-        # Crear índices en las colecciones
-        await self.db.products.create_index("category")
-        await self.db.carts.create_index("user_id")
-        print("Índices creados en 'products' y 'carts'.")
+        # Crear y reconciliar los índices declarados por los repositorios
+        await reconcile_indexes(self.db)
+        logger.info("Índices reconciliados.")
@@ -0,0 +1,75 @@
+import os
+from typing import Optional
+from fastapi import Request
+
+from app.auth.passwords import PasswordHasher
+from app.cache import ProductCache
+from app.database import MongoDBConnection
+from app.repositories.cart_buffer import WriteBehindCarts
+from app.repositories.cart_repository import CartRepository
+from app.repositories.facet_repository import CategoryFacetRepository
+from app.repositories.inventory_repository import StripedInventoryRepository
+from app.repositories.order_repository import OrderRepository
+from app.repositories.product_repository import ProductRepository
+from app.repositories.reservation_repository import ReservationRepository
+from app.repositories.user_repository import UserRepository
+from app.services.order_processor import OrderProcessor
+
+
+def init_app_state(app, connection: MongoDBConnection):
+    """Crea los repositorios del proceso sobre la conexión y los guarda en `app.state`. Se llama desde el lifespan."""
+    db = connection.get_db()
+    product_cache = ProductCache.from_env()
+    reservations = None
+    if os.getenv("STOCK_RESERVATIONS_ENABLED", "true").lower() not in ("0", "false", "no"):
+        reservations = ReservationRepository(db)
+    inventory = None
+    if os.getenv("STRIPED_INVENTORY_ENABLED", "false").lower() == "true":
+        inventory = StripedInventoryRepository(db, reservations=reservations)
+    cart_buffer = None
+    if os.getenv("CART_WRITE_BEHIND_ENABLED", "false").lower() == "true":
+        cart_buffer = WriteBehindCarts(db[CartRepository.COLLECTION])
+    facets = None
+    if os.getenv("CATEGORY_FACETS_ENABLED", "true").lower() not in ("0", "false", "no"):
+        facets = CategoryFacetRepository(db)
+    orders = None
+    if os.getenv("CHECKOUT_MODE", "sync").lower() == "async":
+        orders = OrderRepository(db)
+    app.state.db_connection = connection
+    app.state.product_cache = product_cache
+    app.state.reservation_repo = reservations
+    app.state.inventory_repo = inventory
+    app.state.cart_buffer = cart_buffer
+    app.state.facet_repo = facets
+    app.state.order_repo = orders
+    app.state.product_repo = ProductRepository(db, cache=product_cache, inventory=inventory, facets=facets)
+    app.state.cart_repo = CartRepository(db, product_cache=product_cache, reservations=reservations,
+                                         inventory=inventory, buffer=cart_buffer, facets=facets, orders=orders)
+    app.state.order_processor = OrderProcessor(app.state.cart_repo, orders) if orders else None
+    app.state.user_repo = UserRepository(db)
+    # El pool de bcrypt es del lifespan: se cierra al apagar y se vuelve a crear en el siguiente arranque
+    app.state.password_hasher = PasswordHasher.from_env()
+
+
+def get_db_connection(request: Request) -> MongoDBConnection:
+    return request.app.state.db_connection
+
+
+def get_product_repository(request: Request) -> ProductRepository:
+    return request.app.state.product_repo
+
+
+def get_cart_repository(request: Request) -> CartRepository:
+    return request.app.state.cart_repo
+
+
+def get_user_repository(request: Request) -> UserRepository:
+    return request.app.state.user_repo
+
+
+def get_password_hasher(request: Request) -> PasswordHasher:
+    return request.app.state.password_hasher
+
+
+def get_order_repository(request: Request) -> Optional[OrderRepository]:
+    return request.app.state.order_repo
@@ -0,0 +1,98 @@
+import gzip
+import hashlib
+import os
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from fastapi import Request
+from fastapi.responses import Response
+
+from app.serialization import dumps
+
+load_dotenv()
+
+CATALOG_MAX_AGE_SECONDS = int(os.getenv("CATALOG_CACHE_MAX_AGE_SECONDS", "10"))
+# Por debajo de este tamaño comprimir no compensa
+GZIP_MIN_SIZE = int(os.getenv("CATALOG_GZIP_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("CATALOG_GZIP_LEVEL", "6"))
+
+
+@dataclass
+class SerializedResponse:
+    """Cuerpo JSON ya serializado (y comprimido si conviene) de un listado, con sus validadores HTTP."""
+    body: bytes
+    gzip_body: Optional[bytes]
+    etag: str
+    last_modified: datetime
+    headers: Dict[str, str]
+
+    @classmethod
+    def build(cls, content, headers: Optional[Dict[str, str]] = None) -> "SerializedResponse":
+        headers = headers or {}
+        body = dumps(content)
+        digest = hashlib.blake2b(body, digest_size=16)
+        # Las cabeceras forman parte de la representación (por ejemplo `X-Next-Cursor`)
+        for name, value in sorted(headers.items()):
+            digest.update(f"\n{name}:{value}".encode())
+        gzip_body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0) if len(body) >= GZIP_MIN_SIZE else None
+        return cls(
+            body=body,
+            gzip_body=gzip_body,
+            etag=f'"{digest.hexdigest()}"',
+            # Cota superior de la última modificación del contenido; HTTP usa resolución de segundos
+            last_modified=datetime.now(timezone.utc).replace(microsecond=0),
+            headers=headers,
+        )
+
+
+def _gzip_etag(etag: str) -> str:
+    # Cada codificación es una representación distinta y necesita su propio ETag fuerte
+    return etag[:-1] + '-gzip"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match usa comparación débil: se ignora el prefijo `W/`
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates or _gzip_etag(etag) in candidates
+
+
+def _not_modified(request: Request, cached: SerializedResponse) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, cached.etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return cached.last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def conditional_response(request: Request, cached: SerializedResponse,
+                         max_age: int = CATALOG_MAX_AGE_SECONDS) -> Response:
+    """
+    Responde `304 Not Modified` si el cliente ya tiene la representación actual; si no, devuelve
+    los bytes ya serializados, comprimidos con gzip cuando el cliente lo acepta.
+    """
+    use_gzip = cached.gzip_body is not None and "gzip" in request.headers.get("accept-encoding", "")
+    headers = {
+        "ETag": _gzip_etag(cached.etag) if use_gzip else cached.etag,
+        "Last-Modified": format_datetime(cached.last_modified, usegmt=True),
+        "Cache-Control": f"public, max-age={max_age}",
+        "Vary": "Accept-Encoding",
+    }
+    if _not_modified(request, cached):
+        return Response(status_code=304, headers=headers)
+
+    headers.update(cached.headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(cached.gzip_body, media_type="application/json", headers=headers)
+    return Response(cached.body, media_type="application/json", headers=headers)
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from typing import Iterable, List
+
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+
+from app.repositories.cart_repository import CartRepository
+from app.repositories.facet_repository import CategoryFacetRepository
+from app.repositories.inventory_repository import StripedInventoryRepository
+from app.repositories.order_repository import OrderRepository
+from app.repositories.product_repository import ProductRepository
+from app.repositories.reservation_repository import ReservationRepository
+from app.repositories.user_repository import UserRepository
+
+logger = logging.getLogger(__name__)
+
+# Repositorios que declaran `COLLECTION`, `INDEXES` y `HOT_QUERIES`
+REPOSITORIES = (ProductRepository, CartRepository, UserRepository, ReservationRepository,
+                StripedInventoryRepository, CategoryFacetRepository, OrderRepository)
+
+
+async def reconcile_indexes(db, repositories: Iterable[type] = REPOSITORIES):
+    """
+    Crea los índices declarados por cada repositorio, de a uno para que un índice que no se puede
+    crear (por ejemplo, único sobre datos duplicados) no impida crear los demás. Si ya existe un
+    índice con el mismo nombre pero distintas opciones (por ejemplo, sin `unique`), se reemplaza
+    con `_replace_index()`, que nunca deja la colección sin el índice anterior si el nuevo falla.
+    Los índices listados en `RETIRED_INDEXES` se eliminan.
+    """
+    for repository in repositories:
+        collection = db[repository.COLLECTION]
+        existing = await collection.index_information()
+        declared_names = set()
+
+        for index in repository.INDEXES:
+            spec = index.document
+            declared_names.add(spec["name"])
+            current = existing.get(spec["name"])
+            if current is None:
+                await _create_index(collection, index)
+            elif not _same_index(current, spec):
+                await _replace_index(collection, index, current)
+
+        for name in getattr(repository, "RETIRED_INDEXES", ()):
+            if name in existing:
+                await collection.drop_index(name)
+                logger.info("Índice retirado '%s' de '%s' eliminado.", name, repository.COLLECTION)
+
+        unmanaged = set(existing) - declared_names - set(getattr(repository, "RETIRED_INDEXES", ())) - {"_id_"}
+        if unmanaged:
+            logger.warning("Índices no declarados en '%s': %s", repository.COLLECTION, ", ".join(sorted(unmanaged)))
+
+
+async def _create_index(collection, index: IndexModel) -> bool:
+    try:
+        await collection.create_indexes([index])
+        return True
+    except OperationFailure as err:
+        logger.error("No se pudo crear el índice '%s' de '%s': %s", index.document["name"], collection.name, err)
+        return False
+
+
+async def _replace_index(collection, index: IndexModel, current: dict):
+    """
+    MongoDB no admite dos índices con las mismas claves que solo difieren en sus opciones, así que
+    el nuevo no se puede crear antes de eliminar el anterior. Por eso, antes de eliminarlo se
+    comprueba que los datos no tengan duplicados que impidan crear un índice único, y si aun así
+    la creación falla, se vuelve a crear el índice anterior.
+    """
+    spec = index.document
+    if spec.get("unique") and await _has_duplicates(collection, spec):
+        logger.error("El índice '%s' de '%s' no se hizo único: hay documentos duplicados. Se mantiene el anterior.",
+                     spec["name"], collection.name)
+        return
+
+    await collection.drop_index(spec["name"])
+    if await _create_index(collection, index):
+        logger.info("Índice '%s' de '%s' recreado con nuevas opciones.", spec["name"], collection.name)
+        return
+
+    await collection.create_indexes([_index_from_info(spec["name"], current)])
+    logger.error("Se restauró el índice anterior '%s' de '%s'.", spec["name"], collection.name)
+
+
+async def _has_duplicates(collection, spec: dict) -> bool:
+    """Indica si algún valor de las claves de `spec` se repite entre los documentos que el índice incluiría."""
+    fields = list(spec["key"])
+    pipeline = []
+    if spec.get("partialFilterExpression"):
+        pipeline.append({"$match": spec["partialFilterExpression"]})
+    if spec.get("sparse"):
+        pipeline.append({"$match": {"$or": [{field: {"$exists": True}} for field in fields]}})
+    pipeline += [
+        # Las claves del `_id` de `$group` no pueden llevar puntos: se usan posiciones
+        {"$group": {"_id": {f"k{position}": f"${field}" for position, field in enumerate(fields)},
+                    "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": 1},
+    ]
+    return bool(await collection.aggregate(pipeline).to_list(length=1))
+
+
+def _index_from_info(name: str, info: dict) -> IndexModel:
+    """Reconstruye un `IndexModel` a partir de su entrada en `index_information()`."""
+    options = {key: value for key, value in info.items() if key not in ("key", "v", "ns")}
+    return IndexModel(list(info["key"]), name=name, **options)
+
+
+def _same_keys(current: dict, spec: dict) -> bool:
+    text_fields = {field for field, kind in spec["key"].items() if kind == "text"}
+    if text_fields:
+        # MongoDB guarda los índices de texto como `_fts`/`_ftsx`, con los campos en `weights`
+        return set(current.get("weights", {})) == text_fields
+    return list(current["key"]) == list(spec["key"].items())
+
+
+def _same_index(current: dict, spec: dict) -> bool:
+    return (
+        _same_keys(current, spec)
+        and current.get("unique", False) == spec.get("unique", False)
+        and current.get("expireAfterSeconds") == spec.get("expireAfterSeconds")
+        and current.get("partialFilterExpression") == spec.get("partialFilterExpression")
+    )
+
+
+def _plan_stages(plan) -> List[str]:
+    if isinstance(plan, dict):
+        stages = [plan["stage"]] if "stage" in plan else []
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+        return stages
+    if isinstance(plan, list):
+        return [stage for value in plan for stage in _plan_stages(value)]
+    return []
+
+
+async def find_collscans(db, repositories: Iterable[type] = REPOSITORIES) -> List[str]:
+    """
+    Ejecuta `explain()` sobre las consultas declaradas en `HOT_QUERIES` y devuelve una descripción
+    de cada una cuyo plan ganador recorre la colección completa (COLLSCAN).
+    """
+    offenders = []
+    for repository in repositories:
+        collection = db[repository.COLLECTION]
+        for query in repository.HOT_QUERIES:
+            cursor = collection.find(query["filter"])
+            if query.get("sort"):
+                cursor = cursor.sort(query["sort"])
+            explanation = await cursor.explain()
+            if "COLLSCAN" in _plan_stages(explanation["queryPlanner"]["winningPlan"]):
+                offenders.append(f"{repository.COLLECTION}: {query}")
+    return offenders
+
+
+async def _check():
+    from app.database import MongoDBConnection
+
+    connection = MongoDBConnection()
+    await connection.ensure_collections()
+    offenders = await find_collscans(connection.get_db())
+    connection.close()
+    for offender in offenders:
+        print(f"COLLSCAN en {offender}")
+    return 1 if offenders else 0
+
+
+if __name__ == "__main__":
+    # Uso: python -m app.indexes  (sale con código 1 si alguna consulta hace COLLSCAN)
+    raise SystemExit(asyncio.run(_check()))
@@ -0,0 +1,276 @@
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from pymongo import monitoring
+from starlette.routing import Match
+
+load_dotenv()
+
+logger = logging.getLogger("app.mongo")
+
+SLOW_QUERY_MS = float(os.getenv("MONGODB_SLOW_QUERY_MS", "100"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # Por serie: conteos por bucket (no acumulados), suma y total
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    bucket_labels = _labels(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                bucket_labels = _labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Registro de métricas en memoria que se expone en formato de texto de Prometheus."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[str]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[str]]):
+        """Agrega una función que produce líneas adicionales al exponer las métricas."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+def stats_collector(name: str, documentation: str, stats: Callable[[], Dict]) -> Callable[[], List[str]]:
+    """
+    Expone como gauge un diccionario de estadísticas (por ejemplo `ProductCache.stats()`).
+    Los diccionarios anidados se convierten en la etiqueta `group`.
+    """
+    def collect() -> List[str]:
+        lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+        for key, value in stats().items():
+            if isinstance(value, dict):
+                for stat, number in value.items():
+                    lines.append(f"{name}{_labels(('group', 'stat'), (key, stat))} {number}")
+            else:
+                lines.append(f"{name}{_labels(('stat',), (key,))} {value}")
+        return lines
+    return collect
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta.",
+    ("method", "route", "status"),
+))
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "Peticiones HTTP en curso por ruta.", ("method", "route"),
+))
+MONGO_COMMAND_DURATION = REGISTRY.register(Histogram(
+    "mongodb_command_duration_seconds", "Duración de los comandos de MongoDB por colección y comando.",
+    ("collection", "command"),
+))
+MONGO_COMMAND_FAILURES = REGISTRY.register(Counter(
+    "mongodb_command_failures_total", "Comandos de MongoDB fallidos por colección y comando.",
+    ("collection", "command"),
+))
+MONGO_ROUND_TRIPS_PER_REQUEST = REGISTRY.register(Histogram(
+    "mongodb_round_trips_per_request", "Comandos de MongoDB ejecutados por petición HTTP.",
+    ("route",), buckets=ROUND_TRIP_BUCKETS,
+))
+
+
+class RequestStats:
+    """Contadores de la petición en curso; el listener de comandos los actualiza desde los hilos de Motor."""
+
+    def __init__(self):
+        self.round_trips = 0
+
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Mide la duración de cada comando de MongoDB y registra los que superan `MONGODB_SLOW_QUERY_MS`."""
+
+    def __init__(self, slow_query_ms: float = SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+        self._pending: Dict[tuple, str] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.database_name
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = collection
+
+        stats = _current_request.get()
+        if stats is not None:
+            stats.round_trips += 1
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finish(event, failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool):
+        with self._lock:
+            collection = self._pending.pop((event.connection_id, event.request_id), None)
+        if collection is None:
+            return
+
+        seconds = event.duration_micros / 1_000_000
+        MONGO_COMMAND_DURATION.observe(seconds, collection=collection, command=event.command_name)
+        if failed:
+            MONGO_COMMAND_FAILURES.inc(collection=collection, command=event.command_name)
+
+        # Sin el cuerpo del comando: filtros y documentos pueden llevar emails o hashes de contraseñas
+        if seconds * 1000 >= self.slow_query_ms:
+            logger.warning(
+                "Consulta lenta: %s.%s %.1f ms (request_id=%s)",
+                collection, event.command_name, seconds * 1000, event.request_id,
+            )
+
+
+mongo_command_listener = MongoCommandListener()
+
+
+def route_template(router, scope) -> str:
+    """Plantilla de la ruta que atiende la petición (`/products/{category}`), para acotar la cardinalidad."""
+    for route in router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Middleware ASGI que mide la latencia, las peticiones en curso y los round trips a MongoDB por ruta."""
+
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(self.router, scope)
+        status_code = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        HTTP_REQUESTS_IN_FLIGHT.inc(method=method, route=route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - started, method=method, route=route, status=status_code[0]
+            )
+            MONGO_ROUND_TRIPS_PER_REQUEST.observe(stats.round_trips, route=route)
+            HTTP_REQUESTS_IN_FLIGHT.dec(method=method, route=route)
+            _current_request.reset(token)
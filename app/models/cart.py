@@ -4,7 +4,7 @@ from typing import Optional, List
 
 class CartItem(BaseModel):
     product_id: str
-    quantity: int
+    quantity: int = Field(gt=0)
     name: Optional[str] = None
     price: Optional[float] = None
     category: Optional[str] = None
@@ -17,3 +17,7 @@ class CartItem(BaseModel):
 class Cart(BaseModel):
     user_id: str
     items: List[CartItem]
+
+
+class CartItemQuantity(BaseModel):
+    quantity: int = Field(ge=0)
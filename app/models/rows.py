@@ -0,0 +1,41 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+# Representaciones internas de las filas de los caminos de lectura con mucho volumen. Ocupan
+# bastante menos memoria que un dict o un modelo Pydantic por fila; `app.serialization.dumps`
+# las serializa con `to_json()` si la definen o campo por campo, y los modelos de `product.py` y
+# `cart.py` quedan para validar en el borde de la API.
+
+
+@dataclass(frozen=True)
+class ProductRow:
+    """
+    Producto de un listado, con los campos de `Product`. Inmutable: se comparte desde el cache.
+    El campo se llama `id` (los campos con `_` inicial no se serializan) y se emite como `_id`.
+    """
+    __slots__ = ("id", "name", "category", "price", "stock")
+    id: str
+    name: str
+    category: str
+    price: float
+    stock: int
+
+    @classmethod
+    def from_document(cls, document: dict) -> "ProductRow":
+        return cls(document["_id"], document["name"], document["category"], document["price"], document["stock"])
+
+    def to_json(self) -> dict:
+        return {"_id": self.id, "name": self.name, "category": self.category, "price": self.price,
+                "stock": self.stock}
+
+
+@dataclass
+class CartLine:
+    """Línea de un carrito hidratada con los datos del producto, con los campos de `CartItem`."""
+    __slots__ = ("product_id", "quantity", "name", "price", "category")
+    product_id: str
+    quantity: int
+    name: Optional[str]
+    price: Optional[float]
+    category: Optional[str]
@@ -8,11 +8,20 @@ class User(BaseModel):
     name: str
     email: EmailStr
     hashed_password: str
+    token_version: int = 0
 
     class Config:
         populate_by_name = True
 
 
+class TokenUser(BaseModel):
+    """Usuario reconstruido solo a partir de los claims del JWT, sin consultar la base de datos."""
+    id: str
+    name: str
+    email: EmailStr
+    token_version: int = 0
+
+
 class UserCreate(BaseModel):
     name: str
     email: EmailStr
@@ -0,0 +1,178 @@
+import json
+import logging
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from app.auth.auth import decode_token
+from app.metrics import REGISTRY, Counter, Gauge, route_template
+from app.serialization import MongoJSONResponse
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MAX_TRACKED_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+TRUST_FORWARDED_FOR = os.getenv("RATE_LIMIT_TRUST_FORWARDED_FOR", "false").lower() == "true"
+
+RATE_LIMIT_REJECTIONS = REGISTRY.register(Counter(
+    "rate_limit_rejections_total", "Peticiones rechazadas por límite de tasa (429) o de concurrencia (503).",
+    ("route", "reason"),
+))
+ROUTE_CONCURRENCY = REGISTRY.register(Gauge(
+    "rate_limit_route_concurrency", "Peticiones en curso en las rutas con límite de concurrencia.", ("route",),
+))
+
+
+@dataclass
+class RouteLimit:
+    """Presupuesto de una ruta: `per_minute` peticiones por cliente con ráfagas de hasta `burst`,
+    y como mucho `max_concurrency` peticiones simultáneas en el proceso (`None` sin límite)."""
+    per_minute: float
+    burst: int
+    max_concurrency: Optional[int] = None
+
+
+# Claves "MÉTODO plantilla", como las etiquetas de `/metrics`
+DEFAULT_LIMITS: Dict[str, RouteLimit] = {
+    "POST /login": RouteLimit(per_minute=10, burst=5, max_concurrency=16),
+    "POST /register": RouteLimit(per_minute=5, burst=3, max_concurrency=8),
+    "POST /checkout": RouteLimit(per_minute=30, burst=10, max_concurrency=64),
+    "GET /orders/{order_id}": RouteLimit(per_minute=120, burst=30),
+    "GET /products": RouteLimit(per_minute=300, burst=60, max_concurrency=128),
+    "GET /products/{category}": RouteLimit(per_minute=300, burst=60, max_concurrency=128),
+    "GET /products/search": RouteLimit(per_minute=120, burst=30, max_concurrency=64),
+}
+
+
+def limits_from_env() -> Dict[str, RouteLimit]:
+    """
+    Presupuestos por defecto, sobrescritos por `RATE_LIMIT_RULES` (JSON), por ejemplo
+    `{"POST /login": {"per_minute": 20, "burst": 10, "max_concurrency": 8}}`.
+    """
+    limits = dict(DEFAULT_LIMITS)
+    rules = os.getenv("RATE_LIMIT_RULES")
+    if rules:
+        for route, rule in json.loads(rules).items():
+            limits[route] = RouteLimit(**rule)
+    return limits
+
+
+class RateLimitBackend(ABC):
+    """
+    Almacén de los buckets de tokens. `InMemoryRateLimitBackend` es local al proceso; un almacén
+    compartido entre workers (por ejemplo Redis) debe implementar `take` de forma atómica.
+    """
+
+    @abstractmethod
+    async def take(self, key: str, per_minute: float, burst: int) -> Tuple[bool, float]:
+        """Consume un token del bucket `key`. Devuelve si se permitió y, si no, los segundos de espera."""
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """Buckets de tokens en memoria, acotados a `max_keys` (se descartan los menos usados)."""
+
+    def __init__(self, max_keys: int = MAX_TRACKED_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    async def take(self, key: str, per_minute: float, burst: int) -> Tuple[bool, float]:
+        now = time.monotonic()
+        rate = per_minute / 60
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(burst), now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True, 0.0
+        return False, (1 - bucket[0]) / rate
+
+
+class RateLimitMiddleware:
+    """
+    Middleware ASGI de admisión para las rutas costosas. Cada cliente (el usuario del token JWT o,
+    sin token, la IP) tiene un bucket de tokens por ruta y recibe `429` al agotarlo. Además, cada
+    ruta admite como mucho `max_concurrency` peticiones simultáneas en el proceso: las que exceden
+    reciben `503` de inmediato en lugar de esperar en cola.
+    """
+
+    def __init__(self, app, router, backend: Optional[RateLimitBackend] = None,
+                 limits: Optional[Dict[str, RouteLimit]] = None):
+        self.app = app
+        self.router = router
+        self.backend = backend or InMemoryRateLimitBackend()
+        self.limits = limits if limits is not None else limits_from_env()
+        self._in_flight: Dict[str, int] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = f"{scope['method']} {route_template(self.router, scope)}"
+        limit = self.limits.get(route)
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        allowed, retry_after = await self.backend.take(f"{route}|{self._client_key(scope)}",
+                                                       limit.per_minute, limit.burst)
+        if not allowed:
+            RATE_LIMIT_REJECTIONS.inc(route=route, reason="rate")
+            await self._reject(scope, receive, send, 429, "Demasiadas peticiones, intenta más tarde.",
+                               retry_after)
+            return
+
+        if limit.max_concurrency is None:
+            await self.app(scope, receive, send)
+            return
+
+        if self._in_flight.get(route, 0) >= limit.max_concurrency:
+            RATE_LIMIT_REJECTIONS.inc(route=route, reason="concurrency")
+            await self._reject(scope, receive, send, 503, "Servicio saturado, intenta más tarde.", 1)
+            return
+
+        self._in_flight[route] = self._in_flight.get(route, 0) + 1
+        ROUTE_CONCURRENCY.inc(route=route)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self._in_flight[route] -= 1
+            ROUTE_CONCURRENCY.dec(route=route)
+
+    @staticmethod
+    def _client_key(scope) -> str:
+        headers = dict(scope.get("headers") or [])
+        authorization = headers.get(b"authorization", b"").decode("latin-1")
+        if authorization.lower().startswith("bearer "):
+            try:
+                return "user:" + decode_token(authorization[7:])["sub"]
+            except HTTPException:
+                # Token inválido: se limita por IP y la ruta responderá 401
+                pass
+        if TRUST_FORWARDED_FOR and b"x-forwarded-for" in headers:
+            return "ip:" + headers[b"x-forwarded-for"].decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return "ip:" + (client[0] if client else "unknown")
+
+    @staticmethod
+    async def _reject(scope, receive, send, status_code: int, detail: str, retry_after: float):
+        response = MongoJSONResponse(
+            {"detail": detail}, status_code=status_code,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+        await response(scope, receive, send)
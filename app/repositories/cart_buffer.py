@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SECONDS = float(os.getenv("CART_WRITE_BEHIND_FLUSH_SECONDS", "2"))
+MAX_DIRTY_CARTS = int(os.getenv("CART_WRITE_BEHIND_MAX_DIRTY", "1000"))
+MAX_BUFFERED_CARTS = int(os.getenv("CART_WRITE_BEHIND_MAX_CARTS", "50000"))
+# `buffered`: los cambios se persisten en lote; `write-through`: cada cambio se persiste antes de responder
+DURABILITY = os.getenv("CART_WRITE_BEHIND_DURABILITY", "buffered").lower()
+DURABILITY_MODES = ("buffered", "write-through")
+
+
+class CartWriteError(Exception):
+    """En modo `write-through`, el cambio del carrito no se pudo persistir y se descartó."""
+
+
+@dataclass
+class BufferedCart:
+    """Líneas de un carrito en memoria. `version` cuenta los cambios; `flushed_version` el último persistido."""
+    items: List[dict] = field(default_factory=list)
+    version: int = 0
+    flushed_version: int = 0
+
+    @property
+    def dirty(self) -> bool:
+        return self.version != self.flushed_version
+
+
+class CartStore(ABC):
+    """
+    Almacén de los carritos en buffer. Las operaciones son síncronas para que cada modificación
+    sea atómica dentro del event loop; un store compartido entre procesos debe ofrecer la misma
+    garantía por usuario.
+    """
+
+    @abstractmethod
+    def get(self, user_id: str) -> Optional[BufferedCart]:
+        ...
+
+    @abstractmethod
+    def put(self, user_id: str, cart: BufferedCart) -> BufferedCart:
+        """Guarda el carrito si no había uno y devuelve el que quedó almacenado."""
+
+    @abstractmethod
+    def discard(self, user_id: str):
+        ...
+
+    @abstractmethod
+    def over_capacity(self) -> bool:
+        ...
+
+    @abstractmethod
+    def evict_clean(self):
+        """Descarta carritos ya persistidos si el store superó su capacidad."""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+
+class InMemoryCartStore(CartStore):
+    """Store en proceso acotado a `max_carts`; descarta primero los carritos limpios menos usados."""
+
+    def __init__(self, max_carts: int = MAX_BUFFERED_CARTS):
+        self.max_carts = max_carts
+        self._carts: "OrderedDict[str, BufferedCart]" = OrderedDict()
+
+    def get(self, user_id: str) -> Optional[BufferedCart]:
+        cart = self._carts.get(user_id)
+        if cart is not None:
+            self._carts.move_to_end(user_id)
+        return cart
+
+    def put(self, user_id: str, cart: BufferedCart) -> BufferedCart:
+        return self._carts.setdefault(user_id, cart)
+
+    def discard(self, user_id: str):
+        self._carts.pop(user_id, None)
+
+    def over_capacity(self) -> bool:
+        return len(self._carts) > self.max_carts
+
+    def evict_clean(self):
+        excess = len(self._carts) - self.max_carts
+        if excess <= 0:
+            return
+        for user_id in [user_id for user_id, cart in self._carts.items() if not cart.dirty][:excess]:
+            del self._carts[user_id]
+
+    def __len__(self) -> int:
+        return len(self._carts)
+
+
+class WriteBehindCarts:
+    """
+    Buffer de escritura diferida de carritos. Las modificaciones se aplican en memoria y los
+    carritos modificados se persisten en lote con un único `bulk_write` por ciclo del flusher,
+    o antes si se acumulan `max_dirty` carritos pendientes. Un cambio puede perderse si el
+    proceso termina de forma abrupta antes del siguiente flush (como mucho `flush_interval`).
+
+    Con `durability="write-through"` cada cambio se persiste antes de confirmarse: el buffer solo
+    ahorra las lecturas del carrito. En ambos modos el checkout persiste antes el carrito del usuario.
+    """
+
+    def __init__(self, collection, store: Optional[CartStore] = None,
+                 flush_interval: float = FLUSH_INTERVAL_SECONDS, max_dirty: int = MAX_DIRTY_CARTS,
+                 durability: str = DURABILITY):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"CART_WRITE_BEHIND_DURABILITY debe ser uno de {', '.join(DURABILITY_MODES)}")
+        self.collection = collection
+        self.durability = durability
+        self.store = store or InMemoryCartStore()
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        self._flush_lock = asyncio.Lock()
+        # Usuarios con cambios sin persistir, en orden de llegada
+        self._pending: Dict[str, None] = {}
+        self._started = time.monotonic()
+        self.mutations = 0
+        self.writes = 0
+        self.flushes = 0
+
+    async def get_items(self, user_id: str) -> List[dict]:
+        """Líneas actuales del carrito; se cargan de MongoDB la primera vez."""
+        cart = await self._load(user_id)
+        return [dict(item) for item in cart.items]
+
+    def peek_items(self, user_id: str) -> Optional[List[dict]]:
+        """Líneas del carrito si está en memoria, o `None` si hay que leerlo de MongoDB. No hace I/O."""
+        cart = self.store.get(user_id)
+        return [dict(item) for item in cart.items] if cart is not None else None
+
+    async def modify(self, user_id: str, change: Callable[[List[dict]], bool]) -> bool:
+        """
+        Aplica `change` a las líneas del carrito. `change` es síncrona, de modo que ninguna otra
+        modificación del mismo carrito se intercala; devuelve si el carrito cambió.
+
+        En modo `buffered` el cambio queda aplicado aunque falle un flush forzado: el carrito sigue
+        pendiente y el flusher lo reintenta. En modo `write-through`, si no se puede persistir, el
+        carrito se descarta de memoria (vuelve a leerse de MongoDB) y se lanza `CartWriteError`.
+        """
+        cart = await self._load(user_id)
+        changed = change(cart.items)
+        if not changed:
+            return False
+        cart.version += 1
+        self.mutations += 1
+        self._pending[user_id] = None
+
+        if self.durability == "write-through":
+            version = cart.version
+            try:
+                await self.flush(user_id)
+            except Exception as error:
+                self.discard(user_id)
+                raise CartWriteError(f"No se pudo guardar el carrito de {user_id}") from error
+            if cart.flushed_version < version:
+                # Otra modificación del mismo carrito falló y lo descartó junto con este cambio
+                raise CartWriteError(f"No se pudo guardar el carrito de {user_id}")
+        elif len(self._pending) >= self.max_dirty or self.store.over_capacity():
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Error al persistir los carritos en buffer; se reintenta en el próximo flush")
+        return True
+
+    def discard(self, user_id: str):
+        """Olvida el carrito en memoria, con sus cambios pendientes; el siguiente acceso lo lee de MongoDB."""
+        self.store.discard(user_id)
+        self._pending.pop(user_id, None)
+
+    async def flush(self, user_id: Optional[str] = None) -> int:
+        """Persiste los carritos pendientes (solo el de `user_id` si se indica). Devuelve cuántos escribió."""
+        async with self._flush_lock:
+            user_ids = list(self._pending) if user_id is None else [user_id]
+            pending = []
+            for pending_id in user_ids:
+                cart = self.store.get(pending_id)
+                if cart is not None and cart.dirty:
+                    pending.append((pending_id, cart))
+                else:
+                    self._pending.pop(pending_id, None)
+            if not pending:
+                return 0
+
+            # Se fija la versión de cada carrito antes de escribir: si cambia durante el
+            # `bulk_write`, sigue pendiente para el próximo flush
+            snapshot = [(pending_id, cart, cart.version, [dict(item) for item in cart.items])
+                        for pending_id, cart in pending]
+            await self.collection.bulk_write([
+                UpdateOne({"user_id": pending_id}, {"$set": {"items": items}}, upsert=True)
+                for pending_id, _, _, items in snapshot
+            ], ordered=False)
+            for pending_id, cart, version, _ in snapshot:
+                cart.flushed_version = max(cart.flushed_version, version)
+                if not cart.dirty:
+                    self._pending.pop(pending_id, None)
+            self.writes += len(snapshot)
+            self.flushes += 1
+            self.store.evict_clean()
+            return len(snapshot)
+
+    async def run_flusher(self):
+        """Tarea de fondo que persiste periódicamente los carritos modificados."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error al persistir los carritos en buffer")
+
+    def stats(self) -> Dict[str, float]:
+        saved = self.mutations - self.writes
+        elapsed = time.monotonic() - self._started
+        return {
+            "buffered_carts": len(self.store),
+            "dirty_carts": len(self._pending),
+            "mutations": self.mutations,
+            "writes": self.writes,
+            "flushes": self.flushes,
+            "writes_saved": saved,
+            "writes_saved_per_second": round(saved / elapsed, 2) if elapsed else 0.0,
+        }
+
+    async def _load(self, user_id: str) -> BufferedCart:
+        cart = self.store.get(user_id)
+        if cart is None:
+            document = await self.collection.find_one({"user_id": user_id}, {"items": 1})
+            items = [{"product_id": item["product_id"], "quantity": item["quantity"]}
+                     for item in (document or {}).get("items", [])]
+            # Otra corrutina pudo cargarlo durante la lectura: se conserva la primera copia
+            cart = self.store.put(user_id, BufferedCart(items=items))
+        return cart
@@ -1,101 +1,596 @@
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
 from fastapi import HTTPException
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from app.cache import ProductCache
 from app.models.cart import CartItem, Cart
+from app.models.rows import CartLine
+from app.repositories.cart_buffer import WriteBehindCarts
+from app.repositories.facet_repository import CategoryFacetRepository
+from app.repositories.inventory_repository import StripedInventoryRepository
+from app.repositories.order_repository import OrderRepository
+from app.repositories.reservation_repository import NOT_STRIPED, ReservationRepository, available_stock_at_least
+
+
+@dataclass
+class HydrationStats:
+    """Métricas de la hidratación de un carrito: round trips a MongoDB, items y duración."""
+    round_trips: int
+    items: int
+    elapsed_ms: float
 
 
 class CartRepository:
-    def __init__(self, db):
-        self.collection = db["carts"]
+    COLLECTION = "carts"
+    # Único: evita carritos duplicados cuando dos upserts del mismo usuario compiten
+    INDEXES = [IndexModel([("user_id", ASCENDING)], name="user_id_1", unique=True)]
+    HOT_QUERIES = [{"filter": {"user_id": ""}}]
+
+    def __init__(self, db, product_cache: Optional[ProductCache] = None,
+                 reservations: Optional[ReservationRepository] = None,
+                 inventory: Optional[StripedInventoryRepository] = None,
+                 buffer: Optional[WriteBehindCarts] = None,
+                 facets: Optional[CategoryFacetRepository] = None,
+                 orders: Optional[OrderRepository] = None):
+        self.collection = db[self.COLLECTION]
         self.products_collection = db["products"]
+        self.product_cache = product_cache
+        self.reservations = reservations
+        self.inventory = inventory
+        self.buffer = buffer
+        self.facets = facets
+        self.orders = orders
 
     async def get_cart(self, user_id: str) -> Cart:
-        """Obtiene el carrito de un usuario específico con los detalles de los productos."""
-        cart_data = await self.collection.find_one({"user_id": user_id})
-        if not cart_data:
-            # Retornar un carrito vacío si no existe en la base de datos
-            return Cart(user_id=user_id, items=[])
-
-        # Si el carrito existe, procesamos los items con detalles del producto
-        items_with_details = []
-        for item in cart_data.get("items", []):
-            product_data = await self.products_collection.find_one({"_id": ObjectId(item["product_id"])})
-            if not product_data:
-                continue  # Ignorar productos que ya no existen
-            items_with_details.append(
-                CartItem(
-                    product_id=item["product_id"],
-                    quantity=item["quantity"],
-                    name=product_data.get("name"),
-                    price=product_data.get("price"),
-                    category=product_data.get("category")
+        """Obtiene el carrito de un usuario específico con los detalles de los productos (líneas `CartLine`)."""
+        cart, _ = await self.get_cart_with_stats(user_id)
+        return cart
+
+    async def get_cart_with_stats(self, user_id: str) -> Tuple[Cart, HydrationStats]:
+        """
+        Obtiene el carrito hidratado en un único round trip mediante `$lookup`
+        y devuelve además las métricas de la consulta, con los round trips realmente ejecutados.
+        """
+        started = time.perf_counter()
+        # Las líneas en memoria pueden ser más nuevas que las de MongoDB
+        buffered = self.buffer.peek_items(user_id) if self.buffer else None
+        if buffered is not None:
+            rows, round_trips = await self._hydrate_items(buffered)
+        else:
+            rows = await self.collection.aggregate(self._hydration_pipeline(user_id)).to_list(length=None)
+            round_trips = 1
+
+        # Los productos que ya no existen se descartan en el `$unwind` del pipeline; las filas ya
+        # tienen la forma de `CartItem`, así que se guardan como `CartLine` sin validarlas
+        items_with_details = [CartLine(**row) for row in rows]
+        stats = HydrationStats(
+            round_trips=round_trips,
+            items=len(items_with_details),
+            elapsed_ms=(time.perf_counter() - started) * 1000,
+        )
+        return Cart.model_construct(user_id=user_id, items=items_with_details), stats
+
+    @staticmethod
+    def _hydration_pipeline(user_id: str) -> list:
+        """Pipeline que une los items del carrito con su producto conservando el orden original."""
+        return [
+            {"$match": {"user_id": user_id}},
+            {"$unwind": {"path": "$items", "includeArrayIndex": "position"}},
+            {"$lookup": {
+                "from": "products",
+                "let": {"product_oid": {"$convert": {
+                    "input": "$items.product_id", "to": "objectId", "onError": None, "onNull": None
+                }}},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$_id", "$$product_oid"]}}},
+                    {"$project": {"_id": 0, "name": 1, "price": 1, "category": 1}},
+                ],
+                "as": "product",
+            }},
+            {"$unwind": "$product"},
+            {"$sort": {"position": 1}},
+            {"$project": {
+                "_id": 0,
+                "product_id": "$items.product_id",
+                "quantity": "$items.quantity",
+                "name": "$product.name",
+                "price": "$product.price",
+                "category": "$product.category",
+            }},
+        ]
+
+    async def _hydrate_items(self, items: List[dict]) -> Tuple[List[dict], int]:
+        """
+        Une líneas de carrito en memoria con sus productos en una sola consulta, como el pipeline.
+        Devuelve las filas y los round trips ejecutados (ninguno si no hay ids válidos).
+        """
+        product_ids = []
+        for item in items:
+            try:
+                product_ids.append(ObjectId(item["product_id"]))
+            except (InvalidId, TypeError):
+                continue
+        if not product_ids:
+            return [], 0
+        products = await self.products_collection.find(
+            {"_id": {"$in": product_ids}}, {"name": 1, "price": 1, "category": 1}
+        ).to_list(length=None)
+        by_id = {str(product["_id"]): product for product in products}
+        return [
+            {"product_id": item["product_id"], "quantity": item["quantity"], "name": product["name"],
+             "price": product["price"], "category": product["category"]}
+            for item in items
+            if (product := by_id.get(item["product_id"])) is not None
+        ], 1
+
+    @staticmethod
+    def _set_line(product_id: str, quantity: int, add: bool):
+        """
+        Cambio para el buffer: suma (`add`) o fija la cantidad de la línea. Con `add` la línea se crea
+        si no existe; al fijar la cantidad, una línea inexistente deja el carrito sin cambios.
+        """
+        def change(items: List[dict]) -> bool:
+            for line in items:
+                if line["product_id"] == product_id:
+                    line["quantity"] = line["quantity"] + quantity if add else quantity
+                    return True
+            if not add:
+                return False
+            items.append({"product_id": product_id, "quantity": quantity})
+            return True
+        return change
+
+    @staticmethod
+    def _remove_line(product_id: str):
+        def change(items: List[dict]) -> bool:
+            remaining = [line for line in items if line["product_id"] != product_id]
+            removed = len(remaining) != len(items)
+            items[:] = remaining
+            return removed
+        return change
+
+    async def add_to_cart(self, user_id: str, item: CartItem):
+        """Añade un producto al carrito de un usuario o suma la cantidad si ya existe, en una sola operación atómica."""
+        if item.quantity <= 0:
+            raise HTTPException(status_code=400, detail="La cantidad debe ser mayor que cero.")
+        if self.reservations:
+            await self.reservations.reserve(user_id, item.product_id, item.quantity)
+
+        quantity = {"$add": ["$$item.quantity", item.quantity]}
+        try:
+            if self.buffer:
+                await self.buffer.modify(user_id, self._set_line(item.product_id, item.quantity, add=True))
+            else:
+                await self._upsert_item(user_id, item.product_id, quantity, item.quantity)
+        except Exception:
+            if self.reservations:
+                await self.reservations.release(user_id, item.product_id, item.quantity)
+            raise
+
+    async def set_item_quantity(self, user_id: str, product_id: str, quantity: int) -> bool:
+        """
+        Fija la cantidad de un producto que ya está en el carrito; con cantidad 0 lo elimina.
+        Devuelve `False` si el producto no estaba en el carrito, sin agregarlo.
+        """
+        if quantity <= 0:
+            return await self.remove_item(user_id, product_id)
+        previous = await self.reservations.set_quantity(user_id, product_id, quantity) if self.reservations else 0
+
+        try:
+            if self.buffer:
+                updated = await self.buffer.modify(user_id, self._set_line(product_id, quantity, add=False))
+            else:
+                result = await self.collection.update_one(
+                    {"user_id": user_id, "items.product_id": product_id},
+                    {"$set": {"items.$.quantity": quantity}}
                 )
+                updated = result.matched_count == 1
+        except Exception:
+            if self.reservations:
+                await self.reservations.set_quantity(user_id, product_id, previous)
+            raise
+        if not updated and self.reservations:
+            # La línea no existe (o se eliminó mientras tanto): la reserva vuelve a como estaba
+            await self.reservations.set_quantity(user_id, product_id, previous)
+        return updated
+
+    async def remove_item(self, user_id: str, product_id: str) -> bool:
+        """Elimina un producto del carrito. Devuelve `False` si no estaba en el carrito."""
+        if self.buffer:
+            removed = await self.buffer.modify(user_id, self._remove_line(product_id))
+        else:
+            result = await self.collection.update_one(
+                {"user_id": user_id},
+                {"$pull": {"items": {"product_id": product_id}}}
             )
+            removed = result.modified_count > 0
+        if self.reservations:
+            await self.reservations.release(user_id, product_id)
+        return removed
 
-        return Cart(user_id=user_id, items=items_with_details)
+    async def _upsert_item(self, user_id: str, product_id: str, existing_quantity, new_quantity: int):
+        """
+        Actualiza o agrega la línea del producto con un update pipeline sobre el documento del carrito,
+        de modo que dos modificaciones concurrentes no se pisan. `existing_quantity` es la expresión
+        aplicada a la línea existente (`$$item`) y `new_quantity` la cantidad de una línea nueva.
+        """
+        items = {"$ifNull": ["$items", []]}
+        # El id llega del cliente: con `$literal` un valor que empiece por `$` no se evalúa como ruta de campo
+        product = {"$literal": product_id}
+        pipeline = [{"$set": {"items": {"$cond": [
+            {"$in": [product, {"$map": {"input": items, "as": "item", "in": "$$item.product_id"}}]},
+            {"$map": {"input": items, "as": "item", "in": {"$cond": [
+                {"$eq": ["$$item.product_id", product]},
+                {"$mergeObjects": ["$$item", {"quantity": existing_quantity}]},
+                "$$item",
+            ]}}},
+            {"$concatArrays": [items, {"$literal": [{"product_id": product_id, "quantity": new_quantity}]}]},
+        ]}}}]
 
-    async def add_to_cart(self, user_id: str, item: CartItem):
-        """Añade un producto al carrito de un usuario o actualiza la cantidad si ya existe, sin agregar detalles innecesarios."""
-        cart = await self.get_cart(user_id)
-        item_found = False
-
-        # Actualizar la cantidad si el producto ya existe en el carrito
-        for existing_item in cart.items:
-            if existing_item.product_id == item.product_id:
-                existing_item.quantity += item.quantity
-                item_found = True
-                break
-
-        # Si el producto no está en el carrito, agrégalo solo con product_id y quantity
-        if not item_found:
-            cart.items.append(CartItem(product_id=item.product_id, quantity=item.quantity))
-
-        # Guardar el carrito en la base de datos con solo product_id y quantity en cada item
-        await self.collection.update_one(
-            {"user_id": user_id},
-            {"$set": {"items": [{"product_id": item.product_id, "quantity": item.quantity} for item in cart.items]}},
-            upsert=True
-        )
+        try:
+            await self.collection.update_one({"user_id": user_id}, pipeline, upsert=True)
+        except DuplicateKeyError:
+            # Otro upsert concurrente creó el carrito primero: ahora el documento existe
+            await self.collection.update_one({"user_id": user_id}, pipeline)
 
     async def checkout(self, user_id: str):
-        """Realiza el checkout, reduce el stock de cada producto en el carrito según la cantidad y luego vacía el carrito."""
+        """
+        Realiza el checkout de forma atómica: descuenta el stock de todos los productos
+        del carrito o de ninguno, y luego vacía el carrito.
+        """
+        # Con escritura diferida, el checkout parte del carrito ya persistido
+        if self.buffer:
+            await self.buffer.flush(user_id)
+
         # Obtener el carrito del usuario
         cart = await self.get_cart(user_id)
 
         if not cart.items:
             raise HTTPException(status_code=400, detail="El carrito está vacío.")
 
-        # Procesar cada producto en el carrito
-        for item in cart.items:
-            product_id = ObjectId(item.product_id)
-            # Buscar el producto en la colección de productos usando _id
-            product = await self.products_collection.find_one({"_id": product_id})
-            if not product:
-                raise HTTPException(status_code=404, detail=f"Producto con ID {item.product_id} no encontrado.")
+        quantities = self._quantities_by_product(cart.items)
 
-            # Verificar si hay stock suficiente para la cantidad solicitada
-            if product["stock"] < item.quantity:
-                raise HTTPException(status_code=400,
-                                    detail=f"Stock insuficiente para el producto con ID {item.product_id}.")
+        # Las reservas del usuario se reclaman para que el sweeper no las libere durante el checkout
+        token, reserved = await self.reservations.claim(user_id) if self.reservations else (None, {})
+
+        async def finalize(session=None):
+            await self.collection.update_one({"user_id": user_id}, {"$set": {"items": []}}, session=session)
+            # Las reservas se confirman junto con el vaciado: un reclamo que sobrevive a una caída
+            # indica que el stock no se descontó o que sus líneas todavía llevan el token
+            if token:
+                await self.reservations.confirm(token, consumed=quantities, session=session)
+
+        try:
+            await self.apply_stock(quantities, reserved, finalize=finalize, token=token)
+        except Exception:
+            if token:
+                await self.reservations.restore(token)
+            raise
+
+        if self.buffer:
+            # El checkout vació el carrito en MongoDB: la copia en memoria ya no vale
+            self.buffer.discard(user_id)
+        await self.record_stock_change(quantities, cart.items)
+
+        return {"message": "Compra realizada con éxito y carrito vaciado."}
+
+    async def place_order(self, user_id: str, idempotency_key: Optional[str] = None) -> dict:
+        """
+        Checkout asíncrono: guarda la foto del carrito como pedido `pending`, vacía el carrito y
+        devuelve el pedido sin tocar el stock; un worker lo descuenta después. Con la misma
+        `idempotency_key` se devuelve el pedido ya creado en lugar de uno nuevo.
+
+        Sin transacciones, el pedido se crea como borrador y el carrito vaciado apunta a él
+        (`order_id`); si el proceso cae antes de publicarlo, el worker que lo toma al vencer el
+        lease lo publica o lo descarta según el carrito (ver `settle_draft()`).
+        """
+        if idempotency_key:
+            existing = await self.orders.find_by_key(user_id, idempotency_key)
+            if existing:
+                return existing
+
+        if self.buffer:
+            await self.buffer.flush(user_id)
+        cart = await self.collection.find_one({"user_id": user_id}, {"items": 1})
+        items = (cart or {}).get("items") or []
+        rows, _ = await self._hydrate_items(items)
+        lines = [CartLine(**row) for row in rows]
+        if not lines:
+            raise HTTPException(status_code=400, detail="El carrito está vacío.")
+
+        # Las reservas pasan al pedido: el sweeper ya no las libera y el worker las consume
+        token, reserved = await self.reservations.claim(user_id) if self.reservations else (None, {})
+        try:
+            if self._supports_transactions():
+                order = await self._in_transaction(lambda session: self._snapshot_order(
+                    user_id, items, lines, reserved, token, idempotency_key, session=session
+                ))
+            else:
+                order = await self._snapshot_order(user_id, items, lines, reserved, token, idempotency_key)
+        except DuplicateKeyError:
+            # Una petición concurrente con la misma clave creó el pedido primero
+            if token:
+                await self.reservations.restore(token)
+            return await self.orders.find_by_key(user_id, idempotency_key)
+        except Exception:
+            if token:
+                await self.reservations.restore(token)
+            raise
 
-            # Reducir el stock del producto en la cantidad especificada en el carrito
-            update_result = await self.products_collection.update_one(
-                {"_id": product_id},
-                {"$inc": {"stock": -item.quantity}}
+        if self.buffer:
+            self.buffer.discard(user_id)
+        if not await self.orders.release(order["_id"]) and not await self.orders.exists(order["_id"]):
+            # Un worker dio el borrador por abandonado (y devolvió las reservas) antes de que se
+            # vaciara el carrito: se le devuelven las líneas
+            await self.collection.update_one(
+                {"user_id": user_id, "order_id": order["_id"]},
+                {"$set": {"items": items}, "$unset": {"order_id": ""}}
             )
+            raise HTTPException(status_code=409, detail="El carrito cambió durante la compra, intenta de nuevo.")
+        return order
 
-            # Verificar si la reducción de stock fue exitosa
-            if update_result.modified_count == 0:
-                raise HTTPException(status_code=500,
-                                    detail=f"No se pudo actualizar el stock del producto con ID {item.product_id}.")
+    async def settle_draft(self, order: dict) -> bool:
+        """
+        Resuelve un pedido borrador que un worker tomó porque el proceso que lo creó no llegó a
+        publicarlo. Si el carrito quedó vaciado para este pedido, lo publica y devuelve `True`; si
+        no, el carrito conserva sus líneas: descarta el pedido, devuelve las reservas a `active` y
+        devuelve `False`.
+        """
+        if await self.collection.find_one({"user_id": order["user_id"], "order_id": order["_id"]}, {"_id": 1}):
+            return await self.orders.publish(order)
+        if await self.orders.discard(order) and self.reservations and order.get("reservation_token"):
+            await self.reservations.restore(order["reservation_token"])
+        return False
 
-        # Limpiar el carrito después de un checkout exitoso
-        await self.collection.update_one(
-            {"user_id": user_id},
-            {"$set": {"items": []}}
+    async def _snapshot_order(self, user_id: str, items: List[dict], lines: List[CartLine],
+                              reserved: Dict[ObjectId, int], token: Optional[str],
+                              idempotency_key: Optional[str], session=None) -> dict:
+        """Crea el pedido y vacía el carrito solo si no cambió desde que se leyó `items`."""
+        order = await self.orders.create(user_id, lines, reserved, token, idempotency_key,
+                                         draft=session is None, session=session)
+        result = await self.collection.update_one(
+            {"user_id": user_id, "items": items}, {"$set": {"items": [], "order_id": order["_id"]}}, session=session
         )
+        if result.modified_count == 0:
+            # Dentro de una transacción la excepción ya descarta el pedido
+            if session is None:
+                await self.orders.delete(order["_id"])
+            raise HTTPException(status_code=409, detail="El carrito cambió durante la compra, intenta de nuevo.")
+        return order
 
-        return {"message": "Compra realizada con éxito y carrito vaciado."}
+    async def apply_stock(self, quantities: Dict[ObjectId, int], reserved: Dict[ObjectId, int],
+                          finalize: Callable[..., Awaitable], token: Optional[str] = None,
+                          resumable: bool = False):
+        """
+        Descuenta el stock de todas las líneas o de ninguna y luego ejecuta `finalize(session=...)`
+        (vaciar el carrito, marcar un pedido como completado), dentro de la misma transacción cuando
+        MongoDB la admite. Sin transacciones, las líneas se marcan con `token` (uno nuevo si no se
+        indica) mientras dura el checkout. Con `resumable` (el id de un pedido como token), un
+        reintento tras una caída no vuelve a descontar las líneas que ya llevan ese token.
+        """
+        # Productos con el stock repartido en stripes: se descuentan aparte del `bulk_write`
+        stripes = await self._stripes(quantities)
+        try:
+            await self._apply_stock(quantities, reserved, stripes, finalize, token, resumable)
+        except HTTPException as error:
+            if error.status_code not in (400, 409) or not self.inventory:
+                raise
+            # El número de stripes está cacheado: si otro proceso acaba de repartir un producto, el
+            # descuento en su documento falla (ya no tiene stock) y se reintenta sobre sus stripes
+            fresh = await self._stripes(quantities, use_cache=False)
+            if fresh == stripes:
+                raise
+            await self._apply_stock(quantities, reserved, fresh, finalize, token, resumable)
+
+    async def _stripes(self, quantities: Dict[ObjectId, int], use_cache: bool = True) -> Dict[ObjectId, int]:
+        if not self.inventory:
+            return {}
+        counts = await self.inventory.stripe_counts(quantities, use_cache=use_cache)
+        return {product_id: count for product_id, count in counts.items() if count}
+
+    async def _apply_stock(self, quantities: Dict[ObjectId, int], reserved: Dict[ObjectId, int],
+                           stripes: Dict[ObjectId, int], finalize: Callable[..., Awaitable], token: Optional[str],
+                           resumable: bool):
+        if self._supports_transactions():
+            await self._checkout_in_transaction(quantities, reserved, stripes, finalize)
+        else:
+            await self._checkout_with_compensation(quantities, reserved, stripes, finalize, token, resumable)
+
+    async def revert_stock(self, token: str, quantities: Dict[ObjectId, int], reserved: Dict[ObjectId, int]):
+        """Devuelve el stock de las líneas que un checkout con `token` dejó descontadas."""
+        await self._revert_decrements(token, quantities, reserved)
+        for product_id in await self._stripes(quantities, use_cache=False):
+            await self.inventory.revert(product_id, token)
+
+    async def record_stock_change(self, quantities: Dict[ObjectId, int], lines: List[CartLine]):
+        """El stock de estos productos cambió: descarta las copias en cache y actualiza el resumen."""
+        if self.product_cache:
+            self.product_cache.invalidate_products(quantities)
+        if self.facets:
+            await self.facets.record(stock_deltas=CategoryFacetRepository.stock_deltas(
+                (line.category, -line.quantity) for line in lines
+            ))
+
+    @staticmethod
+    def _quantities_by_product(items: List[CartLine]) -> Dict[ObjectId, int]:
+        """Agrupa las cantidades del carrito por producto."""
+        quantities: Dict[ObjectId, int] = {}
+        for item in items:
+            product_id = ObjectId(item.product_id)
+            quantities[product_id] = quantities.get(product_id, 0) + item.quantity
+        return quantities
+
+    def _supports_transactions(self) -> bool:
+        """Las transacciones multi-documento solo están disponibles en replica sets y clusters sharded."""
+        topology = getattr(self.collection.database.client, "topology_description", None)
+        return topology is not None and topology.topology_type_name in ("ReplicaSetWithPrimary", "Sharded")
+
+    async def _in_transaction(self, callback: Callable[..., Awaitable]):
+        """
+        Ejecuta `callback(session)` en una transacción multi-documento. `with_transaction` la repite
+        completa ante errores transitorios (por ejemplo, el `WriteConflict` entre dos checkouts del
+        mismo producto) y reintenta el commit cuando su resultado es incierto.
+        """
+        client = self.collection.database.client
+        async with await client.start_session() as session:
+            return await session.with_transaction(callback)
+
+    @staticmethod
+    def _decrement(product_id: ObjectId, quantity: int, reserved: int, token: Optional[str] = None) -> UpdateOne:
+        """
+        Descuento condicional de stock: la línea solo se aplica si el stock no reservado por otros
+        carritos cubre la cantidad y el producto no está repartido en stripes. Lo reservado por este
+        carrito se convierte en descuento. Con `token`, la línea se marca con él y no se aplica si ya lo lleva.
+        """
+        query = {"_id": product_id, **NOT_STRIPED, "$expr": available_stock_at_least(quantity - reserved)}
+        update = {"$inc": {"stock": -quantity}}
+        if reserved:
+            update["$inc"]["reserved"] = -reserved
+        if token:
+            query["pending_checkouts"] = {"$ne": token}
+            update["$push"] = {"pending_checkouts": token}
+        return UpdateOne(query, update)
+
+    async def _checkout_in_transaction(self, quantities: Dict[ObjectId, int], reserved: Dict[ObjectId, int],
+                                       stripes: Dict[ObjectId, int], finalize: Callable[..., Awaitable]):
+        """Descuenta el stock y ejecuta `finalize` dentro de una transacción multi-documento."""
+        regular = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in stripes}
+        operations = [
+            self._decrement(product_id, quantity, reserved.get(product_id, 0))
+            for product_id, quantity in regular.items()
+        ]
+
+        async def run(session):
+            if operations:
+                result = await self.products_collection.bulk_write(operations, ordered=False, session=session)
+                if result.modified_count != len(operations):
+                    # Salir con excepción aborta la transacción
+                    await self._raise_stock_error(regular, reserved, session=session)
+            await self._decrement_striped(quantities, stripes, session=session)
+            await finalize(session=session)
+
+        await self._in_transaction(run)
+
+    async def _checkout_with_compensation(self, quantities: Dict[ObjectId, int], reserved: Dict[ObjectId, int],
+                                          stripes: Dict[ObjectId, int], finalize: Callable[..., Awaitable],
+                                          token: Optional[str] = None, resumable: bool = False):
+        """
+        Descuenta el stock con un único `bulk_write` condicional. Cada línea aplicada se marca
+        con un token de checkout para poder revertir exactamente esas líneas si alguna falla.
+        Con `resumable`, las líneas que ya llevan el token (de un intento anterior) cuentan como
+        aplicadas y, si `finalize` falla, las marcas se conservan para que un reintento continúe.
+        """
+        token = token or uuid.uuid4().hex
+        regular = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in stripes}
+        operations = [
+            self._decrement(product_id, quantity, reserved.get(product_id, 0), token=token)
+            for product_id, quantity in regular.items()
+        ]
+        result = await self.products_collection.bulk_write(operations, ordered=False) if operations else None
+
+        if result is not None and result.modified_count != len(operations):
+            applied = result.modified_count
+            if resumable:
+                applied = await self.products_collection.count_documents(
+                    {"_id": {"$in": list(regular)}, "pending_checkouts": token}
+                )
+            if applied != len(operations):
+                await self._revert_decrements(token, regular, reserved)
+                await self._raise_stock_error(regular, reserved)
+
+        try:
+            await self._decrement_striped(quantities, stripes, token=token, resumable=resumable)
+        except HTTPException:
+            await self._revert_decrements(token, regular, reserved)
+            raise
+
+        try:
+            await finalize(session=None)
+        except Exception:
+            if not resumable:
+                await self._clear_token(token, quantities)
+            raise
+        await self._clear_token(token, quantities)
+
+    async def _clear_token(self, token: str, product_ids: Iterable[ObjectId]):
+        """Quita el token de checkout de las líneas ya confirmadas, acotado por `_id` a los productos del checkout."""
+        product_ids = list(product_ids)
+        await self.products_collection.update_many(
+            {"_id": {"$in": product_ids}, "pending_checkouts": token},
+            {"$pull": {"pending_checkouts": token}}
+        )
+        if self.inventory:
+            await self.inventory.clear(token, product_ids)
+
+    async def _revert_decrements(self, token: str, quantities: Dict[ObjectId, int], reserved: Dict[ObjectId, int]):
+        """Revierte solo las líneas que llevan el token de este checkout."""
+        if not quantities:
+            return
+        await self.products_collection.bulk_write([
+            UpdateOne(
+                {"_id": product_id, "pending_checkouts": token},
+                {"$inc": {"stock": quantity, "reserved": reserved.get(product_id, 0)},
+                 "$pull": {"pending_checkouts": token}},
+            )
+            for product_id, quantity in quantities.items()
+        ], ordered=False)
+
+    async def _decrement_striped(self, quantities: Dict[ObjectId, int], stripes: Dict[ObjectId, int], session=None,
+                                 token: Optional[str] = None, resumable: bool = False):
+        """
+        Descuenta de sus stripes el stock de los productos repartidos. Si alguno no alcanza,
+        devuelve lo ya descontado y lanza el error de stock insuficiente. Sus reservas no usan el
+        contador `reserved` del producto, así que no se escribe en su documento. Con `token` los
+        descuentos quedan marcados como las líneas del `bulk_write`; con `resumable`, lo que un
+        intento anterior ya descontó con ese token no se vuelve a descontar.
+        """
+        applied = []
+        for product_id, count in stripes.items():
+            quantity = quantities[product_id]
+            if resumable:
+                quantity -= await self.inventory.applied(product_id, token)
+            if quantity > 0 and not await self.inventory.decrement(product_id, quantity, count,
+                                                                   session=session, token=token):
+                if token:
+                    for striped_id in stripes:
+                        await self.inventory.revert(striped_id, token)
+                else:
+                    for applied_id, applied_quantity in applied:
+                        await self.inventory.increment(applied_id, applied_quantity, stripes[applied_id],
+                                                       session=session)
+                raise HTTPException(status_code=400,
+                                    detail=f"Stock insuficiente para el producto con ID {product_id}.")
+            applied.append((product_id, quantity))
+
+    async def _raise_stock_error(self, quantities: Dict[ObjectId, int], reserved: Dict[ObjectId, int],
+                                 session=None):
+        """Identifica el primer producto que impidió el checkout y lanza el error correspondiente."""
+        products = await self.products_collection.find(
+            {"_id": {"$in": list(quantities)}}, {"stock": 1, "reserved": 1}, session=session
+        ).to_list(length=None)
+        # Stock disponible para este carrito: lo no reservado más lo que reservó este mismo carrito
+        available_by_id = {
+            product["_id"]: product.get("stock", 0) - product.get("reserved", 0) + reserved.get(product["_id"], 0)
+            for product in products
+        }
+
+        for product_id, quantity in quantities.items():
+            if product_id not in available_by_id:
+                raise HTTPException(status_code=404, detail=f"Producto con ID {product_id} no encontrado.")
+            if available_by_id[product_id] < quantity:
+                raise HTTPException(status_code=400,
+                                    detail=f"Stock insuficiente para el producto con ID {product_id}.")
+
+        # Otro checkout concurrente consumió el stock entre la escritura y la verificación
+        raise HTTPException(status_code=409, detail="El stock cambió durante la compra, intenta de nuevo.")
 
     async def clear_cart(self, user_id: str):
         """Limpia el carrito de un usuario específico."""
+        if self.buffer:
+            self.buffer.discard(user_id)
         await self.collection.delete_one({"user_id": user_id})
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Intervalo de la reconstrucción periódica del resumen (0 = solo bajo demanda)
+REBUILD_INTERVAL_SECONDS = float(os.getenv("CATEGORY_FACETS_REBUILD_SECONDS", "0"))
+
+# Campos agregados por categoría; el promedio de precio se deriva de `price_sum / count`
+_SUMMARY_GROUP = {
+    "count": {"$sum": 1},
+    "stock": {"$sum": "$stock"},
+    "price_sum": {"$sum": "$price"},
+    "price_min": {"$min": "$price"},
+    "price_max": {"$max": "$price"},
+}
+
+
+class CategoryFacetRepository:
+    """
+    Resumen materializado del catálogo por categoría (cantidad de productos, stock total y
+    precio mínimo, máximo y promedio) en la colección `category_facets`.
+
+    Se mantiene de forma incremental con cada alta de producto y cambio de stock; `rebuild()`
+    lo recalcula desde `products`. `price_min` y `price_max` solo se amplían de forma incremental,
+    por lo que un cambio de precio a la baja se refleja al reconstruir (bajo demanda o cada
+    `CATEGORY_FACETS_REBUILD_SECONDS`).
+
+    Los documentos de una reconstrucción llevan `rebuilt_at`; mientras no exista ninguna,
+    `get_facets()` calcula las facetas al vuelo en lugar de leer un resumen parcial.
+    """
+    COLLECTION = "category_facets"
+    INDEXES = []
+    HOT_QUERIES = [{"filter": {}, "sort": [("_id", ASCENDING)]}]
+
+    def __init__(self, db):
+        self.collection = db[self.COLLECTION]
+        self.products_collection = db["products"]
+        self.stripes_collection = db["inventory_stripes"]
+
+    async def get_facets(self) -> List[dict]:
+        """Lee el resumen: un documento por categoría, sin recorrer los productos."""
+        summaries = await self.collection.find({}).sort("_id", ASCENDING).to_list(length=None)
+        if not any("rebuilt_at" in summary for summary in summaries):
+            return await self.compute_facets()
+        return [self._facet(summary) for summary in summaries]
+
+    async def compute_facets(self) -> List[dict]:
+        """Calcula las facetas directamente sobre `products` (sin el stock repartido en stripes)."""
+        summaries = await self.products_collection.aggregate([
+            {"$group": {"_id": "$category", **_SUMMARY_GROUP}},
+            {"$sort": {"_id": 1}},
+        ]).to_list(length=None)
+        return [self._facet(summary) for summary in summaries]
+
+    async def record(self, created: Iterable[dict] = (), stock_deltas: Optional[Dict[str, int]] = None):
+        """
+        Aplica al resumen los productos creados y los cambios de stock por categoría. Un fallo
+        se registra pero no interrumpe la escritura que lo originó: `rebuild()` corrige la deriva.
+        """
+        operations = []
+        for product in created:
+            operations.append(UpdateOne(
+                {"_id": product["category"]},
+                {"$inc": {"count": 1, "stock": product.get("stock", 0), "price_sum": product["price"]},
+                 "$min": {"price_min": product["price"]},
+                 "$max": {"price_max": product["price"]}},
+                upsert=True,
+            ))
+        for category, delta in (stock_deltas or {}).items():
+            if delta:
+                operations.append(UpdateOne({"_id": category}, {"$inc": {"stock": delta}}))
+        if not operations:
+            return
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except PyMongoError:
+            logger.exception("No se pudo actualizar el resumen de categorías")
+
+    async def ensure_built(self):
+        """Construye el resumen si esta base de datos todavía no tiene una reconstrucción completa."""
+        try:
+            if await self.collection.find_one({"rebuilt_at": {"$exists": True}}, {"_id": 1}) is None:
+                categories = await self.rebuild()
+                logger.info("Resumen de categorías construido: %d categorías.", categories)
+        except PyMongoError:
+            logger.exception("No se pudo construir el resumen de categorías")
+
+    async def rebuild(self) -> int:
+        """
+        Recalcula el resumen en una colección auxiliar (`$group` + `$out` sobre `products`, más el
+        stock de las stripes) y la renombra sobre `category_facets`, de modo que los lectores ven el
+        resumen anterior o el nuevo completo. Devuelve la cantidad de categorías.
+
+        Los cambios incrementales que `record()` aplica mientras dura la reconstrucción van al
+        resumen anterior y se descartan con él: los que ocurrieron antes de que `$group` leyera
+        el producto ya están contados en el nuevo, y los posteriores se pierden hasta la próxima
+        reconstrucción, sin contarse nunca dos veces.
+        """
+        # Nombre propio por reconstrucción: dos procesos que reconstruyen a la vez no se pisan
+        staging_name = f"{self.COLLECTION}_rebuild_{uuid.uuid4().hex}"
+        staging = self.collection.database[staging_name]
+        try:
+            await self.products_collection.aggregate([
+                {"$group": {"_id": "$category", **_SUMMARY_GROUP}},
+                {"$set": {"rebuilt_at": datetime.utcnow()}},
+                {"$out": staging_name},
+            ]).to_list(length=None)
+
+            # Los productos con stripes guardan su stock fuera del documento
+            stripe_stock = await self.stripes_collection.aggregate([
+                {"$group": {"_id": "$product_id", "stock": {"$sum": "$stock"}}},
+                {"$lookup": {"from": "products", "localField": "_id", "foreignField": "_id", "as": "product"}},
+                {"$unwind": "$product"},
+                {"$group": {"_id": "$product.category", "stock": {"$sum": "$stock"}}},
+            ]).to_list(length=None)
+            operations = [UpdateOne({"_id": row["_id"]}, {"$inc": {"stock": row["stock"]}})
+                          for row in stripe_stock if row["stock"]]
+            if operations:
+                await staging.bulk_write(operations, ordered=False)
+
+            categories = await staging.count_documents({})
+            if categories:
+                await staging.rename(self.COLLECTION, dropTarget=True)
+            else:
+                # `$out` sin resultados no crea la colección: el catálogo quedó vacío
+                await self.collection.delete_many({})
+            return categories
+        finally:
+            await staging.drop()
+
+    async def run_rebuilder(self, interval: float = REBUILD_INTERVAL_SECONDS):
+        """Tarea de fondo que reconstruye el resumen periódicamente y corrige la deriva incremental."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                categories = await self.rebuild()
+                logger.info("Resumen de categorías reconstruido: %d categorías.", categories)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error al reconstruir el resumen de categorías")
+
+    @staticmethod
+    def stock_deltas(lines: Iterable[tuple]) -> Dict[str, int]:
+        """Agrupa pares `(categoría, cambio de stock)` por categoría."""
+        deltas: Dict[str, int] = defaultdict(int)
+        for category, delta in lines:
+            deltas[category] += delta
+        return dict(deltas)
+
+    @staticmethod
+    def _facet(summary: dict) -> dict:
+        count = summary.get("count", 0)
+        return {
+            "category": summary["_id"],
+            "count": count,
+            "stock": summary.get("stock", 0),
+            "price_min": summary.get("price_min"),
+            "price_max": summary.get("price_max"),
+            "price_avg": round(summary["price_sum"] / count, 2) if count else None,
+        }
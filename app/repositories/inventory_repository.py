@@ -0,0 +1,240 @@
+import os
+import random
+from typing import Dict, Iterable, List, Optional
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from app.cache import LRUCache
+from app.repositories.reservation_repository import ReservationRepository
+
+DEFAULT_STRIPES = int(os.getenv("STRIPED_INVENTORY_DEFAULT_STRIPES", "8"))
+STRIPE_COUNT_CACHE_TTL_SECONDS = float(os.getenv("STRIPED_INVENTORY_CACHE_TTL_SECONDS", "30"))
+STOCK_CACHE_TTL_SECONDS = float(os.getenv("STRIPED_STOCK_CACHE_TTL_SECONDS", "1"))
+
+
+class StripedInventoryRepository:
+    """
+    Inventario repartido en K documentos contador (stripes) para productos con mucha
+    contención de escritura. Un producto con stripes tiene el campo `stripes` con K; su stock
+    total es `stock` del producto más la suma de sus stripes.
+
+    Los demás procesos ven la activación o desactivación de un producto al vencer el cache
+    de `STRIPED_INVENTORY_CACHE_TTL_SECONDS`; mientras tanto, el checkout detecta el cambio
+    cuando el descuento en el documento del producto falla y vuelve a consultar las stripes.
+    """
+    COLLECTION = "inventory_stripes"
+    INDEXES = [
+        IndexModel([("product_id", ASCENDING), ("stripe", ASCENDING)], name="product_id_1_stripe_1", unique=True),
+    ]
+    HOT_QUERIES = [
+        {"filter": {"product_id": ObjectId("0" * 24), "stripe": 0, "stock": {"$gte": 1}}},
+        {"filter": {"product_id": ObjectId("0" * 24)}, "sort": [("stock", DESCENDING)]},
+    ]
+
+    def __init__(self, db, reservations: Optional[ReservationRepository] = None):
+        self.collection = db[self.COLLECTION]
+        self.products_collection = db["products"]
+        self.reservations = reservations
+        self._stripe_counts = LRUCache(max_size=10000, ttl_seconds=STRIPE_COUNT_CACHE_TTL_SECONDS)
+        self._stock = LRUCache(max_size=10000, ttl_seconds=STOCK_CACHE_TTL_SECONDS)
+
+    async def enable(self, product_id: ObjectId, stripes: int = DEFAULT_STRIPES) -> int:
+        """
+        Reparte el stock actual del producto en `stripes` contadores. Devuelve el stock repartido.
+        El contador `reserved` se elimina: las reservas de productos con stripes no lo usan.
+        """
+        product = await self.products_collection.find_one_and_update(
+            {"_id": product_id, "stripes": {"$exists": False}},
+            {"$set": {"stock": 0, "stripes": stripes}, "$unset": {"reserved": ""}},
+        )
+        if product is None:
+            raise HTTPException(status_code=400, detail="Producto no encontrado o ya repartido en stripes.")
+
+        stock = product.get("stock", 0)
+        share, remainder = divmod(stock, stripes)
+        await self.collection.insert_many([
+            {"product_id": product_id, "stripe": stripe, "stock": share + (1 if stripe < remainder else 0)}
+            for stripe in range(stripes)
+        ])
+        self._invalidate(product_id)
+        return stock
+
+    async def disable(self, product_id: ObjectId) -> int:
+        """
+        Devuelve al producto el stock de sus stripes y las elimina. Devuelve el stock recuperado.
+        El contador `reserved` se recalcula con las reservas vigentes del producto.
+        """
+        recovered = 0
+        stripes = await self.collection.find({"product_id": product_id}, {"_id": 1}).to_list(length=None)
+        for stripe in stripes:
+            # Se borra una a una para no perder decrementos concurrentes
+            document = await self.collection.find_one_and_delete({"_id": stripe["_id"]})
+            if document:
+                recovered += document["stock"]
+        held = await self.reservations.held_quantity(product_id) if self.reservations else 0
+        await self.products_collection.update_one(
+            {"_id": product_id}, {"$inc": {"stock": recovered}, "$set": {"reserved": held}, "$unset": {"stripes": ""}}
+        )
+        self._invalidate(product_id)
+        return recovered
+
+    async def stripe_counts(self, product_ids: Iterable[ObjectId], use_cache: bool = True) -> Dict[ObjectId, int]:
+        """Número de stripes por producto (0 si no está repartido), con cache salvo `use_cache=False`."""
+        counts: Dict[ObjectId, int] = {}
+        missing: List[ObjectId] = []
+        for product_id in product_ids:
+            count = self._stripe_counts.get(product_id) if use_cache else None
+            if count is None:
+                missing.append(product_id)
+            else:
+                counts[product_id] = count
+        if missing:
+            products = await self.products_collection.find(
+                {"_id": {"$in": missing}}, {"stripes": 1}
+            ).to_list(length=None)
+            found = {product["_id"]: product.get("stripes", 0) for product in products}
+            for product_id in missing:
+                counts[product_id] = found.get(product_id, 0)
+                self._stripe_counts.set(product_id, counts[product_id])
+        return counts
+
+    async def decrement(self, product_id: ObjectId, quantity: int, stripes: int, session=None,
+                        token: Optional[str] = None) -> bool:
+        """
+        Descuenta `quantity` de una stripe al azar; si no alcanza, prueba las demás y por último
+        reparte el descuento entre varias stripes y el stock del producto. Nunca deja stock negativo.
+        Con `token` (checkout sin transacción), cada documento descontado se marca en `stripe_checkouts`
+        con el token y la cantidad, para que `applied()` y `revert()` sepan qué se descontó.
+        """
+        order = list(range(stripes))
+        random.shuffle(order)
+        for stripe in order:
+            result = await self.collection.update_one(
+                *self._tagged({"product_id": product_id, "stripe": stripe, "stock": {"$gte": quantity}},
+                              quantity, token),
+                session=session,
+            )
+            if result.modified_count:
+                self._stock.invalidate(product_id)
+                return True
+
+        # Ninguna stripe alcanza sola: se toma de varias, con compensación si el total no alcanza
+        taken = []
+        remaining = quantity
+        documents = await self.collection.find(
+            {"product_id": product_id}, session=session
+        ).sort("stock", DESCENDING).to_list(length=None)
+        for document in documents:
+            take = min(document["stock"], remaining)
+            if take <= 0:
+                continue
+            result = await self.collection.update_one(
+                *self._tagged({"_id": document["_id"], "stock": {"$gte": take}}, take, token), session=session
+            )
+            if result.modified_count:
+                taken.append((document["_id"], take))
+                remaining -= take
+            if remaining == 0:
+                break
+
+        if remaining:
+            result = await self.products_collection.update_one(
+                *self._tagged({"_id": product_id, "stock": {"$gte": remaining}}, remaining, token), session=session
+            )
+            if not result.modified_count:
+                for stripe_id, take in taken:
+                    undo = {"$inc": {"stock": take}}
+                    if token:
+                        undo["$pull"] = {"stripe_checkouts": {"token": token}}
+                    await self.collection.update_one({"_id": stripe_id}, undo, session=session)
+                return False
+
+        self._stock.invalidate(product_id)
+        return True
+
+    async def applied(self, product_id: ObjectId, token: str) -> int:
+        """Cantidad del producto ya descontada por el checkout `token` (de un intento anterior)."""
+        applied = 0
+        for collection, query in ((self.collection, {"product_id": product_id}),
+                                  (self.products_collection, {"_id": product_id})):
+            documents = await collection.find(
+                {**query, "stripe_checkouts.token": token}, {"stripe_checkouts": 1}
+            ).to_list(length=None)
+            applied += sum(
+                entry["quantity"] for document in documents for entry in document["stripe_checkouts"]
+                if entry["token"] == token
+            )
+        return applied
+
+    async def revert(self, product_id: ObjectId, token: str):
+        """Devuelve a cada documento lo que el checkout `token` le descontó y quita su marca."""
+        for collection, query in ((self.collection, {"product_id": product_id}),
+                                  (self.products_collection, {"_id": product_id})):
+            documents = await collection.find(
+                {**query, "stripe_checkouts.token": token}, {"stripe_checkouts": 1}
+            ).to_list(length=None)
+            for document in documents:
+                for entry in document["stripe_checkouts"]:
+                    if entry["token"] != token:
+                        continue
+                    # Cada documento lleva a lo sumo una marca por token y se quita en el mismo update:
+                    # repetir la devolución no la aplica dos veces
+                    await collection.update_one(
+                        {"_id": document["_id"], "stripe_checkouts.token": token},
+                        {"$inc": {"stock": entry["quantity"]}, "$pull": {"stripe_checkouts": {"token": token}}},
+                    )
+        self._stock.invalidate(product_id)
+
+    async def clear(self, token: str, product_ids: Iterable[ObjectId]):
+        """
+        Quita las marcas del checkout `token` una vez confirmado. `stripe_checkouts` no tiene índice:
+        la búsqueda se acota a los productos del checkout y sus stripes.
+        """
+        product_ids = list(product_ids)
+        for collection, query in ((self.collection, {"product_id": {"$in": product_ids}}),
+                                  (self.products_collection, {"_id": {"$in": product_ids}})):
+            await collection.update_many(
+                {**query, "stripe_checkouts.token": token}, {"$pull": {"stripe_checkouts": {"token": token}}}
+            )
+
+    @staticmethod
+    def _tagged(query: dict, quantity: int, token: Optional[str]) -> tuple:
+        update = {"$inc": {"stock": -quantity}}
+        if token:
+            query = {**query, "stripe_checkouts.token": {"$ne": token}}
+            update["$push"] = {"stripe_checkouts": {"token": token, "quantity": quantity}}
+        return query, update
+
+    async def increment(self, product_id: ObjectId, quantity: int, stripes: int, session=None):
+        """Suma stock a una stripe al azar (reposición o compensación de un checkout fallido)."""
+        await self.collection.update_one(
+            {"product_id": product_id, "stripe": random.randrange(stripes)},
+            {"$inc": {"stock": quantity}},
+            session=session,
+        )
+        self._stock.invalidate(product_id)
+
+    async def get_stock(self, product_id: ObjectId) -> int:
+        """Suma de las stripes del producto, con un cache muy corto."""
+        stock = self._stock.get(product_id)
+        if stock is None:
+            rows = await self.collection.aggregate([
+                {"$match": {"product_id": product_id}},
+                {"$group": {"_id": None, "stock": {"$sum": "$stock"}}},
+            ]).to_list(length=None)
+            stock = rows[0]["stock"] if rows else 0
+            self._stock.set(product_id, stock)
+        return stock
+
+    async def overlay_stock(self, products: List[dict]) -> List[dict]:
+        """Reemplaza `stock` por el total real en los productos con stripes y quita el campo `stripes`."""
+        for product in products:
+            stripes = product.pop("stripes", None)
+            if stripes:
+                product_id = ObjectId(product["_id"]) if isinstance(product["_id"], str) else product["_id"]
+                product["stock"] = product.get("stock", 0) + await self.get_stock(product_id)
+        return products
+
+    def _invalidate(self, product_id: ObjectId):
+        self._stripe_counts.invalidate(product_id)
+        self._stock.invalidate(product_id)
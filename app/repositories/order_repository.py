@@ -0,0 +1,200 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument
+
+from app.models.rows import CartLine
+
+ORDER_LEASE_SECONDS = float(os.getenv("ORDER_LEASE_SECONDS", "30"))
+
+# Estados en los que un pedido todavía puede tomarlo un worker
+_CLAIMABLE = ["pending", "processing"]
+
+
+class OrderRepository:
+    """
+    Pedidos creados por el checkout asíncrono y cola de trabajo de los workers que los procesan.
+
+    Estados de un pedido: `pending` (en cola), `processing` (tomado por un worker con un lease),
+    `completed` y `failed`. Un pedido se puede tomar cuando vence su `lease_until`: al crearlo se
+    retiene hasta que el carrito queda vacío, y si el worker que lo procesa cae, otro lo retoma al
+    vencer el lease. Solo quien tiene el lease vigente (`lease_id`) puede cerrar el pedido.
+
+    Sin transacciones el pedido nace como borrador (`draft`) hasta que `release()` lo publica; un
+    borrador que llega a un worker es de un proceso que cayó entre crearlo y publicarlo.
+    """
+    COLLECTION = "orders"
+    INDEXES = [
+        # Reintentos del cliente con la misma `Idempotency-Key` devuelven el mismo pedido
+        IndexModel([("user_id", ASCENDING), ("idempotency_key", ASCENDING)], name="user_id_1_idempotency_key_1",
+                   unique=True, partialFilterExpression={"idempotency_key": {"$exists": True}}),
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="status_1_lease_until_1"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_id_1_created_at_-1"),
+        # El sweeper de reservas busca el pedido dueño de un reclamo abandonado
+        IndexModel([("reservation_token", ASCENDING)], name="reservation_token_1", sparse=True),
+    ]
+    HOT_QUERIES = [
+        {"filter": {"status": {"$in": _CLAIMABLE}, "lease_until": {"$lte": datetime(2000, 1, 1)}},
+         "sort": [("lease_until", ASCENDING)]},
+        {"filter": {"user_id": "", "idempotency_key": ""}},
+    ]
+
+    def __init__(self, db, lease_seconds: float = ORDER_LEASE_SECONDS):
+        self.collection = db[self.COLLECTION]
+        self.lease_seconds = lease_seconds
+        # Despierta a los workers del proceso cuando hay un pedido nuevo, sin esperar al polling
+        self._work_available = asyncio.Event()
+
+    async def create(self, user_id: str, lines: List[CartLine], reserved: Dict[ObjectId, int],
+                     reservation_token: Optional[str], idempotency_key: Optional[str] = None,
+                     draft: bool = False, session=None) -> dict:
+        """
+        Guarda la foto del carrito como pedido `pending`, retenido durante un lease para que ningún
+        worker lo tome antes de `release()`. Con `draft`, queda marcado como borrador hasta entonces.
+        """
+        now = datetime.utcnow()
+        order = {
+            "user_id": user_id,
+            "items": [
+                {"product_id": line.product_id, "quantity": line.quantity, "name": line.name,
+                 "price": line.price, "category": line.category}
+                for line in lines
+            ],
+            "total": round(sum((line.price or 0) * line.quantity for line in lines), 2),
+            "status": "pending",
+            "attempts": 0,
+            "reservation_token": reservation_token,
+            "reserved": {str(product_id): quantity for product_id, quantity in reserved.items()},
+            "created_at": now,
+            "updated_at": now,
+            "lease_until": now + timedelta(seconds=self.lease_seconds),
+        }
+        if idempotency_key:
+            order["idempotency_key"] = idempotency_key
+        if draft:
+            order["draft"] = True
+        result = await self.collection.insert_one(order, session=session)
+        order["_id"] = result.inserted_id
+        return order
+
+    async def release(self, order_id: ObjectId) -> bool:
+        """
+        Publica el pedido y lo deja disponible para los workers de inmediato. Devuelve `False` si ya
+        no está en cola (un worker lo tomó o lo descartó por abandonado).
+        """
+        result = await self.collection.update_one(
+            {"_id": order_id, "status": "pending"},
+            {"$set": {"lease_until": datetime.utcnow()}, "$unset": {"draft": ""}}
+        )
+        self._work_available.set()
+        return result.matched_count == 1
+
+    async def delete(self, order_id: ObjectId):
+        await self.collection.delete_one({"_id": order_id, "status": "pending"})
+
+    async def exists(self, order_id: ObjectId) -> bool:
+        return await self.collection.count_documents({"_id": order_id}, limit=1) > 0
+
+    async def publish(self, order: dict) -> bool:
+        """Publica un borrador tomado por este worker. Devuelve `False` si ya no tiene el lease."""
+        result = await self.collection.update_one(
+            {"_id": order["_id"], "lease_id": order["lease_id"]}, {"$unset": {"draft": ""}}
+        )
+        return result.modified_count == 1
+
+    async def discard(self, order: dict) -> bool:
+        """Elimina un borrador abandonado tomado por este worker. Devuelve `False` si ya no tiene el lease."""
+        result = await self.collection.delete_one({"_id": order["_id"], "draft": True, "lease_id": order["lease_id"]})
+        return result.deleted_count == 1
+
+    async def find_by_key(self, user_id: str, idempotency_key: str) -> Optional[dict]:
+        return await self.collection.find_one({"user_id": user_id, "idempotency_key": idempotency_key})
+
+    async def get_for_user(self, order_id: str, user_id: str) -> dict:
+        """Obtiene un pedido del usuario; un id inválido o de otro usuario responde `404`."""
+        try:
+            order = await self.collection.find_one({"_id": ObjectId(order_id), "user_id": user_id})
+        except (InvalidId, TypeError):
+            order = None
+        if order is None:
+            raise HTTPException(status_code=404, detail="Pedido no encontrado.")
+        return order
+
+    async def claim_next(self) -> Optional[dict]:
+        """Toma el pedido disponible más antiguo con un lease nuevo, o `None` si la cola está vacía."""
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {"status": {"$in": _CLAIMABLE}, "lease_until": {"$lte": now}},
+            {"$set": {"status": "processing", "lease_id": uuid.uuid4().hex,
+                      "lease_until": now + timedelta(seconds=self.lease_seconds), "updated_at": now},
+             "$inc": {"attempts": 1}},
+            sort=[("lease_until", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def wait_for_work(self, timeout: float):
+        """Espera un pedido nuevo de este proceso o, como mucho, `timeout` segundos."""
+        try:
+            await asyncio.wait_for(self._work_available.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._work_available.clear()
+
+    async def complete(self, order: dict, session=None) -> bool:
+        """Marca el pedido como completado. Devuelve `False` si el worker ya no tiene el lease."""
+        return await self._finish(order, {"status": "completed", "error": None}, session=session)
+
+    async def fail(self, order: dict, error: str) -> bool:
+        """Marca el pedido como fallido. Devuelve `False` si el worker ya no tiene el lease."""
+        return await self._finish(order, {"status": "failed", "error": error})
+
+    async def retry(self, order: dict, error: str, delay: float):
+        """Devuelve el pedido a la cola para reintentarlo dentro de `delay` segundos."""
+        now = datetime.utcnow()
+        await self.collection.update_one(
+            {"_id": order["_id"], "lease_id": order["lease_id"]},
+            {"$set": {"status": "pending", "error": error, "updated_at": now,
+                      "lease_until": now + timedelta(seconds=delay)},
+             "$unset": {"lease_id": ""}}
+        )
+
+    async def _finish(self, order: dict, fields: dict, session=None) -> bool:
+        result = await self.collection.update_one(
+            {"_id": order["_id"], "status": "processing", "lease_id": order["lease_id"]},
+            {"$set": {**fields, "updated_at": datetime.utcnow()}, "$unset": {"lease_id": "", "lease_until": ""}},
+            session=session,
+        )
+        return result.modified_count == 1
+
+    @staticmethod
+    def quantities(order: dict) -> Dict[ObjectId, int]:
+        """Cantidades del pedido agrupadas por producto."""
+        quantities: Dict[ObjectId, int] = {}
+        for item in order["items"]:
+            product_id = ObjectId(item["product_id"])
+            quantities[product_id] = quantities.get(product_id, 0) + item["quantity"]
+        return quantities
+
+    @staticmethod
+    def reserved(order: dict) -> Dict[ObjectId, int]:
+        """Cantidades que el carrito tenía reservadas al crear el pedido."""
+        return {ObjectId(product_id): quantity for product_id, quantity in (order.get("reserved") or {}).items()}
+
+    @staticmethod
+    def summary(order: dict) -> dict:
+        """Vista pública del pedido para la API."""
+        return {
+            "order_id": str(order["_id"]),
+            "status": order["status"],
+            "items": order["items"],
+            "total": order["total"],
+            "error": order.get("error"),
+            "attempts": order.get("attempts", 0),
+            "created_at": order["created_at"],
+            "updated_at": order["updated_at"],
+        }
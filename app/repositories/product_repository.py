@@ -1,27 +1,247 @@
+import base64
+import binascii
+import os
+import time
+import orjson
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from app.cache import ProductCache
 from app.models.product import Product
+from app.models.rows import ProductRow
+from app.repositories.facet_repository import CategoryFacetRepository
+from app.repositories.inventory_repository import StripedInventoryRepository
+from app.serialization import stringify_id
 from bson import ObjectId
+from bson.errors import InvalidId
 from fastapi import HTTPException
+from pydantic import ValidationError
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+# Solo se leen los campos que expone el modelo `Product` (y `stripes` para calcular el stock)
+PRODUCT_PROJECTION = {"name": 1, "category": 1, "price": 1, "stock": 1, "stripes": 1}
+DEFAULT_PAGE_SIZE = int(os.getenv("PRODUCTS_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("PRODUCTS_MAX_PAGE_SIZE", "1000"))
+STREAM_BATCH_SIZE = int(os.getenv("PRODUCTS_STREAM_BATCH_SIZE", "500"))
+BULK_CHUNK_SIZE = int(os.getenv("PRODUCTS_BULK_CHUNK_SIZE", "1000"))
+# Campos que se pueden pedir en `fields` y órdenes admitidos por la búsqueda
+SEARCH_FIELDS = ("name", "category", "price", "stock")
+SEARCH_SORTS = {
+    "relevance": None,
+    "id": ("_id", ASCENDING),
+    "price": ("price", ASCENDING),
+    "-price": ("price", DESCENDING),
+    "name": ("name", ASCENDING),
+}
+
+
+def _search_filter(text: Optional[str] = None, category: Optional[str] = None, min_price: Optional[float] = None,
+                   max_price: Optional[float] = None, in_stock: bool = False) -> dict:
+    query: dict = {}
+    if text:
+        query["$text"] = {"$search": text}
+    if category is not None:
+        query["category"] = category
+    if min_price is not None or max_price is not None:
+        query["price"] = {}
+        if min_price is not None:
+            query["price"]["$gte"] = min_price
+        if max_price is not None:
+            query["price"]["$lte"] = max_price
+    if in_stock:
+        # Los productos con stripes guardan su stock fuera del documento
+        query["$or"] = [{"stock": {"$gt": 0}}, {"stripes": {"$gt": 0}}]
+    return query
+
+
+def _search_sort(sort: str) -> Optional[List[Tuple[str, int]]]:
+    """
+    Claves de orden de la búsqueda; `_id` desempata los campos que se pueden repetir (`name` es
+    único, así que `name_1` da el orden completo). `None` para `relevance` (orden por `textScore`).
+    """
+    if SEARCH_SORTS[sort] is None:
+        return None
+    field, direction = SEARCH_SORTS[sort]
+    return [(field, direction)] if field in ("_id", "name") else [(field, direction), ("_id", direction)]
+
+
+def _search_query(sort: str, **filters) -> dict:
+    """Consulta de `search_products()` para `HOT_QUERIES`, con el mismo filtro y orden que ejecuta."""
+    query = {"filter": _search_filter(**filters)}
+    if _search_sort(sort):
+        query["sort"] = _search_sort(sort)
+    return query
 
 
 class ProductRepository:
-    def __init__(self, db):
-        self.collection = db["products"]
+    COLLECTION = "products"
+    INDEXES = [
+        IndexModel([("name", ASCENDING)], name="name_1", unique=True),
+        IndexModel([("category", ASCENDING), ("_id", ASCENDING)], name="category_1__id_1"),
+        # `_id` desempata el orden por precio, necesario para paginar por cursor sin ordenar en memoria
+        IndexModel([("category", ASCENDING), ("price", ASCENDING), ("_id", ASCENDING)],
+                   name="category_1_price_1__id_1"),
+        IndexModel([("price", ASCENDING), ("_id", ASCENDING)], name="price_1__id_1"),
+        IndexModel([("name", TEXT), ("category", TEXT)], name="name_text_category_text"),
+    ]
+    # Consultas de ejemplo con la forma de las que ejecuta el repositorio, verificadas con explain().
+    # Las de la búsqueda se arman con el mismo `_search_filter()`: el `$or` de `in_stock` se resuelve
+    # con el índice del orden (un índice sobre `stock` se reescribiría en cada checkout)
+    HOT_QUERIES = [
+        {"filter": {"name": ""}},
+        {"filter": {"category": ""}, "sort": [("_id", ASCENDING)]},
+        {"filter": {"category": "", "_id": {"$gt": ObjectId("0" * 24)}}, "sort": [("_id", ASCENDING)]},
+        {"filter": {"category": ""}, "sort": [("price", ASCENDING)]},
+        {"filter": {"_id": ObjectId("0" * 24)}},
+        _search_query("relevance", text="x", min_price=0),
+        _search_query("relevance", text="x", in_stock=True),
+        _search_query("price", min_price=0, max_price=1, in_stock=True),
+        _search_query("-price", category="", min_price=0),
+        _search_query("price", category="", in_stock=True),
+        _search_query("id", in_stock=True),
+        _search_query("name", in_stock=True),
+    ]
 
-    async def get_all_products(self):
-        products_cursor = self.collection.find()
-        products = await products_cursor.to_list(length=None)
+    def __init__(self, db, cache: Optional[ProductCache] = None,
+                 inventory: Optional[StripedInventoryRepository] = None,
+                 facets: Optional[CategoryFacetRepository] = None):
+        self.collection = db[self.COLLECTION]
+        self.cache = cache
+        self.inventory = inventory
+        self.facets = facets
 
-        for product in products:
-            if "_id" in product and isinstance(product["_id"], ObjectId):
-                product["_id"] = str(product["_id"])
+    async def get_products_by_category(self, category: str, after: Optional[str] = None,
+                                       limit: int = DEFAULT_PAGE_SIZE, use_cache: bool = True):
+        products, _ = await self.get_products_page(category=category, after=after, limit=limit, use_cache=use_cache)
+        return products
+
+    async def get_products_page(self, category: Optional[str] = None, after: Optional[str] = None,
+                                limit: int = DEFAULT_PAGE_SIZE,
+                                use_cache: bool = True) -> Tuple[List[ProductRow], Optional[str]]:
+        """
+        Obtiene una página de productos ordenada por `_id` (paginación por cursor).
+        Devuelve los productos y el cursor de la página siguiente, o `None` si no hay más.
+        Las filas son `ProductRow` inmutables, compartidas con el cache.
+        """
+        cache_key = ProductCache.list_key(category, "page", after, limit)
+        products = self.cache.get_list(cache_key) if self.cache and use_cache else None
+        if products is None:
+            # Se pide un documento extra para saber si existe una página siguiente
+            cursor = self.collection.find(self._keyset_filter(category, after), PRODUCT_PROJECTION)
+            documents = await cursor.sort("_id", 1).limit(limit + 1).to_list(length=limit + 1)
+            for document in documents:
+                stringify_id(document)
+            await self._resolve_stock(documents)
+            products = [ProductRow.from_document(document) for document in documents]
+            if self.cache:
+                self.cache.set_list(cache_key, products)
+
+        next_cursor = products[limit - 1].id if len(products) > limit else None
+        return products[:limit], next_cursor
+
+    def stream_products(self, category: Optional[str] = None, after: Optional[str] = None,
+                        batch_size: int = STREAM_BATCH_SIZE) -> AsyncIterator[dict]:
+        """Itera el catálogo en lotes de `batch_size` sin cargarlo completo en memoria."""
+        cursor = self.collection.find(self._keyset_filter(category, after), PRODUCT_PROJECTION)
+        return self._iterate(cursor.sort("_id", 1).batch_size(batch_size))
 
-        return [Product(**product) for product in products]
+    async def _iterate(self, cursor) -> AsyncIterator[dict]:
+        async for product in cursor:
+            await self._resolve_stock([product])
+            yield stringify_id(product)
 
-    async def get_products_by_category(self, category: str):
-        products = await self.collection.find({"category": category}).to_list(length=100)
+    async def search_products(self, text: Optional[str] = None, category: Optional[str] = None,
+                              min_price: Optional[float] = None, max_price: Optional[float] = None,
+                              in_stock: bool = False, sort: Optional[str] = None,
+                              fields: Optional[List[str]] = None, after: Optional[str] = None,
+                              limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[dict], Optional[str]]:
+        """
+        Búsqueda con texto (índice de texto sobre nombre y categoría), rango de precio, stock
+        disponible y orden. Cada combinación se resuelve con un índice: el de texto cuando hay `text`,
+        `category_1_price_1__id_1` o `price_1__id_1` al ordenar por precio y el de `_id` o `name` en
+        los demás casos. Salvo con `relevance`, se pagina por cursor (`after`) sobre el orden elegido.
+        """
+        sort = sort or ("relevance" if text else "id")
+        if sort not in SEARCH_SORTS:
+            raise HTTPException(status_code=400, detail=f"Orden no admitido: {sort}.")
+        if sort == "relevance" and not text:
+            raise HTTPException(status_code=400, detail="El orden por relevancia requiere un texto de búsqueda.")
+        if sort == "relevance" and after:
+            raise HTTPException(status_code=400, detail="El orden por relevancia no admite cursor.")
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise HTTPException(status_code=400, detail="min_price no puede ser mayor que max_price.")
+
+        fields = fields or list(SEARCH_FIELDS)
+        projection = self._search_projection(fields)
+        query = _search_filter(text, category, min_price, max_price, in_stock)
+        if sort == "relevance":
+            cursor = self.collection.find(query, projection).sort([("score", {"$meta": "textScore"})])
+        else:
+            field, direction = SEARCH_SORTS[sort]
+            if after:
+                query = {"$and": [query, self._after_filter(field, direction, after)]}
+            cursor = self.collection.find(query, projection).sort(_search_sort(sort))
+
+        products = await cursor.limit(limit + 1).to_list(length=limit + 1)
+        next_cursor = None
+        if len(products) > limit and sort != "relevance":
+            field, _ = SEARCH_SORTS[sort]
+            last = products[limit - 1]
+            next_cursor = self._encode_cursor(last.get(field) if field != "_id" else None, last["_id"])
+        products = products[:limit]
         for product in products:
-            product["_id"] = str(product["_id"])
-        return products
+            stringify_id(product)
+        if "stripes" in projection:
+            await self._resolve_stock(products)
+        requested = set(fields) | {"_id"}
+        for product in products:
+            # Campos usados solo para ordenar o paginar que el cliente no pidió
+            for extra in set(product) - requested:
+                del product[extra]
+        return products, next_cursor
+
+    @staticmethod
+    def _search_projection(fields: List[str]) -> dict:
+        unknown = set(fields) - set(SEARCH_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Campos no admitidos: {', '.join(sorted(unknown))}.")
+        projection = {field: 1 for field in fields}
+        # `price` y `name` se leen siempre porque pueden ser la clave del cursor
+        projection.setdefault("price", 1)
+        projection.setdefault("name", 1)
+        if "stock" in fields:
+            projection["stripes"] = 1
+        return projection
+
+    def _after_filter(self, field: str, direction: int, after: str) -> dict:
+        value, last_id = self._decode_cursor(after)
+        operator = "$gt" if direction == ASCENDING else "$lt"
+        if field == "_id":
+            return {"_id": {operator: last_id}}
+        return {"$or": [{field: {operator: value}}, {field: value, "_id": {operator: last_id}}]}
+
+    @staticmethod
+    def _encode_cursor(value, last_id) -> str:
+        return base64.urlsafe_b64encode(orjson.dumps([value, str(last_id)])).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        try:
+            value, last_id = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return value, ObjectId(last_id)
+        except (binascii.Error, ValueError, TypeError, InvalidId):
+            raise HTTPException(status_code=400, detail="Cursor de búsqueda inválido.")
+
+    @staticmethod
+    def _keyset_filter(category: Optional[str], after: Optional[str]) -> dict:
+        query = {}
+        if category is not None:
+            query["category"] = category
+        if after:
+            try:
+                query["_id"] = {"$gt": ObjectId(after)}
+            except (InvalidId, TypeError):
+                raise HTTPException(status_code=400, detail="Cursor de paginación inválido.")
+        return query
 
     async def update_stock(self, product_id: str, quantity: int):
         product = await self.collection.find_one({"_id": ObjectId(product_id)})
@@ -29,6 +249,15 @@ class ProductRepository:
         if not product:
             raise HTTPException(status_code=404, detail="Producto no encontrado.")
 
+        if product.get("stripes") and self.inventory:
+            # Producto con stock repartido en stripes: el descuento es condicional en cada stripe
+            updated = await self.inventory.decrement(product["_id"], quantity, product["stripes"])
+            if not updated:
+                raise HTTPException(status_code=400, detail="Stock insuficiente para este producto.")
+            self._invalidate(product_id, product.get("category"))
+            await self._record_facets(stock_deltas={product["category"]: -quantity})
+            return True
+
         if product["stock"] < quantity:
             raise HTTPException(status_code=400, detail="Stock insuficiente para este producto.")
 
@@ -36,8 +265,38 @@ class ProductRepository:
             {"_id": ObjectId(product_id)},
             {"$inc": {"stock": -quantity}}
         )
+        self._invalidate(product_id, product.get("category"))
+        if result.modified_count:
+            await self._record_facets(stock_deltas={product["category"]: -quantity})
         return result.modified_count > 0
 
+    async def get_facets(self) -> List[dict]:
+        """Facetas por categoría desde el resumen materializado, o calculadas al vuelo si está desactivado."""
+        if self.facets:
+            return await self.facets.get_facets()
+        return await CategoryFacetRepository(self.collection.database).compute_facets()
+
+    async def rebuild_facets(self) -> int:
+        if not self.facets:
+            raise HTTPException(status_code=400, detail="El resumen de categorías no está habilitado.")
+        return await self.facets.rebuild()
+
+    async def set_stripes(self, product_id: str, count: int) -> int:
+        """Reparte el stock del producto en `count` stripes (0 lo devuelve al documento). Devuelve el stock movido."""
+        if not self.inventory:
+            raise HTTPException(status_code=400, detail="El inventario con stripes no está habilitado.")
+        try:
+            product_oid = ObjectId(product_id)
+        except (InvalidId, TypeError):
+            raise HTTPException(status_code=400, detail="ID de producto inválido.")
+
+        if count == 0:
+            stock = await self.inventory.disable(product_oid)
+        else:
+            stock = await self.inventory.enable(product_oid, count)
+        self._invalidate(product_id)
+        return stock
+
     async def create_product(self, product: Product):
         # Primero, intentamos buscar el producto por `nombre`
         existing_product_by_name = await self.collection.find_one({"name": product.name})
@@ -59,6 +318,8 @@ class ProductRepository:
             )
             existing_product_by_id["stock"] += 1
             existing_product_by_id["_id"] = str(existing_product_by_id["_id"])
+            self._invalidate(existing_product_by_id["_id"], existing_product_by_id.get("category"))
+            await self._record_facets(stock_deltas={existing_product_by_id["category"]: 1})
             return Product(**existing_product_by_id)
 
         elif existing_product_by_name:
@@ -69,21 +330,171 @@ class ProductRepository:
             )
             existing_product_by_name["stock"] += 1
             existing_product_by_name["_id"] = str(existing_product_by_name["_id"])
+            self._invalidate(existing_product_by_name["_id"], existing_product_by_name.get("category"))
+            await self._record_facets(stock_deltas={existing_product_by_name["category"]: 1})
             return Product(**existing_product_by_name)
 
         # Si no existe por ID ni por nombre, insertamos un nuevo producto
         product_data = product.dict(by_alias=True, exclude={"id"})
-        result = await self.collection.insert_one(product_data)
+        try:
+            result = await self.collection.insert_one(product_data)
+        except DuplicateKeyError:
+            # Otra petición insertó un producto con el mismo nombre: se incrementa su stock
+            return await self.create_product(product)
         product_data["_id"] = str(result.inserted_id)
+        self._invalidate(product_data["_id"], product_data.get("category"))
+        await self._record_facets(created=[product_data])
         return Product(**product_data)
 
-    async def get_product_by_id(self, product_id: str):
+    async def bulk_upsert_products(self, rows: AsyncIterable, chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+        """
+        Carga productos en lotes con `bulk_write` no ordenado, con la misma semántica que
+        `create_product`: si el producto existe por id o por nombre se incrementa su stock en 1,
+        si no se inserta. Devuelve el resultado de cada fila y estadísticas de throughput.
+        """
+        started = time.perf_counter()
+        results: List[dict] = []
+        chunks = 0
+        chunk = []
+        async for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                results.extend(await self._bulk_upsert_chunk(chunk, offset=len(results)))
+                chunks += 1
+                chunk = []
+        if chunk:
+            results.extend(await self._bulk_upsert_chunk(chunk, offset=len(results)))
+            chunks += 1
+
+        elapsed = time.perf_counter() - started
+        statuses = [result["status"] for result in results]
+        return {
+            "results": results,
+            "stats": {
+                "rows": len(results),
+                "created": statuses.count("created"),
+                "updated": statuses.count("updated"),
+                "errors": statuses.count("error"),
+                "chunks": chunks,
+                "elapsed_ms": round(elapsed * 1000, 2),
+                "rows_per_second": round(len(results) / elapsed, 2) if elapsed else None,
+            },
+        }
+
+    async def _bulk_upsert_chunk(self, rows: list, offset: int) -> List[dict]:
+        """Procesa un lote en dos round trips: una búsqueda de los existentes y un `bulk_write`."""
+        results: List[Optional[dict]] = [None] * len(rows)
+        parsed = []
+        for position, row in enumerate(rows):
+            try:
+                if not isinstance(row, dict):
+                    raise TypeError("La fila debe ser un objeto JSON.")
+                product = Product(**row)
+                parsed.append((position, product, ObjectId(product.id) if product.id else None))
+            except (ValidationError, InvalidId, TypeError) as err:
+                results[position] = {"row": offset + position, "status": "error", "detail": str(err)}
+
+        if parsed:
+            existing = await self.collection.find(
+                {"$or": [
+                    {"_id": {"$in": [product_id for _, _, product_id in parsed if product_id]}},
+                    {"name": {"$in": [product.name for _, product, _ in parsed]}},
+                ]},
+                {"name": 1, "category": 1}
+            ).to_list(length=None)
+            existing_by_id = {document["_id"]: document for document in existing}
+            existing_by_name = {document["name"]: document for document in existing}
+
+            # Las filas repetidas dentro del lote se agrupan en una sola operación por producto
+            increments: Dict[ObjectId, List[int]] = {}
+            inserts: Dict[str, Tuple[dict, List[int]]] = {}
+            for position, product, product_id in parsed:
+                target = existing_by_id.get(product_id) or existing_by_name.get(product.name)
+                if target:
+                    increments.setdefault(target["_id"], []).append(position)
+                elif product.name in inserts:
+                    document, positions = inserts[product.name]
+                    document["stock"] += 1
+                    positions.append(position)
+                else:
+                    document = product.dict(by_alias=True, exclude={"id"})
+                    document["_id"] = ObjectId()
+                    inserts[product.name] = (document, [position])
+
+            operations = []
+            targets = []
+            # Documento afectado por cada operación, para actualizar el resumen por categoría
+            documents = []
+            for product_id, positions in increments.items():
+                operations.append(UpdateOne({"_id": product_id}, {"$inc": {"stock": len(positions)}}))
+                targets.append((product_id, positions, "updated"))
+                documents.append(existing_by_id[product_id])
+            for document, positions in inserts.values():
+                operations.append(InsertOne(document))
+                targets.append((document["_id"], positions, "created"))
+                documents.append(document)
+
+            failed = {}
+            try:
+                await self.collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as err:
+                failed = {error["index"]: error["errmsg"] for error in err.details["writeErrors"]}
+
+            for index, (product_id, positions, status) in enumerate(targets):
+                for order, position in enumerate(positions):
+                    if index in failed:
+                        results[position] = {"row": offset + position, "status": "error", "detail": failed[index]}
+                    else:
+                        results[position] = {
+                            "row": offset + position,
+                            "status": status if order == 0 else "updated",
+                            "id": str(product_id),
+                        }
+
+            if self.cache:
+                self.cache.invalidate_products(product_id for product_id, _, _ in targets)
+
+            applied = [(documents[index], len(positions), status)
+                       for index, (_, positions, status) in enumerate(targets) if index not in failed]
+            await self._record_facets(
+                created=[document for document, _, status in applied if status == "created"],
+                stock_deltas=CategoryFacetRepository.stock_deltas(
+                    (document["category"], rows) for document, rows, status in applied if status == "updated"
+                ),
+            )
+
+        return results
+
+    async def get_product_by_id(self, product_id: str, use_cache: bool = True):
+        """Obtiene un producto por id; los caminos sensibles al stock pueden pasar `use_cache=False`."""
+        product = self.cache.get_product(product_id) if self.cache and use_cache else None
+        if product is not None:
+            return Product(**product)
         try:
             product = await self.collection.find_one({"_id": ObjectId(product_id)})
             if product:
-                product["_id"] = str(product["_id"])
+                stringify_id(product)
+                await self._resolve_stock([product])
+                if self.cache:
+                    self.cache.set_product(product)
                 return Product(**product)
             else:
                 raise HTTPException(status_code=404, detail="Producto no encontrado.")
         except Exception as e:
             raise HTTPException(status_code=400, detail="Error al obtener el producto.")
+
+    async def _record_facets(self, created: Iterable[dict] = (), stock_deltas: Optional[Dict[str, int]] = None):
+        if self.facets:
+            await self.facets.record(created=created, stock_deltas=stock_deltas)
+
+    async def _resolve_stock(self, products: List[dict]):
+        """Calcula el stock total de los productos con stripes y quita el campo interno `stripes`."""
+        if self.inventory:
+            await self.inventory.overlay_stock(products)
+        else:
+            for product in products:
+                product.pop("stripes", None)
+
+    def _invalidate(self, product_id: str, category: Optional[str] = None):
+        if self.cache:
+            self.cache.invalidate_product(product_id, category)
@@ -0,0 +1,332 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.repositories.order_repository import OrderRepository
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_TTL_SECONDS = int(os.getenv("STOCK_RESERVATION_TTL_SECONDS", "900"))
+# Tras este tiempo, una reserva reclamada (`checkout`, `releasing`) se considera abandonada por un proceso caído
+CLAIM_TIMEOUT_SECONDS = float(os.getenv("STOCK_RESERVATION_CLAIM_TIMEOUT_SECONDS", "300"))
+SWEEP_INTERVAL_SECONDS = float(os.getenv("STOCK_RESERVATION_SWEEP_SECONDS", "30"))
+
+
+# El contador `reserved` del producto solo existe mientras su stock no está repartido en stripes
+NOT_STRIPED = {"stripes": {"$exists": False}}
+
+
+def available_stock_at_least(quantity: int) -> dict:
+    """Condición `$expr`: stock menos lo reservado por otros carritos es al menos `quantity`."""
+    return {"$gte": [{"$subtract": ["$stock", {"$ifNull": ["$reserved", 0]}]}, quantity]}
+
+
+class ReservationRepository:
+    """
+    Reservas de stock por usuario y producto. Al agregar al carrito se incrementa el contador
+    `reserved` del producto y se registra la reserva con un vencimiento; el sweeper libera las
+    vencidas y el checkout las convierte en descuentos de stock.
+
+    Estados de una reserva: `active`, `checkout` (reclamada por un checkout en curso o por un
+    pedido en cola) y `releasing` (reclamada por el sweeper). Los reclamos llevan `claimed_at`;
+    el sweeper retoma los que un proceso caído dejó a medias (`recover_stale()`).
+
+    En los productos repartidos en stripes la reserva es orientativa y no escribe en el documento
+    del producto, que es justo el que las stripes buscan descargar: su contador `reserved` se
+    elimina al repartirlo y se recalcula al volver a un único contador.
+    """
+    COLLECTION = "reservations"
+    INDEXES = [
+        IndexModel([("user_id", ASCENDING), ("product_id", ASCENDING), ("status", ASCENDING)],
+                   name="user_id_1_product_id_1_status_1", unique=True),
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)], name="status_1_expires_at_1"),
+        IndexModel([("token", ASCENDING)], name="token_1", sparse=True),
+        IndexModel([("status", ASCENDING), ("claimed_at", ASCENDING)], name="status_1_claimed_at_1"),
+    ]
+    # El antiguo índice TTL borraba reservas sin devolver su `reserved` al producto
+    RETIRED_INDEXES = ["expires_at_1"]
+    HOT_QUERIES = [
+        {"filter": {"user_id": "", "product_id": "", "status": "active"}},
+        {"filter": {"status": "active", "expires_at": {"$lt": datetime(2000, 1, 1)}}},
+        {"filter": {"token": ""}},
+        {"filter": {"status": "releasing", "claimed_at": {"$not": {"$gte": datetime(2000, 1, 1)}}}},
+    ]
+
+    def __init__(self, db, ttl_seconds: int = RESERVATION_TTL_SECONDS,
+                 claim_timeout: float = CLAIM_TIMEOUT_SECONDS):
+        self.collection = db[self.COLLECTION]
+        self.products_collection = db["products"]
+        self.orders_collection = db[OrderRepository.COLLECTION]
+        self.stripes_collection = db["inventory_stripes"]
+        self.ttl_seconds = ttl_seconds
+        self.claim_timeout = claim_timeout
+
+    async def reserve(self, user_id: str, product_id: str, quantity: int):
+        """Reserva `quantity` unidades del producto para el usuario o amplía su reserva activa."""
+        if quantity <= 0:
+            raise HTTPException(status_code=400, detail="La cantidad debe ser mayor que cero.")
+        try:
+            product_oid = ObjectId(product_id)
+        except (InvalidId, TypeError):
+            raise HTTPException(status_code=400, detail="ID de producto inválido.")
+
+        result = await self.products_collection.update_one(
+            {"_id": product_oid, **NOT_STRIPED, "$expr": available_stock_at_least(quantity)},
+            {"$inc": {"reserved": quantity}}
+        )
+        counted = result.modified_count == 1
+        if not counted:
+            product = await self.products_collection.find_one({"_id": product_oid}, {"stripes": 1})
+            if not product:
+                raise HTTPException(status_code=404, detail="Producto no encontrado.")
+            # En productos con stripes el stock no está en el documento: la reserva es orientativa
+            # y el checkout garantiza que no se venda de más
+            if not product.get("stripes"):
+                raise HTTPException(status_code=400, detail="Stock insuficiente para la cantidad solicitada.")
+
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl_seconds)
+        query = {"user_id": user_id, "product_id": product_id, "status": "active"}
+        update = {"$inc": {"quantity": quantity}, "$set": {"expires_at": expires_at}}
+        try:
+            try:
+                await self.collection.update_one(query, update, upsert=True)
+            except DuplicateKeyError:
+                await self.collection.update_one(query, update)
+        except Exception:
+            if counted:
+                await self.return_reserved(product_oid, quantity)
+            raise
+
+    async def release(self, user_id: str, product_id: str, quantity: Optional[int] = None):
+        """Libera `quantity` unidades de la reserva activa (toda la reserva si es `None`)."""
+        query = {"user_id": user_id, "product_id": product_id, "status": "active"}
+        if quantity is None:
+            reservation = await self.collection.find_one_and_delete(query)
+            released = reservation["quantity"] if reservation else 0
+        else:
+            reservation = await self.collection.find_one_and_update(
+                {**query, "quantity": {"$gte": quantity}},
+                {"$inc": {"quantity": -quantity}},
+                return_document=ReturnDocument.AFTER,
+            )
+            released = quantity if reservation else 0
+            if reservation and reservation["quantity"] <= 0:
+                await self.collection.delete_one({"_id": reservation["_id"], "quantity": {"$lte": 0}})
+
+        if released:
+            await self.return_reserved(ObjectId(product_id), released)
+
+    async def set_quantity(self, user_id: str, product_id: str, quantity: int) -> int:
+        """Ajusta la reserva activa para que cubra exactamente `quantity` unidades. Devuelve la cantidad anterior."""
+        reservation = await self.collection.find_one(
+            {"user_id": user_id, "product_id": product_id, "status": "active"}, {"quantity": 1}
+        )
+        previous = reservation["quantity"] if reservation else 0
+        delta = quantity - previous
+        if delta > 0:
+            await self.reserve(user_id, product_id, delta)
+        elif delta < 0:
+            await self.release(user_id, product_id, -delta)
+        return previous
+
+    async def claim(self, user_id: str) -> Tuple[str, Dict[ObjectId, int]]:
+        """
+        Reclama para un checkout las reservas activas del usuario, de modo que el sweeper
+        ya no pueda liberarlas. Devuelve el token del reclamo y las cantidades por producto.
+        """
+        token = uuid.uuid4().hex
+        await self.collection.update_many(
+            {"user_id": user_id, "status": "active"},
+            {"$set": {"status": "checkout", "token": token, "claimed_at": datetime.utcnow()}}
+        )
+        reservations = await self.collection.find({"token": token}).to_list(length=None)
+        reserved: Dict[ObjectId, int] = {}
+        for reservation in reservations:
+            product_id = ObjectId(reservation["product_id"])
+            reserved[product_id] = reserved.get(product_id, 0) + reservation["quantity"]
+        return token, reserved
+
+    async def confirm(self, token: str, consumed: Iterable[ObjectId], session=None):
+        """
+        Elimina las reservas reclamadas tras un checkout exitoso. Las de productos que no
+        estaban en el carrito no se consumieron y se liberan. Se puede repetir sin liberar dos veces.
+        """
+        consumed = {str(product_id) for product_id in consumed}
+        leftovers = await self.collection.find(
+            {"token": token, "product_id": {"$nin": list(consumed)}}, session=session
+        ).to_list(length=None)
+        for reservation in leftovers:
+            await self._release_claimed(reservation, session=session)
+        await self.collection.delete_many({"token": token}, session=session)
+
+    async def restore(self, token: str):
+        """Devuelve a `active` las reservas reclamadas por un checkout que falló."""
+        for reservation in await self.collection.find({"token": token}).to_list(length=None):
+            await self._reactivate(reservation)
+
+    async def _reactivate(self, reservation: dict):
+        try:
+            await self.collection.update_one(
+                {"_id": reservation["_id"]},
+                {"$set": {"status": "active"}, "$unset": {"token": "", "claimed_at": ""}}
+            )
+        except DuplicateKeyError:
+            # El usuario volvió a agregar el producto mientras tanto: se suma a esa reserva activa
+            await self.collection.update_one(
+                {"user_id": reservation["user_id"], "product_id": reservation["product_id"], "status": "active"},
+                {"$inc": {"quantity": reservation["quantity"]}}
+            )
+            await self.collection.delete_one({"_id": reservation["_id"]})
+
+    async def sweep_expired(self, limit: int = 1000) -> int:
+        """Libera hasta `limit` reservas vencidas y devuelve cuántas liberó."""
+        released = 0
+        while released < limit:
+            now = datetime.utcnow()
+            reservation = await self.collection.find_one_and_update(
+                {"status": "active", "expires_at": {"$lt": now}},
+                {"$set": {"status": "releasing", "claimed_at": now}},
+            )
+            if reservation is None:
+                break
+            await self._release_claimed(reservation)
+            released += 1
+        return released
+
+    async def recover_stale(self, limit: int = 1000) -> int:
+        """
+        Retoma hasta `limit` reclamos abandonados hace más de `claim_timeout` segundos por un
+        proceso que cayó, y devuelve cuántas reservas resolvió:
+
+        - `releasing`: se completa la liberación; la marca en el producto evita descontar dos veces.
+        - `checkout` de un pedido: si el pedido ya terminó se confirman como lo haría el worker; si
+          sigue en cola, se dejan para el worker.
+        - `checkout` síncrono: las de productos que llevan el token en `pending_checkouts` (o en
+          `stripe_checkouts`, en el producto o sus stripes) ya se convirtieron en descuento y se
+          eliminan; las demás vuelven a `active`.
+        """
+        recovered = 0
+        while recovered < limit:
+            now = datetime.utcnow()
+            reservation = await self.collection.find_one_and_update(
+                {"status": "releasing", "claimed_at": self._stale_before(now)},
+                {"$set": {"claimed_at": now}},
+            )
+            if reservation is None:
+                break
+            await self._release_claimed(reservation)
+            recovered += 1
+
+        stale = {"status": "checkout", "claimed_at": self._stale_before(datetime.utcnow())}
+        for token in await self.collection.distinct("token", stale):
+            if recovered >= limit:
+                break
+            recovered += await self._recover_checkout(token)
+        return recovered
+
+    async def _recover_checkout(self, token: str) -> int:
+        now = datetime.utcnow()
+        # Se renueva el reclamo para que otro sweeper no lo resuelva al mismo tiempo
+        result = await self.collection.update_many(
+            {"token": token, "status": "checkout", "claimed_at": self._stale_before(now)},
+            {"$set": {"claimed_at": now}}
+        )
+        if not result.modified_count:
+            return 0
+
+        order = await self.orders_collection.find_one({"reservation_token": token}, {"status": 1, "items": 1})
+        if order is not None:
+            if order["status"] == "completed":
+                await self.confirm(token, consumed={item["product_id"] for item in order["items"]})
+            elif order["status"] == "failed":
+                await self.confirm(token, consumed=())
+            else:
+                return 0
+            return result.modified_count
+
+        reservations = await self.collection.find({"token": token}).to_list(length=None)
+        # Las marcas no tienen índice: se buscan solo en los productos reservados y sus stripes
+        product_ids = [ObjectId(reservation["product_id"]) for reservation in reservations]
+        by_id = {"_id": {"$in": product_ids}}
+        by_product = {"product_id": {"$in": product_ids}}
+        applied = {
+            str(product["_id"]) for product in await self.products_collection.find(
+                {**by_id, "$or": [{"pending_checkouts": token}, {"stripe_checkouts.token": token}]}, {"_id": 1}
+            ).to_list(length=None)
+        }
+        applied.update(str(product_id) for product_id in await self.stripes_collection.distinct(
+            "product_id", {**by_product, "stripe_checkouts.token": token}
+        ))
+        for reservation in reservations:
+            if reservation["product_id"] in applied:
+                await self.collection.delete_one({"_id": reservation["_id"]})
+            else:
+                await self._reactivate(reservation)
+        if applied:
+            await self.products_collection.update_many(
+                {**by_id, "pending_checkouts": token}, {"$pull": {"pending_checkouts": token}}
+            )
+            for collection, query in ((self.products_collection, by_id), (self.stripes_collection, by_product)):
+                await collection.update_many(
+                    {**query, "stripe_checkouts.token": token}, {"$pull": {"stripe_checkouts": {"token": token}}}
+                )
+        return result.modified_count
+
+    def _stale_before(self, now: datetime) -> dict:
+        # Sin `claimed_at`: reclamos anteriores a este campo, abandonados por definición
+        return {"$not": {"$gte": now - timedelta(seconds=self.claim_timeout)}}
+
+    async def _release_claimed(self, reservation: dict, session=None):
+        """
+        Devuelve al producto lo reservado y elimina la reserva. El descuento de `reserved` marca el
+        producto con el id de la reserva en el mismo update, de modo que repetirlo tras una caída
+        no lo aplica dos veces; la marca se quita una vez eliminada la reserva.
+        """
+        product_id = ObjectId(reservation["product_id"])
+        await self.products_collection.update_one(
+            {"_id": product_id, **NOT_STRIPED, "released_reservations": {"$ne": reservation["_id"]}},
+            {"$inc": {"reserved": -reservation["quantity"]}, "$push": {"released_reservations": reservation["_id"]}},
+            session=session,
+        )
+        await self.collection.delete_one({"_id": reservation["_id"]}, session=session)
+        await self.products_collection.update_one(
+            {"_id": product_id}, {"$pull": {"released_reservations": reservation["_id"]}}, session=session
+        )
+
+    async def return_reserved(self, product_id: ObjectId, quantity: int):
+        """Descuenta `quantity` del contador `reserved` del producto, si no está repartido en stripes."""
+        await self.products_collection.update_one(
+            {"_id": product_id, **NOT_STRIPED}, {"$inc": {"reserved": -quantity}}
+        )
+
+    async def held_quantity(self, product_id: ObjectId) -> int:
+        """Unidades del producto retenidas por reservas vigentes, para recalcular su contador `reserved`."""
+        rows = await self.collection.aggregate([
+            {"$match": {"product_id": str(product_id)}},
+            {"$group": {"_id": None, "quantity": {"$sum": "$quantity"}}},
+        ]).to_list(length=None)
+        return rows[0]["quantity"] if rows else 0
+
+    async def run_sweeper(self, interval: float = SWEEP_INTERVAL_SECONDS):
+        """Tarea de fondo que libera periódicamente las reservas vencidas y retoma los reclamos abandonados."""
+        while True:
+            try:
+                released = await self.sweep_expired()
+                if released:
+                    logger.info("Reservas vencidas liberadas: %d", released)
+                recovered = await self.recover_stale()
+                if recovered:
+                    logger.warning("Reservas de reclamos abandonados resueltas: %d", recovered)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error al liberar reservas vencidas")
+            await asyncio.sleep(interval)
@@ -1,11 +1,16 @@
 from app.models.user import User
 from bson import ObjectId
 from typing import Optional
+from pymongo import ASCENDING, IndexModel
 
 
 class UserRepository:
+    COLLECTION = "users"
+    INDEXES = [IndexModel([("email", ASCENDING)], name="email_1", unique=True)]
+    HOT_QUERIES = [{"filter": {"email": ""}}, {"filter": {"_id": ObjectId("0" * 24)}}]
+
     def __init__(self, db):
-        self.collection = db["users"]
+        self.collection = db[self.COLLECTION]
 
     async def create_user(self, user: User):
         # Insertar usuario y devolver el documento completo con `_id` como string
@@ -27,3 +32,18 @@ class UserRepository:
             user_data["_id"] = str(user_data["_id"])
             return User(**user_data)
         return None
+
+    async def get_token_version(self, user_id: str) -> Optional[int]:
+        user_data = await self.collection.find_one({"_id": ObjectId(user_id)}, {"token_version": 1})
+        if user_data:
+            return user_data.get("token_version", 0)
+        return None
+
+    async def increment_token_version(self, user_id: str):
+        await self.collection.update_one({"_id": ObjectId(user_id)}, {"$inc": {"token_version": 1}})
+
+    async def update_password_hash(self, user_id: str, hashed_password: str):
+        await self.collection.update_one(
+            {"_id": ObjectId(user_id)},
+            {"$set": {"hashed_password": hashed_password}}
+        )
@@ -1,75 +1,185 @@
-from fastapi import APIRouter, HTTPException, Depends, status
-from app.auth.auth import create_access_token, get_current_user
+import logging
+import orjson
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request, status
+from fastapi.responses import Response, StreamingResponse
+from pymongo.errors import DuplicateKeyError
+from app.auth.auth import create_user_access_token, get_current_token_user, revoke_user_tokens
 from app.models.product import Product
-from app.models.cart import Cart, CartItem
-from app.models.user import User, UserCreate, UserLogin
-from app.repositories.product_repository import ProductRepository
+from app.models.cart import Cart, CartItem, CartItemQuantity
+from app.models.user import User, TokenUser, UserCreate, UserLogin
+from app.repositories.product_repository import ProductRepository, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.cache import ProductCache
+from app.http_cache import SerializedResponse, conditional_response
+from app.serialization import MongoJSONResponse, dumps
 from app.repositories.cart_repository import CartRepository
-from app.database import MongoDBConnection
+from app.dependencies import (get_cart_repository, get_order_repository, get_password_hasher, get_product_repository,
+                              get_user_repository)
 from datetime import timedelta
-from passlib.context import CryptContext
+from app.auth.passwords import PasswordHasher
 
 from app.repositories.user_repository import UserRepository
+from app.repositories.order_repository import OrderRepository
 
 router = APIRouter()
-
-# Obtener la conexión de la base de datos y repositorios
-db = MongoDBConnection().get_db()
-product_repo = ProductRepository(db)
-cart_repo = CartRepository(db)
-user_repo = UserRepository(db)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger(__name__)
 
 
 @router.post("/register", response_model=User)
-async def register_user(user_data: UserCreate):
+async def register_user(user_data: UserCreate, user_repo: UserRepository = Depends(get_user_repository),
+                        password_hasher: PasswordHasher = Depends(get_password_hasher)):
     existing_user = await user_repo.get_user_by_email(user_data.email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email ya registrado.")
 
-    hashed_password = pwd_context.hash(user_data.password)
+    hashed_password = await password_hasher.hash(user_data.password)
     user = User(name=user_data.name, email=user_data.email, hashed_password=hashed_password)
-    new_user = await user_repo.create_user(user)
+    try:
+        new_user = await user_repo.create_user(user)
+    except DuplicateKeyError:
+        # Registro concurrente con el mismo email
+        raise HTTPException(status_code=400, detail="Email ya registrado.")
     return new_user
 
 
+async def _ndjson(products):
+    async for product in products:
+        yield dumps(product) + b"\n"
+
+
+async def _page_response(request: Request, product_repo: ProductRepository, category: Optional[str],
+                         after: Optional[str], limit: int) -> Response:
+    """
+    Página del catálogo con validadores HTTP (`ETag`, `Last-Modified`). Los bytes serializados
+    se guardan en el cache de productos, así que una petición repetida no toca MongoDB ni orjson.
+    """
+    cache = product_repo.cache
+    key = ProductCache.list_key(category, "response", after, limit)
+    cached = cache.get_response(key) if cache else None
+    if cached is None:
+        version = cache.version if cache else 0
+        products, next_cursor = await product_repo.get_products_page(category=category, after=after, limit=limit)
+        if category is not None and not products and after is None:
+            raise HTTPException(status_code=404, detail="No se encontraron productos en esta categoría.")
+        cached = SerializedResponse.build(products, {"X-Next-Cursor": next_cursor} if next_cursor else None)
+        if cache:
+            cache.set_response(key, cached, version)
+    return conditional_response(request, cached)
+
+
 @router.get("/products", response_model=list[Product])
-async def get_all_products():
-    """Endpoint para obtener todos los productos."""
+async def get_all_products(
+    request: Request,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    product_repo: ProductRepository = Depends(get_product_repository),
+):
+    """
+    Endpoint para obtener los productos paginados por cursor (`after`, `limit`).
+    El cursor de la página siguiente se devuelve en la cabecera `X-Next-Cursor`.
+    Con `stream=true` devuelve el catálogo completo como NDJSON. Los documentos ya vienen
+    proyectados del repositorio, por lo que se serializan sin validarlos de nuevo.
+    Las páginas admiten peticiones condicionales (`If-None-Match`, `If-Modified-Since`).
+    """
     try:
-        products = await product_repo.get_all_products()
-        return products
+        if stream:
+            return StreamingResponse(_ndjson(product_repo.stream_products(after=after)),
+                                     media_type="application/x-ndjson")
+
+        return await _page_response(request, product_repo, None, after, limit)
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail="Error al obtener productos: " + str(e))
 
 
+@router.get("/products/search")
+async def search_products(
+    request: Request,
+    q: Optional[str] = Query(None, min_length=1, max_length=200),
+    category: Optional[str] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    in_stock: bool = False,
+    sort: Optional[str] = Query(None, description="relevance, id, price, -price o name"),
+    fields: Optional[str] = Query(None, description="Campos separados por coma: name,category,price,stock"),
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    product_repo: ProductRepository = Depends(get_product_repository),
+):
+    """
+    Endpoint de búsqueda en el catálogo: texto (`q`), categoría, rango de precio, solo con stock,
+    orden y proyección de campos. El cursor de la página siguiente llega en `X-Next-Cursor`.
+    Se declara antes de `/products/{category}` para que `search` no se tome como categoría.
+    """
+    products, next_cursor = await product_repo.search_products(
+        text=q, category=category, min_price=min_price, max_price=max_price, in_stock=in_stock, sort=sort,
+        fields=[field.strip() for field in fields.split(",") if field.strip()] if fields else None,
+        after=after, limit=limit,
+    )
+    body = SerializedResponse.build(products, {"X-Next-Cursor": next_cursor} if next_cursor else None)
+    return conditional_response(request, body)
+
+
+@router.get("/products/facets")
+async def get_product_facets(request: Request, product_repo: ProductRepository = Depends(get_product_repository)):
+    """
+    Endpoint con la cantidad de productos, el stock total y el precio mínimo, máximo y promedio
+    de cada categoría, leídos del resumen materializado (un documento por categoría).
+    """
+    facets = await product_repo.get_facets()
+    return conditional_response(request, SerializedResponse.build(facets))
+
+
+@router.post("/products/facets/rebuild")
+async def rebuild_product_facets(product_repo: ProductRepository = Depends(get_product_repository)):
+    """Recalcula el resumen de categorías desde la colección de productos."""
+    categories = await product_repo.rebuild_facets()
+    return {"categories": categories}
+
+
 @router.get("/products/{category}", response_model=list[Product])
-async def get_products_by_category(category: str):
-    """Endpoint para obtener productos por categoría."""
+async def get_products_by_category(
+    request: Request,
+    category: str,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    product_repo: ProductRepository = Depends(get_product_repository),
+):
+    """Endpoint para obtener productos por categoría, con la misma paginación que `/products`."""
     try:
-        products = await product_repo.get_products_by_category(category)
-        if not products:
-            raise HTTPException(status_code=404, detail="No se encontraron productos en esta categoría.")
-        return products
+        if stream:
+            return StreamingResponse(_ndjson(product_repo.stream_products(category=category, after=after)),
+                                     media_type="application/x-ndjson")
+
+        return await _page_response(request, product_repo, category, after, limit)
+    except HTTPException as e:
+        raise e
     except Exception as e:
-        print("Error en get_products_by_category:", e)
+        logger.exception("Error en get_products_by_category")
         raise HTTPException(status_code=500, detail="Error interno del servidor: " + str(e))
 
 
 @router.post("/cart")
-async def add_to_cart(item: CartItem, current_user: User = Depends(get_current_user)):
+async def add_to_cart(item: CartItem, current_user: TokenUser = Depends(get_current_token_user),
+                      product_repo: ProductRepository = Depends(get_product_repository),
+                      cart_repo: CartRepository = Depends(get_cart_repository)):
     """
     Endpoint para agregar o actualizar un producto en el carrito del usuario autenticado.
     """
     user_id = current_user.id
 
-    # Verificar si el producto existe y tiene suficiente stock
-    product = await product_repo.get_product_by_id(item.product_id)
-    if not product:
-        raise HTTPException(status_code=404, detail="Producto no encontrado.")
+    # Con reservas activas el repositorio verifica y reserva el stock de forma atómica
+    if not cart_repo.reservations:
+        # Verificar si el producto existe y tiene suficiente stock
+        product = await product_repo.get_product_by_id(item.product_id, use_cache=False)
+        if not product:
+            raise HTTPException(status_code=404, detail="Producto no encontrado.")
 
-    if product.stock < item.quantity:
-        raise HTTPException(status_code=400, detail="Stock insuficiente para la cantidad solicitada.")
+        if product.stock < item.quantity:
+            raise HTTPException(status_code=400, detail="Stock insuficiente para la cantidad solicitada.")
 
     # Llamar a `add_to_cart` del repositorio con `user_id` y `item` ya instanciado como `CartItem`
     await cart_repo.add_to_cart(user_id=user_id, item=item)
@@ -79,19 +189,57 @@ async def add_to_cart(item: CartItem, current_user: User = Depends(get_current_u
     return {"message": "Producto agregado o actualizado en el carrito"}
 
 
+@router.put("/cart/{product_id}")
+async def set_cart_item_quantity(product_id: str, body: CartItemQuantity,
+                                 current_user: TokenUser = Depends(get_current_token_user),
+                                 product_repo: ProductRepository = Depends(get_product_repository),
+                                 cart_repo: CartRepository = Depends(get_cart_repository)):
+    """Endpoint para fijar la cantidad de un producto en el carrito (0 lo elimina)."""
+    if body.quantity > 0 and not cart_repo.reservations:
+        product = await product_repo.get_product_by_id(product_id, use_cache=False)
+        if product.stock < body.quantity:
+            raise HTTPException(status_code=400, detail="Stock insuficiente para la cantidad solicitada.")
+
+    updated = await cart_repo.set_item_quantity(current_user.id, product_id, body.quantity)
+    if not updated:
+        raise HTTPException(status_code=404, detail="El producto no está en el carrito.")
+    return {"message": "Cantidad actualizada en el carrito"}
+
+
+@router.delete("/cart/{product_id}")
+async def remove_cart_item(product_id: str, current_user: TokenUser = Depends(get_current_token_user),
+                           cart_repo: CartRepository = Depends(get_cart_repository)):
+    """Endpoint para eliminar un producto del carrito."""
+    removed = await cart_repo.remove_item(current_user.id, product_id)
+    if not removed:
+        raise HTTPException(status_code=404, detail="El producto no está en el carrito.")
+    return {"message": "Producto eliminado del carrito"}
+
+
 @router.get("/cart", response_model=Cart)
-async def get_user_cart(current_user: User = Depends(get_current_user)):
+async def get_user_cart(current_user: TokenUser = Depends(get_current_token_user),
+                        cart_repo: CartRepository = Depends(get_cart_repository)):
     """Endpoint para ver el contenido del carrito de un usuario con detalles de los productos."""
     user_id = current_user.id
     cart = await cart_repo.get_cart(user_id)
     if not cart.items:
         raise HTTPException(status_code=404, detail="Carrito vacío o no encontrado.")
-    return cart
+    # Las líneas son `CartLine` ya proyectadas: se serializan con orjson sin validar de nuevo
+    return MongoJSONResponse({"user_id": cart.user_id, "items": cart.items})
 
 
 @router.post("/checkout")
-async def checkout(current_user: User = Depends(get_current_user)):
-    """Endpoint para finalizar la compra."""
+async def checkout(current_user: TokenUser = Depends(get_current_token_user),
+                   cart_repo: CartRepository = Depends(get_cart_repository),
+                   idempotency_key: Optional[str] = Header(None, max_length=128)):
+    """
+    Endpoint para finalizar la compra. Con `CHECKOUT_MODE=async` crea un pedido y responde `202`
+    sin esperar el descuento de stock; `Idempotency-Key` evita pedidos duplicados al reintentar.
+    """
+    if cart_repo.orders:
+        order = await cart_repo.place_order(current_user.id, idempotency_key)
+        return MongoJSONResponse(OrderRepository.summary(order), status_code=status.HTTP_202_ACCEPTED,
+                                 headers={"Location": f"/orders/{order['_id']}"})
     try:
         result = await cart_repo.checkout(current_user.id)
         return result
@@ -101,8 +249,18 @@ async def checkout(current_user: User = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail="Error interno del servidor: " + str(e))
 
 
+@router.get("/orders/{order_id}")
+async def get_order(order_id: str, current_user: TokenUser = Depends(get_current_token_user),
+                    order_repo: Optional[OrderRepository] = Depends(get_order_repository)):
+    """Endpoint para consultar el estado de un pedido del checkout asíncrono."""
+    if order_repo is None:
+        raise HTTPException(status_code=404, detail="Pedido no encontrado.")
+    order = await order_repo.get_for_user(order_id, current_user.id)
+    return OrderRepository.summary(order)
+
+
 @router.post("/products", response_model=Product)
-async def create_product(product: Product):
+async def create_product(product: Product, product_repo: ProductRepository = Depends(get_product_repository)):
     """Endpoint para crear un nuevo producto en la tienda."""
     try:
         new_product = await product_repo.create_product(product)
@@ -111,20 +269,86 @@ async def create_product(product: Product):
         raise HTTPException(status_code=500, detail="Error al crear el producto: " + str(e))
 
 
+async def _json_rows(rows: list):
+    for row in rows:
+        yield row
+
+
+async def _ndjson_rows(request: Request):
+    """Lee el cuerpo NDJSON por fragmentos, sin cargarlo completo en memoria."""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _parse_json_line(line)
+    if buffer.strip():
+        yield _parse_json_line(buffer)
+
+
+def _parse_json_line(line: bytes):
+    try:
+        return orjson.loads(line)
+    except ValueError:
+        # Se devuelve tal cual para que el repositorio lo reporte como fila con error
+        return line.decode("utf-8", errors="replace")
+
+
+@router.post("/products/bulk")
+async def bulk_create_products(request: Request,
+                               product_repo: ProductRepository = Depends(get_product_repository)):
+    """
+    Endpoint para cargar productos en lote. Acepta un arreglo JSON o NDJSON
+    (`Content-Type: application/x-ndjson`) y devuelve el resultado de cada fila.
+    """
+    if "ndjson" in request.headers.get("content-type", ""):
+        rows = _ndjson_rows(request)
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="El cuerpo debe ser un arreglo JSON.")
+        if not isinstance(body, list):
+            raise HTTPException(status_code=400, detail="El cuerpo debe ser un arreglo JSON.")
+        rows = _json_rows(body)
+
+    return await product_repo.bulk_upsert_products(rows)
+
+
+@router.post("/products/{product_id}/stripes")
+async def set_product_stripes(product_id: str, count: int = Query(..., ge=0, le=64),
+                              product_repo: ProductRepository = Depends(get_product_repository)):
+    """
+    Reparte el stock de un producto muy demandado en `count` contadores para reducir la contención
+    del checkout. Con `count=0` se vuelve a un único contador en el documento del producto.
+    """
+    stock = await product_repo.set_stripes(product_id, count)
+    return {"product_id": product_id, "stripes": count, "stock": stock}
+
+
 @router.post("/login")
-async def login(user_data: UserLogin):
+async def login(user_data: UserLogin, user_repo: UserRepository = Depends(get_user_repository),
+                password_hasher: PasswordHasher = Depends(get_password_hasher)):
     # Verificar si el usuario existe
     user = await user_repo.get_user_by_email(user_data.email)
-    if not user or not pwd_context.verify(user_data.password, user.hashed_password):
+    valid, new_hash = (False, None)
+    if user:
+        valid, new_hash = await password_hasher.verify_and_update(user_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email o contraseña incorrectos",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # Rehash transparente si cambiaron los parámetros de bcrypt
+    if new_hash:
+        await user_repo.update_password_hash(user.id, new_hash)
+
     # Generar el token de acceso JWT
     access_token_expires = timedelta(minutes=60)
-    access_token = create_access_token(data={"sub": user.id}, expires_delta=access_token_expires)
+    access_token = create_user_access_token(user, expires_delta=access_token_expires)
 
     # Devolver el token de acceso y el ID del usuario
     return {
@@ -132,3 +356,11 @@ async def login(user_data: UserLogin):
         "token_type": "bearer",
         "user_id": user.id
     }
+
+
+@router.post("/logout")
+async def logout(current_user: TokenUser = Depends(get_current_token_user),
+                 user_repo: UserRepository = Depends(get_user_repository)):
+    """Revoca todos los tokens emitidos para el usuario autenticado."""
+    await revoke_user_tokens(user_repo, current_user.id)
+    return {"message": "Sesión cerrada."}
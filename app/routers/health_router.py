@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Depends, HTTPException
+from app.database import MongoDBConnection
+from app.dependencies import get_db_connection
+
+router = APIRouter(prefix="/health", tags=["health"])
+
+
+@router.get("/live")
+async def live():
+    """El proceso está en ejecución."""
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+async def ready(db_connection: MongoDBConnection = Depends(get_db_connection)):
+    """La instancia puede atender tráfico: MongoDB responde al ping."""
+    if not await db_connection.is_ready():
+        raise HTTPException(status_code=503, detail="MongoDB no disponible.")
+    return {"status": "ready"}
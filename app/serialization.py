@@ -0,0 +1,38 @@
+from dataclasses import fields, is_dataclass
+from typing import Any
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+
+def stringify_id(document: dict) -> dict:
+    """Convierte el `_id` de un documento de MongoDB a string, en el lugar."""
+    if isinstance(document.get("_id"), ObjectId):
+        document["_id"] = str(document["_id"])
+    return document
+
+
+def _default(value: Any):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if hasattr(value, "model_dump"):
+        return value.model_dump(by_alias=True)
+    if is_dataclass(value):
+        # Las filas eligen sus nombres de campo en JSON (por ejemplo `ProductRow.id` como `_id`)
+        if hasattr(value, "to_json"):
+            return value.to_json()
+        return {field.name: getattr(value, field.name) for field in fields(value)}
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """Serializa a JSON con orjson; los `ObjectId` se codifican como string."""
+    return orjson.dumps(content, default=_default, option=orjson.OPT_PASSTHROUGH_DATACLASS)
+
+
+class MongoJSONResponse(JSONResponse):
+    """Respuesta JSON serializada con orjson, que además acepta `ObjectId` y modelos Pydantic."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
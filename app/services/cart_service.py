@@ -9,7 +9,7 @@ class CartService:
     async def add_to_cart(self, cart: Cart):
         # Lógica para agregar al carrito y verificar disponibilidad
         for item in cart.items:
-            product = await self.product_repo.get_product_by_id(item.product_id)
+            product = await self.product_repo.get_product_by_id(item.product_id, use_cache=False)
             if product.stock < item.quantity:
                 raise ValueError("Stock insuficiente para el producto.")
         # Actualizar inventario
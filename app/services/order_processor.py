@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict
+
+from fastapi import HTTPException
+
+from app.models.rows import CartLine
+from app.repositories.cart_repository import CartRepository
+from app.repositories.order_repository import OrderRepository
+
+logger = logging.getLogger(__name__)
+
+ORDER_WORKERS = int(os.getenv("ORDER_WORKERS", "4"))
+ORDER_POLL_SECONDS = float(os.getenv("ORDER_POLL_SECONDS", "1"))
+ORDER_MAX_ATTEMPTS = int(os.getenv("ORDER_MAX_ATTEMPTS", "5"))
+ORDER_RETRY_DELAY_SECONDS = float(os.getenv("ORDER_RETRY_DELAY_SECONDS", "0.5"))
+
+
+class LeaseLost(Exception):
+    """El lease del pedido venció y otro worker lo tomó: este worker no debe cerrarlo."""
+
+
+class OrderProcessor:
+    """
+    Pool de workers asyncio que descuenta el stock de los pedidos en cola. Cada pedido se aplica
+    con el mismo `bulk_write` condicional del checkout síncrono y se marca como completado en la
+    misma transacción (o, sin replica set, con las líneas y las stripes marcadas con el id del
+    pedido), de modo que un reintento tras una caída no vuelve a descontar el stock.
+
+    Un reintento solo es seguro una vez vencido el lease del intento anterior: `ORDER_LEASE_SECONDS`
+    debe superar con holgura lo que tarda en procesarse un pedido.
+    """
+
+    def __init__(self, cart_repo: CartRepository, orders: OrderRepository, workers: int = ORDER_WORKERS,
+                 poll_interval: float = ORDER_POLL_SECONDS, max_attempts: int = ORDER_MAX_ATTEMPTS,
+                 retry_delay: float = ORDER_RETRY_DELAY_SECONDS):
+        self.cart_repo = cart_repo
+        self.orders = orders
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._counts: Dict[str, int] = {"completed": 0, "failed": 0, "retried": 0, "errors": 0}
+        self._processing_ms = 0.0
+
+    async def run(self):
+        """Tarea de fondo: `workers` workers que toman pedidos hasta que se cancela la tarea."""
+        await asyncio.gather(*(self._worker() for _ in range(self.workers)))
+
+    async def _worker(self):
+        while True:
+            try:
+                order = await self.orders.claim_next()
+                if order is None:
+                    await self.orders.wait_for_work(self.poll_interval)
+                    continue
+                await self.process(order)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # El pedido queda con su lease y otro intento lo retoma al vencer
+                self._counts["errors"] += 1
+                logger.exception("Error al procesar un pedido")
+                await asyncio.sleep(self.poll_interval)
+
+    async def process(self, order: dict):
+        """Descuenta el stock de un pedido tomado con `claim_next()` y lo cierra."""
+        started = time.perf_counter()
+        quantities = OrderRepository.quantities(order)
+        reserved = OrderRepository.reserved(order)
+        token = str(order["_id"])
+
+        if order.get("draft") and not await self.cart_repo.settle_draft(order):
+            logger.warning("Pedido borrador %s sin publicar: su checkout no vació el carrito o venció el lease",
+                           token)
+            return
+
+        if order["attempts"] > self.max_attempts:
+            await self._fail(order, quantities, reserved, "Se agotaron los reintentos del pedido.")
+            return
+
+        async def complete(session=None):
+            if not await self.orders.complete(order, session=session):
+                raise LeaseLost(token)
+
+        try:
+            await self.cart_repo.apply_stock(quantities, reserved, finalize=complete, token=token, resumable=True)
+        except LeaseLost:
+            logger.warning("El lease del pedido %s venció antes de completarlo", token)
+            return
+        except HTTPException as error:
+            if error.status_code == 409 and order["attempts"] < self.max_attempts:
+                # Contención con otro checkout: se reintenta más tarde
+                self._counts["retried"] += 1
+                await self.orders.retry(order, error.detail, self.retry_delay * order["attempts"])
+            else:
+                await self._fail(order, quantities, reserved, error.detail)
+            return
+
+        self._counts["completed"] += 1
+        self._processing_ms += (time.perf_counter() - started) * 1000
+        if self.cart_repo.reservations and order.get("reservation_token"):
+            await self.cart_repo.reservations.confirm(order["reservation_token"], consumed=quantities)
+        await self.cart_repo.record_stock_change(quantities, [CartLine(**item) for item in order["items"]])
+
+    async def _fail(self, order: dict, quantities, reserved, error: str):
+        """Cierra el pedido como fallido, devuelve el stock que haya quedado descontado y libera las reservas."""
+        if not await self.orders.fail(order, error):
+            return
+        self._counts["failed"] += 1
+        await self.cart_repo.revert_stock(str(order["_id"]), quantities, reserved)
+        if self.cart_repo.reservations and order.get("reservation_token"):
+            await self.cart_repo.reservations.confirm(order["reservation_token"], consumed=())
+
+    def stats(self) -> Dict[str, float]:
+        completed = self._counts["completed"]
+        return {
+            **self._counts,
+            "workers": self.workers,
+            "avg_processing_ms": round(self._processing_ms / completed, 3) if completed else 0.0,
+        }
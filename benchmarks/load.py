@@ -0,0 +1,428 @@
+"""
+Benchmark de carga de la API contra un MongoDB local o un stand-in en memoria.
+
+Levanta la app FastAPI en proceso (con su lifespan) y la ejercita con clientes httpx concurrentes.
+Reporta throughput y latencias p50/p95/p99 por endpoint y guarda el resultado en JSON para
+comparar entre commits.
+
+Escenarios:
+  flow      register -> login -> products -> cart -> checkout por cada usuario virtual
+  hot-sku   muchos compradores sobre un único producto; verifica que el stock no quede negativo y
+            reporta cuántos fallan al agregar al carrito y cuántos en el checkout. Para comparar con
+            y sin reservas de stock, ejecutar con STOCK_RESERVATIONS_ENABLED=true y =false; con
+            `--stripes K` el stock del producto se reparte en K contadores antes del checkout
+  checkout-engines
+            checkouts concurrentes de un único producto con el motor actual (`bulk_write` condicional)
+            y con el bucle anterior (leer, verificar y `$inc` por línea); compara checkouts/segundo y
+            si el stock quedó vendido de más. Se ejecuta directamente sobre los repositorios
+  cart-size latencia de GET /cart y POST /cart según el tamaño del carrito (1 a 500 items), con
+            los round trips y la duración de la hidratación (`get_cart_with_stats`) por tamaño
+  login-storm
+            p99 de GET /products sin logins y durante `--users` logins concurrentes, para verificar
+            que bcrypt no bloquea el event loop; reporta los `503` de la cola del hashing
+
+Uso:
+  pip install -r benchmarks/requirements.txt
+  python -m benchmarks.load --backend mongomock --users 200 --concurrency 50
+  python -m benchmarks.load --backend mongod --mongo-uri mongodb://localhost:27017 --baseline old.json
+
+El stand-in `mongomock` no implementa todas las operaciones (transacciones, change streams, `$lookup`
+con `let`, update pipelines). Con él los carritos pasan por la escritura diferida
+(`CART_WRITE_BEHIND_ENABLED=true`), que los hidrata con una consulta `$in`. Para resultados
+representativos usa `--backend mongod`.
+
+Las llamadas de preparación (registro, login, carga de productos, agregar al carrito) que fallan
+detienen el benchmark con un error en lugar de reportarse como resultado.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List
+
+# Valores por defecto para poder ejecutar sin `.env`; deben fijarse antes de importar la app
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+# Todos los usuarios virtuales comparten IP: sin esto el límite de `/register` y `/login` domina el resultado
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+import httpx  # noqa: E402
+
+
+class ScenarioError(RuntimeError):
+    """Una llamada que el escenario necesita que funcione respondió con un error."""
+
+
+def expect(response: httpx.Response, *statuses: int) -> httpx.Response:
+    """Detiene el benchmark si la respuesta no tiene uno de los códigos esperados (por defecto 2xx)."""
+    if statuses and response.status_code in statuses or not statuses and response.is_success:
+        return response
+    raise ScenarioError(f"{response.request.method} {response.request.url.path} respondió "
+                        f"{response.status_code}: {response.text[:300]}")
+
+
+class Recorder:
+    """Acumula latencias por endpoint."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.started = time.perf_counter()
+
+    async def request(self, client: httpx.AsyncClient, label: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[label].append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            self.errors[label] += 1
+        return response
+
+    def report(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        endpoints = {}
+        for label, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            endpoints[label] = {
+                "requests": len(values),
+                "errors": self.errors[label],
+                "throughput_rps": round(len(values) / elapsed, 2),
+                "p50_ms": round(percentile(values, 50), 3),
+                "p95_ms": round(percentile(values, 95), 3),
+                "p99_ms": round(percentile(values, 99), 3),
+                "max_ms": round(values[-1], 3),
+            }
+        return {"elapsed_s": round(elapsed, 3), "endpoints": endpoints}
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Rango más cercano: el menor valor con al menos `pct`% de las muestras por debajo o iguales
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def configure_backend(args):
+    from app.database import MongoDBConnection
+
+    os.environ["DATABASE_NAME"] = args.database or f"benchmark_{uuid.uuid4().hex[:8]}"
+    if args.stripes:
+        os.environ["STRIPED_INVENTORY_ENABLED"] = "true"
+    if args.backend == "mongomock":
+        from mongomock_motor import AsyncMongoMockClient
+
+        # Caminos que el stand-in puede ejecutar; se pueden sobrescribir con las variables de entorno
+        os.environ.setdefault("CART_WRITE_BEHIND_ENABLED", "true")
+        MongoDBConnection.configure(lambda url, **options: AsyncMongoMockClient())
+    else:
+        os.environ["MONGODB_URI"] = args.mongo_uri
+
+
+async def seed_products(client: httpx.AsyncClient, count: int, stock: int) -> List[str]:
+    rows = [
+        {"name": f"bench-{uuid.uuid4().hex[:12]}", "category": f"cat-{i % 20}", "price": 10 + i % 90, "stock": stock}
+        for i in range(count)
+    ]
+    response = expect(await client.post("/products/bulk", json=rows))
+    results = response.json()["results"]
+    errors = [row for row in results if row["status"] == "error"]
+    if errors:
+        raise ScenarioError(f"Carga de productos con errores: {errors[:3]}")
+    return [row["id"] for row in results]
+
+
+async def register_and_login(client: httpx.AsyncClient, recorder: Recorder) -> dict:
+    # `EmailStr` rechaza dominios reservados como `.local`
+    email = f"user-{uuid.uuid4().hex[:12]}@example.com"
+    credentials = {"email": email, "password": "benchmark-password"}
+    expect(await recorder.request(client, "POST /register", "POST", "/register",
+                                  json={"name": "Bench", **credentials}))
+    response = expect(await recorder.request(client, "POST /login", "POST", "/login", json=credentials))
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def flow_scenario(client: httpx.AsyncClient, recorder: Recorder, args):
+    product_ids = await seed_products(client, args.products, stock=1_000_000)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def virtual_user(index: int):
+        async with semaphore:
+            headers = await register_and_login(client, recorder)
+            await recorder.request(client, "GET /products", "GET", "/products", params={"limit": 100})
+            for offset in range(args.cart_items):
+                product_id = product_ids[(index + offset) % len(product_ids)]
+                expect(await recorder.request(client, "POST /cart", "POST", "/cart", headers=headers,
+                                              json={"product_id": product_id, "quantity": 1}))
+            expect(await recorder.request(client, "GET /cart", "GET", "/cart", headers=headers))
+            expect(await recorder.request(client, "POST /checkout", "POST", "/checkout", headers=headers), 200, 202)
+
+    await asyncio.gather(*(virtual_user(index) for index in range(args.users)))
+    return {}
+
+
+async def hot_sku_scenario(client: httpx.AsyncClient, recorder: Recorder, args):
+    stock = args.users // 2
+    product_id = (await seed_products(client, 1, stock=stock))[0]
+    if args.stripes:
+        expect(await client.post(f"/products/{product_id}/stripes", params={"count": args.stripes}))
+    buyers = await asyncio.gather(*(register_and_login(client, recorder) for _ in range(args.users)))
+    cart_responses = await asyncio.gather(*(
+        recorder.request(client, "POST /cart (hot SKU)", "POST", "/cart", headers=headers,
+                         json={"product_id": product_id, "quantity": 1})
+        for headers in buyers
+    ))
+    # Con reservas, un `400` al agregar es el rechazo esperado por falta de stock; cualquier otro error no
+    for response in cart_responses:
+        expect(response, 200, 400)
+    buyers = [headers for headers, response in zip(buyers, cart_responses) if response.status_code == 200]
+
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(
+        recorder.request(client, "POST /checkout (hot SKU)", "POST", "/checkout", headers=headers)
+        for headers in buyers
+    ))
+    elapsed = time.perf_counter() - started
+    for response in responses:
+        expect(response, 200, 202, 400, 409)
+
+    from bson import ObjectId
+    from main import app
+
+    db = app.state.db_connection.get_db()
+    product = await db["products"].find_one({"_id": ObjectId(product_id)})
+    stripes = await db["inventory_stripes"].find({"product_id": ObjectId(product_id)}).to_list(length=None)
+    final_stock = product["stock"] + sum(stripe["stock"] for stripe in stripes)
+    succeeded = sum(1 for response in responses if response.status_code == 200)
+    return {
+        "stripes": args.stripes,
+        "initial_stock": stock,
+        "cart_rejections": len(cart_responses) - len(buyers),
+        "checkouts": len(responses),
+        "succeeded": succeeded,
+        "failed_checkout_rate": round(1 - succeeded / len(responses), 4) if responses else 0.0,
+        "final_stock": final_stock,
+        "oversold": final_stock < 0 or any(stripe["stock"] < 0 for stripe in stripes) or succeeded > stock,
+        "checkouts_per_second": round(len(responses) / elapsed, 2),
+    }
+
+
+async def legacy_checkout(repo, user_id: str):
+    """Checkout anterior a la escritura condicional, solo como referencia: lee, verifica y descuenta por línea."""
+    from bson import ObjectId
+    from fastapi import HTTPException
+
+    cart = await repo.get_cart(user_id)
+    for item in cart.items:
+        product = await repo.products_collection.find_one({"_id": ObjectId(item.product_id)})
+        if product["stock"] < item.quantity:
+            raise HTTPException(status_code=400, detail="Stock insuficiente.")
+        await repo.products_collection.update_one({"_id": product["_id"]}, {"$inc": {"stock": -item.quantity}})
+    await repo.collection.update_one({"user_id": user_id}, {"$set": {"items": []}})
+    if repo.buffer:
+        repo.buffer.discard(user_id)
+
+
+async def checkout_engines_scenario(client: httpx.AsyncClient, recorder: Recorder, args):
+    from bson import ObjectId
+    from fastapi import HTTPException
+    from app.models.cart import CartItem
+    from app.repositories.cart_buffer import WriteBehindCarts
+    from app.repositories.cart_repository import CartRepository
+    from main import app
+
+    db = app.state.db_connection.get_db()
+    engines = {"loop": legacy_checkout, "bulk": lambda repo, user_id: repo.checkout(user_id)}
+    results = {}
+    for engine, checkout in engines.items():
+        stock = args.users // 2
+        product_id = (await seed_products(client, 1, stock=stock))[0]
+        # Sin reservas, para que todos los compradores lleguen al checkout; el stand-in no hidrata
+        # carritos guardados (`$lookup` con `let`), así que ahí los carritos quedan en el buffer
+        buffer = WriteBehindCarts(db["carts"]) if args.backend == "mongomock" else None
+        repo = CartRepository(db, buffer=buffer)
+        user_ids = [f"{engine}-{uuid.uuid4().hex[:12]}" for _ in range(args.users)]
+        for user_id in user_ids:
+            await repo.add_to_cart(user_id, CartItem(product_id=product_id, quantity=1))
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def attempt(user_id: str) -> bool:
+            async with semaphore:
+                try:
+                    await checkout(repo, user_id)
+                    return True
+                except HTTPException:
+                    return False
+
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(attempt(user_id) for user_id in user_ids))
+        elapsed = time.perf_counter() - started
+        final_stock = (await db["products"].find_one({"_id": ObjectId(product_id)}))["stock"]
+        succeeded = sum(outcomes)
+        results[engine] = {
+            "initial_stock": stock,
+            "checkouts": len(outcomes),
+            "succeeded": succeeded,
+            "final_stock": final_stock,
+            "oversold": final_stock < 0 or succeeded > stock,
+            "checkouts_per_second": round(len(outcomes) / elapsed, 2),
+        }
+    if results["bulk"]["oversold"]:
+        raise RuntimeError(f"El checkout vendió de más: {results['bulk']}")
+    return results
+
+
+async def cart_size_scenario(client: httpx.AsyncClient, recorder: Recorder, args):
+    from app.auth.auth import decode_token
+    from main import app
+
+    sizes = [1, 10, 50, 100, 250, 500]
+    product_ids = await seed_products(client, max(sizes), stock=1_000_000)
+    hydration = {}
+    for size in sizes:
+        headers = await register_and_login(client, recorder)
+        for product_id in product_ids[:size]:
+            expect(await client.post("/cart", headers=headers, json={"product_id": product_id, "quantity": 1}))
+        for _ in range(args.repeat):
+            expect(await recorder.request(client, f"GET /cart ({size} items)", "GET", "/cart", headers=headers))
+            expect(await recorder.request(client, f"POST /cart ({size} items)", "POST", "/cart", headers=headers,
+                                          json={"product_id": product_ids[0], "quantity": 1}))
+
+        user_id = decode_token(headers["Authorization"].split()[1])["sub"]
+        cart, stats = await app.state.cart_repo.get_cart_with_stats(user_id)
+        if stats.items != size or stats.round_trips > 1:
+            raise RuntimeError(f"Hidratación de un carrito de {size} items: {stats}")
+        hydration[size] = {"round_trips": stats.round_trips, "elapsed_ms": round(stats.elapsed_ms, 3)}
+    return {"cart_sizes": sizes, "hydration": hydration}
+
+
+async def login_storm_scenario(client: httpx.AsyncClient, recorder: Recorder, args):
+    await seed_products(client, args.products, stock=1_000)
+    email = f"storm-{uuid.uuid4().hex[:12]}@example.com"
+    credentials = {"email": email, "password": "benchmark-password"}
+    expect(await client.post("/register", json={"name": "Bench", **credentials}))
+
+    async def poll_products(label: str, stop: asyncio.Event):
+        while not stop.is_set():
+            expect(await recorder.request(client, label, "GET", "/products", params={"limit": 100}))
+
+    async def measure(label: str, load):
+        stop = asyncio.Event()
+        pollers = [asyncio.create_task(poll_products(label, stop)) for _ in range(args.concurrency)]
+        try:
+            await load
+        finally:
+            stop.set()
+            await asyncio.gather(*pollers)
+        return round(percentile(sorted(recorder.latencies[label]), 99), 3)
+
+    # Misma carga de lecturas sin logins y durante `--users` logins concurrentes
+    idle_p99 = await measure("GET /products (idle)", asyncio.sleep(1))
+    logins = asyncio.gather(*(
+        recorder.request(client, "POST /login (storm)", "POST", "/login", json=credentials)
+        for _ in range(args.users)
+    ))
+    storm_p99 = await measure("GET /products (login storm)", logins)
+    statuses = defaultdict(int)
+    for response in logins.result():
+        # `503` es el rechazo de la cola acotada del hashing; cualquier otro error detiene el benchmark
+        statuses[expect(response, 200, 503).status_code] += 1
+
+    from main import app
+
+    return {
+        "logins": args.users,
+        "login_statuses": dict(statuses),
+        "products_p99_idle_ms": idle_p99,
+        "products_p99_login_storm_ms": storm_p99,
+        "password_hasher": app.state.password_hasher.stats(),
+    }
+
+
+SCENARIOS = {"flow": flow_scenario, "hot-sku": hot_sku_scenario, "checkout-engines": checkout_engines_scenario,
+             "cart-size": cart_size_scenario, "login-storm": login_storm_scenario}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(baseline: dict, current: dict):
+    print(f"\nComparación con {baseline.get('commit')}:")
+    for label, stats in current["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(label)
+        if not previous:
+            continue
+        for key in ("p50_ms", "p99_ms", "throughput_rps"):
+            if previous[key]:
+                change = (stats[key] - previous[key]) / previous[key] * 100
+                print(f"  {label:32} {key:15} {previous[key]:>10} -> {stats[key]:>10} ({change:+.1f}%)")
+
+
+async def run(args) -> dict:
+    configure_backend(args)
+    from main import app
+
+    recorder = Recorder()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60) as client:
+            recorder.started = time.perf_counter()
+            extra = await SCENARIOS[args.scenario](client, recorder, args)
+        if app.state.cart_buffer:
+            # Escrituras ahorradas con CART_WRITE_BEHIND_ENABLED=true
+            extra["cart_write_behind"] = app.state.cart_buffer.stats()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        **recorder.report(),
+        "scenario": extra,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="flow")
+    parser.add_argument("--backend", choices=("mongomock", "mongod"), default="mongomock")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default=None, help="por defecto, una base de datos nueva por ejecución")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--cart-items", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--stripes", type=int, default=0, help="hot-sku: stripes del producto (0 = sin repartir)")
+    parser.add_argument("--output", default="benchmarks/results.json")
+    parser.add_argument("--baseline", default=None, help="JSON de una ejecución anterior para comparar")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    with open(args.output, "w") as output:
+        json.dump(result, output, indent=2)
+
+    for label, stats in result["endpoints"].items():
+        print(f"{label:32} {stats['requests']:>6} req  {stats['throughput_rps']:>9} rps  "
+              f"p50 {stats['p50_ms']:>8} ms  p95 {stats['p95_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms  "
+              f"errores {stats['errors']}")
+    if result["scenario"]:
+        print(json.dumps(result["scenario"], indent=2))
+    print(f"Resultados guardados en {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            compare(json.load(baseline), result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark de memoria (pico de tracemalloc) de recorrer un catálogo de 100k productos por páginas.
+
+Compara, a partir de los documentos tal como los entrega Motor:
+  models  dict -> Product -> dict de model_dump -> JSON (camino con `response_model`)
+  dicts   dict proyectado -> JSON con orjson
+  rows    dict proyectado -> ProductRow -> JSON con orjson (camino actual)
+
+Cada página (`--page-size`, por defecto el máximo de la API) se serializa con
+`SerializedResponse.build`, el mismo camino que `GET /products`, incluida la versión gzip. Para cada
+variante reporta la memoria retenida por las filas y las respuestas de todas las páginas (lo que
+ocupa el catálogo completo en el cache de productos) y el pico durante la serialización. Los
+cuerpos de las tres variantes deben ser idénticos; si no lo son, el benchmark falla.
+
+Uso: python -m benchmarks.memory_bench [--products 100000] [--page-size 1000]
+"""
+import argparse
+import gc
+import tracemalloc
+
+from bson import ObjectId
+
+from app.http_cache import SerializedResponse
+from app.models.product import Product
+from app.models.rows import ProductRow
+from app.repositories.product_repository import MAX_PAGE_SIZE
+from app.serialization import stringify_id
+
+
+def make_documents(count: int) -> list:
+    return [
+        {"_id": ObjectId(), "name": f"Producto {i}", "category": f"Categoria {i % 50}",
+         "price": round(10 + i * 0.01, 2), "stock": i % 500}
+        for i in range(count)
+    ]
+
+
+def build_models(documents: list) -> list:
+    return [Product(**stringify_id(dict(document))) for document in documents]
+
+
+def models_content(products: list) -> list:
+    return [product.model_dump(by_alias=True) for product in products]
+
+
+def build_dicts(documents: list) -> list:
+    return [stringify_id(dict(document)) for document in documents]
+
+
+def build_rows(documents: list) -> list:
+    return [ProductRow.from_document(stringify_id(dict(document))) for document in documents]
+
+
+PATHS = {
+    "models": (build_models, models_content),
+    "dicts": (build_dicts, list),
+    "rows": (build_rows, list),
+}
+
+
+def measure(documents: list, page_size: int, build, content) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    pages = [build(documents[start:start + page_size]) for start in range(0, len(documents), page_size)]
+    rows, _ = tracemalloc.get_traced_memory()
+    responses = [SerializedResponse.build(content(page)) for page in pages]
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    bodies = [response.body for response in responses]
+    del pages, responses
+    return {"rows_mb": rows / 2 ** 20, "retained_mb": retained / 2 ** 20, "peak_mb": peak / 2 ** 20,
+            "bodies": bodies}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--page-size", type=int, default=MAX_PAGE_SIZE)
+    args = parser.parse_args()
+
+    documents = make_documents(args.products)
+    print(f"{args.products} productos en páginas de {args.page_size}")
+    expected = None
+    for name, (build, content) in PATHS.items():
+        stats = measure(documents, args.page_size, build, content)
+        if expected is None:
+            expected = stats["bodies"]
+        elif stats["bodies"] != expected:
+            raise SystemExit(f"El cuerpo de `{name}` no coincide con el de `models`")
+        print(f"  {name:7} filas={stats['rows_mb']:8.1f} MB  filas+respuestas={stats['retained_mb']:8.1f} MB  "
+              f"pico={stats['peak_mb']:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
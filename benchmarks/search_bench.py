@@ -0,0 +1,118 @@
+"""
+Benchmark de `ProductRepository.search_products` sobre un catálogo grande (1M de productos por defecto).
+
+Carga el catálogo en una base de datos nueva de un `mongod` local (el stand-in en memoria no
+implementa el índice de texto), crea los índices declarados y mide la latencia p50/p95 de cada
+forma de búsqueda. Para cada una reporta además el plan ganador de `explain()` y los documentos
+examinados, de modo que un COLLSCAN o un SORT en memoria se detectan en el resultado.
+
+Uso:
+  python -m benchmarks.search_bench --mongo-uri mongodb://localhost:27017 [--products 1000000] [--repeat 50]
+  python -m benchmarks.search_bench --database benchmark_search --skip-seed   # reutiliza un catálogo cargado
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from app.database import MongoDBConnection
+from app.indexes import _plan_stages
+from app.repositories.product_repository import SEARCH_SORTS, ProductRepository
+
+WORDS = ["camisa", "pantalon", "zapato", "reloj", "lampara", "silla", "mesa", "taza", "mochila", "gorra",
+         "azul", "rojo", "negro", "blanco", "verde", "grande", "mini", "clasico", "deportivo", "premium"]
+
+SEARCHES = {
+    "text": {"text": "reloj negro"},
+    "text+price": {"text": "silla", "min_price": 20, "max_price": 60, "sort": "price"},
+    "category+price": {"category": "cat-7", "min_price": 50, "max_price": 80, "sort": "price"},
+    "category+price desc": {"category": "cat-7", "sort": "-price"},
+    "price range": {"min_price": 10, "max_price": 11, "sort": "price"},
+    "in_stock by name": {"in_stock": True, "sort": "name"},
+    "in_stock+fields": {"in_stock": True, "fields": ["name", "price"]},
+}
+
+
+async def seed(collection, count: int, chunk: int = 10000):
+    started = time.perf_counter()
+    for offset in range(0, count, chunk):
+        await collection.insert_many([
+            {"name": f"{' '.join(random.sample(WORDS, 3))} {i}", "category": f"cat-{i % 100}",
+             "price": round(random.uniform(1, 100), 2), "stock": random.choice([0, 0, 1, 5, 20, 100])}
+            for i in range(offset, min(offset + chunk, count))
+        ], ordered=False)
+    return time.perf_counter() - started
+
+
+async def explain(repo, params: dict) -> dict:
+    """Plan ganador de la consulta que construye el repositorio para `params`."""
+    query = repo._search_filter(params.get("text"), params.get("category"), params.get("min_price"),
+                                params.get("max_price"), params.get("in_stock", False))
+    cursor = repo.collection.find(query)
+    sort = params.get("sort") or ("relevance" if params.get("text") else "id")
+    if sort != "relevance":
+        field, direction = SEARCH_SORTS[sort]
+        cursor = cursor.sort([(field, direction)] if field == "_id" else [(field, direction), ("_id", direction)])
+    explanation = await cursor.limit(100).explain()
+    return {
+        "stages": sorted(set(_plan_stages(explanation["queryPlanner"]["winningPlan"]))),
+        "docs_examined": explanation.get("executionStats", {}).get("totalDocsExamined"),
+    }
+
+
+async def run(args) -> dict:
+    os.environ["MONGODB_URI"] = args.mongo_uri
+    os.environ["DATABASE_NAME"] = args.database or f"benchmark_search_{uuid.uuid4().hex[:8]}"
+
+    connection = MongoDBConnection()
+    await connection.ensure_collections()
+    repo = ProductRepository(connection.get_db())
+
+    seed_seconds = None if args.skip_seed else await seed(repo.collection, args.products)
+
+    results = {}
+    for name, params in SEARCHES.items():
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            products, _ = await repo.search_products(limit=args.limit, **params)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results[name] = {
+            "p50_ms": round(timings[len(timings) // 2], 2),
+            "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 2),
+            "results": len(products),
+            **await explain(repo, params),
+        }
+
+    if not args.database:
+        await connection.client.drop_database(os.environ["DATABASE_NAME"])
+    connection.close()
+    return {"products": args.products, "seed_seconds": seed_seconds, "searches": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default=None, help="por defecto, una base de datos nueva que se borra al final")
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument("--output", default="benchmarks/results-search.json")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    with open(args.output, "w") as output:
+        json.dump(result, output, indent=2)
+
+    for name, stats in result["searches"].items():
+        print(f"{name:22} p50={stats['p50_ms']:>8}ms p95={stats['p95_ms']:>8}ms "
+              f"docs={stats['docs_examined']} plan={','.join(stats['stages'])}")
+
+
+if __name__ == "__main__":
+    main()
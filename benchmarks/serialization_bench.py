@@ -0,0 +1,68 @@
+"""
+Microbenchmark del costo de serializar `GET /products` por cada 10k productos.
+
+Compara el camino anterior (Product(**doc) + validación de `response_model` + encoder JSON por
+defecto) con el actual (documentos proyectados serializados directamente con orjson).
+
+Uso: python -m benchmarks.serialization_bench [--products 10000] [--repeat 5]
+"""
+import argparse
+import json
+import time
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app.models.product import Product
+from app.serialization import dumps, stringify_id
+
+
+def make_documents(count: int) -> list:
+    return [
+        {"_id": ObjectId(), "name": f"Producto {i}", "category": f"Categoria {i % 50}",
+         "price": round(10 + i * 0.01, 2), "stock": i % 500}
+        for i in range(count)
+    ]
+
+
+def previous_path(documents: list) -> bytes:
+    products = []
+    for document in documents:
+        document = dict(document, _id=str(document["_id"]))
+        products.append(Product(**document))
+    # FastAPI vuelve a validar contra `response_model=list[Product]` antes de serializar
+    validated = TypeAdapter(list[Product]).validate_python(products, from_attributes=True)
+    content = jsonable_encoder(validated, by_alias=True)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def fast_path(documents: list) -> bytes:
+    return dumps([stringify_id(dict(document)) for document in documents])
+
+
+def measure(func, documents: list, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(documents)
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    documents = make_documents(args.products)
+    previous = measure(previous_path, documents, args.repeat)
+    fast = measure(fast_path, documents, args.repeat)
+    print(f"{args.products} productos")
+    print(f"  anterior: {previous:8.2f} ms")
+    print(f"  orjson:   {fast:8.2f} ms  ({previous / fast:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
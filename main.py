@@ -1,9 +1,77 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import app_router
+from app.routers import app_router, health_router, metrics_router
 from app.database import MongoDBConnection
+from app.dependencies import init_app_state
+from app.serialization import MongoJSONResponse
+from app.repositories.facet_repository import REBUILD_INTERVAL_SECONDS
+from app.metrics import REGISTRY, MetricsMiddleware, stats_collector
+from app.rate_limit import RateLimitMiddleware
 
-app = FastAPI()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cada proceso (worker) crea su propio cliente aquí, después del fork, y no al importar
+    db_connection = MongoDBConnection()
+    init_app_state(app, db_connection)
+
+    # Conexión, colecciones, índices y precalentamiento del pool antes de aceptar tráfico
+    await db_connection.connect()
+
+    # Resumen de categorías para `/products/facets`: construcción inicial en segundo plano si la base
+    # de datos aún no tiene uno (mientras tanto se calcula al vuelo) y reconstrucción periódica opcional
+    facets_builder = facets_rebuilder = None
+    facet_repo = app.state.facet_repo
+    if facet_repo:
+        if os.getenv("CATEGORY_FACETS_BUILD_ON_STARTUP", "true").lower() not in ("0", "false", "no"):
+            facets_builder = asyncio.create_task(facet_repo.ensure_built())
+        if REBUILD_INTERVAL_SECONDS > 0:
+            facets_rebuilder = asyncio.create_task(facet_repo.run_rebuilder())
+
+    # Invalidación del cache de productos mediante change streams (requiere replica set)
+    watcher = None
+    product_cache = app.state.product_cache
+    if product_cache and os.getenv("PRODUCT_CACHE_CHANGE_STREAM", "false").lower() == "true":
+        watcher = asyncio.create_task(product_cache.watch_changes(db_connection.get_db()["products"]))
+
+    # Liberación periódica de las reservas de stock vencidas
+    sweeper = None
+    if app.state.reservation_repo:
+        sweeper = asyncio.create_task(app.state.reservation_repo.run_sweeper())
+
+    # Persistencia periódica de los carritos en modo de escritura diferida
+    flusher = None
+    cart_buffer = app.state.cart_buffer
+    if cart_buffer:
+        flusher = asyncio.create_task(cart_buffer.run_flusher())
+
+    # Workers del checkout asíncrono (`CHECKOUT_MODE=async`)
+    order_workers = None
+    if app.state.order_processor:
+        order_workers = asyncio.create_task(app.state.order_processor.run())
+
+    yield
+
+    for task in (facets_builder, facets_rebuilder, watcher, sweeper, flusher, order_workers):
+        if task:
+            task.cancel()
+    if cart_buffer:
+        await cart_buffer.flush()
+    app.state.password_hasher.shutdown()
+    db_connection.close()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=MongoJSONResponse)
+
+# Admisión de las rutas costosas; se agrega antes que CORS para que los 429/503 lleven sus cabeceras
+if os.getenv("RATE_LIMIT_ENABLED", "true").lower() not in ("0", "false", "no"):
+    app.add_middleware(RateLimitMiddleware, router=app.router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,20 +82,45 @@ app.add_middleware(
 )
 
 
-db_connection = MongoDBConnection()
-db = db_connection.get_db()
+# Se agrega al final para que sea el middleware más externo y mida la petición completa
+app.add_middleware(MetricsMiddleware, router=app.router)
 
+# Registrar rutas
+app.include_router(app_router.router)
+app.include_router(health_router.router)
+app.include_router(metrics_router.router)
 
-# Registrar eventos de inicio y apagado
-@app.on_event("startup")
-async def startup_db_client():
-    await db_connection.ensure_collections()
 
+def _product_cache_stats() -> dict:
+    product_cache = getattr(app.state, "product_cache", None)
+    return product_cache.stats() if product_cache else {}
 
-# Registrar rutas
-app.include_router(app_router.router)
+
+def _cart_buffer_stats() -> dict:
+    cart_buffer = getattr(app.state, "cart_buffer", None)
+    return cart_buffer.stats() if cart_buffer else {}
+
+
+def _password_hasher_stats() -> dict:
+    password_hasher = getattr(app.state, "password_hasher", None)
+    return password_hasher.stats() if password_hasher else {}
+
+
+def _order_processor_stats() -> dict:
+    order_processor = getattr(app.state, "order_processor", None)
+    return order_processor.stats() if order_processor else {}
 
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    db_connection.client.close()
+# Estadísticas del cache de productos, del buffer de carritos, de los pedidos y del hashing de contraseñas en `/metrics`
+REGISTRY.register_collector(stats_collector(
+    "product_cache", "Estadísticas del cache de productos.", _product_cache_stats
+))
+REGISTRY.register_collector(stats_collector(
+    "cart_write_behind", "Estadísticas del buffer de escritura diferida de carritos.", _cart_buffer_stats
+))
+REGISTRY.register_collector(stats_collector(
+    "order_processor", "Estadísticas de los workers del checkout asíncrono.", _order_processor_stats
+))
+REGISTRY.register_collector(stats_collector(
+    "password_hasher", "Estadísticas del pool de hashing de contraseñas.", _password_hasher_stats
+))
@@ -0,0 +1,62 @@
+import os
+import uuid
+
+# Valores por defecto para ejecutar sin `.env`; deben fijarse antes de importar la app
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+import pytest  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db():
+    """Base de datos nueva en el stand-in en memoria (`mongomock-motor`)."""
+    return AsyncMongoMockClient()[f"test_{uuid.uuid4().hex[:8]}"]
+
+
+@pytest.fixture
+async def mongod_db():
+    """
+    Base de datos nueva en un `mongod` real, para lo que el stand-in no implementa (`$lookup` con
+    `let`, update pipelines con `$mergeObjects`, transacciones). Sin `TEST_MONGODB_URI` se omite.
+    """
+    uri = os.getenv("TEST_MONGODB_URI")
+    if not uri:
+        pytest.skip("Requiere un mongod real: definir TEST_MONGODB_URI")
+    client = AsyncIOMotorClient(uri, serverSelectionTimeoutMS=2000)
+    name = f"test_{uuid.uuid4().hex[:8]}"
+    yield client[name]
+    await client.drop_database(name)
+    client.close()
+
+
+@pytest.fixture
+def mock_backend(monkeypatch):
+    """
+    Hace que la app se conecte al stand-in en memoria, con los caminos que este puede ejecutar: carritos
+    con escritura diferida (sin `$lookup` con `let` ni update pipelines).
+    """
+    from app.database import MongoDBConnection
+
+    monkeypatch.setenv("DATABASE_NAME", f"test_{uuid.uuid4().hex[:8]}")
+    monkeypatch.setenv("CART_WRITE_BEHIND_ENABLED", "true")
+    monkeypatch.setattr(MongoDBConnection, "_client_factory", lambda url, **options: AsyncMongoMockClient())
+
+
+@pytest.fixture
+def client(mock_backend):
+    """`TestClient` de la app con su lifespan completo sobre el stand-in en memoria."""
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
@@ -0,0 +1,34 @@
+from fastapi.testclient import TestClient
+
+from main import app
+
+CREDENTIALS = {"email": "ana@example.com", "password": "secret-password"}
+
+
+def register_and_login(client: TestClient) -> dict:
+    response = client.post("/register", json={"name": "Ana", **CREDENTIALS})
+    assert response.status_code == 200, response.text
+    response = client.post("/login", json=CREDENTIALS)
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_register_and_login(client):
+    headers = register_and_login(client)
+    assert headers["Authorization"].startswith("Bearer ")
+
+    response = client.post("/login", json={**CREDENTIALS, "password": "wrong-password"})
+    assert response.status_code == 401
+
+
+def test_password_hasher_survives_a_second_lifespan(mock_backend):
+    # El pool de bcrypt se cierra al apagar: cada arranque debe crear el suyo
+    with TestClient(app) as client:
+        register_and_login(client)
+        first = app.state.password_hasher
+
+    with TestClient(app) as client:
+        response = client.post("/register", json={"name": "Beto", **{**CREDENTIALS, "email": "beto@example.com"}})
+        assert response.status_code == 200, response.text
+        assert app.state.password_hasher is not first
+        assert app.state.password_hasher.stats()["completed"] == 1
@@ -0,0 +1,53 @@
+import argparse
+
+import httpx
+import pytest
+
+from app.database import MongoDBConnection
+from benchmarks import load
+
+pytestmark = pytest.mark.anyio
+
+
+def test_percentile_uses_the_nearest_rank():
+    values = [float(value) for value in range(1, 101)]
+    assert load.percentile(values, 50) == 50
+    assert load.percentile(values, 99) == 99
+    assert load.percentile([], 99) == 0.0
+
+
+def test_expect_raises_on_unexpected_statuses():
+    request = httpx.Request("POST", "http://benchmark/cart")
+    assert load.expect(httpx.Response(200, request=request)).status_code == 200
+    assert load.expect(httpx.Response(409, request=request), 200, 409).status_code == 409
+
+    with pytest.raises(load.ScenarioError, match="POST /cart respondió 400"):
+        load.expect(httpx.Response(400, request=request, text="Stock insuficiente"))
+
+
+@pytest.fixture
+def bench_args(monkeypatch):
+    # `configure_backend` modifica el entorno y la fábrica del cliente: se restauran al terminar
+    monkeypatch.setenv("DATABASE_NAME", "")
+    monkeypatch.setenv("CART_WRITE_BEHIND_ENABLED", "true")
+    monkeypatch.setattr(MongoDBConnection, "_client_factory", MongoDBConnection._client_factory)
+    return lambda scenario, **overrides: argparse.Namespace(**{
+        "scenario": scenario, "backend": "mongomock", "mongo_uri": None, "database": None, "users": 6,
+        "concurrency": 3, "products": 5, "cart_items": 2, "repeat": 2, "stripes": 0, **overrides,
+    })
+
+
+async def test_flow_scenario_runs_on_the_stand_in(bench_args):
+    result = await load.run(bench_args("flow"))
+
+    endpoints = result["endpoints"]
+    assert endpoints["POST /checkout"]["requests"] == 6 and endpoints["POST /checkout"]["errors"] == 0
+    assert endpoints["POST /cart"]["requests"] == 12
+    assert result["scenario"]["cart_write_behind"]["mutations"] == 12
+
+
+async def test_hot_sku_scenario_never_oversells(bench_args):
+    result = await load.run(bench_args("hot-sku", users=8, concurrency=8))
+
+    assert result["scenario"]["oversold"] is False
+    assert result["scenario"]["final_stock"] >= 0
@@ -0,0 +1,55 @@
+import orjson
+import pytest
+
+from app.repositories.product_repository import ProductRepository
+
+pytestmark = pytest.mark.anyio
+
+
+async def rows_of(items):
+    for item in items:
+        yield item
+
+
+async def test_bulk_upsert_matches_create_product_semantics(db):
+    await db["products"].insert_one({"name": "Taza", "category": "hogar", "price": 10.0, "stock": 5})
+    repo = ProductRepository(db)
+    rows = [
+        {"name": "Taza", "category": "hogar", "price": 10.0, "stock": 1},
+        {"name": "Plato", "category": "hogar", "price": 8.0, "stock": 2},
+        {"name": "Plato", "category": "hogar", "price": 8.0, "stock": 2},
+        {"name": "Vaso", "category": "hogar", "price": "caro", "stock": 1},
+        "no es un objeto",
+    ]
+
+    outcome = await repo.bulk_upsert_products(rows_of(rows), chunk_size=2)
+
+    assert [(result["row"], result["status"]) for result in outcome["results"]] == [
+        (0, "updated"), (1, "created"), (2, "updated"), (3, "error"), (4, "error"),
+    ]
+    assert outcome["results"][1]["id"] == outcome["results"][2]["id"]
+    stats = outcome["stats"]
+    assert (stats["rows"], stats["created"], stats["updated"], stats["errors"], stats["chunks"]) == (5, 1, 2, 2, 3)
+    # Como en `POST /products`, un producto existente o repetido suma 1 a su stock
+    assert (await db["products"].find_one({"name": "Taza"}))["stock"] == 6
+    assert (await db["products"].find_one({"name": "Plato"}))["stock"] == 3
+
+
+def test_bulk_endpoint_accepts_json_and_ndjson(client):
+    response = client.post("/products/bulk", json=[{"name": "Taza", "category": "hogar", "price": 10.0, "stock": 1}])
+    assert response.status_code == 200, response.text
+    assert response.json()["results"][0]["status"] == "created"
+
+    body = b"\n".join(orjson.dumps(row) for row in [
+        {"name": "Plato", "category": "hogar", "price": 8.0, "stock": 2},
+        {"name": "Taza", "category": "hogar", "price": 10.0, "stock": 1},
+    ]) + b"\n{roto\n"
+    response = client.post("/products/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200, response.text
+    assert [result["status"] for result in response.json()["results"]] == ["created", "updated", "error"]
+    assert len(client.get("/products").json()) == 2
+
+
+def test_bulk_endpoint_rejects_a_body_that_is_not_an_array(client):
+    response = client.post("/products/bulk", json={"name": "Taza"})
+    assert response.status_code == 400
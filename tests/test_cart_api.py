@@ -0,0 +1,80 @@
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from main import app
+from tests.test_auth import register_and_login
+
+
+@pytest.fixture
+def client_without_reservations(mock_backend, monkeypatch):
+    # Sin reservas, el router verifica el stock antes de agregar al carrito
+    monkeypatch.setenv("STOCK_RESERVATIONS_ENABLED", "false")
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def create_product(client: TestClient, stock: int) -> str:
+    response = client.post("/products", json={"name": "Taza", "price": 10.0, "category": "hogar", "stock": stock})
+    assert response.status_code == 200, response.text
+    return response.json()["_id"]
+
+
+def sell_out(client: TestClient, product_id: str):
+    """Deja el producto sin stock directamente en la base, con su entrada del cache todavía vigente."""
+    products = app.state.db_connection.get_db()["products"]
+    client.portal.call(products.update_one, {"_id": ObjectId(product_id)}, {"$set": {"stock": 0}})
+
+
+def test_add_to_cart_checks_stock_against_the_database(client_without_reservations):
+    client = client_without_reservations
+    headers = register_and_login(client)
+    product_id = create_product(client, stock=5)
+    app.state.product_cache.set_product({"_id": product_id, "name": "Taza", "price": 10.0, "category": "hogar",
+                                         "stock": 5})
+    sell_out(client, product_id)
+
+    response = client.post("/cart", headers=headers, json={"product_id": product_id, "quantity": 1})
+    assert response.status_code == 400
+
+
+def test_set_quantity_checks_stock_against_the_database(client_without_reservations):
+    client = client_without_reservations
+    headers = register_and_login(client)
+    product_id = create_product(client, stock=5)
+    response = client.post("/cart", headers=headers, json={"product_id": product_id, "quantity": 1})
+    assert response.status_code == 200, response.text
+    app.state.product_cache.set_product({"_id": product_id, "name": "Taza", "price": 10.0, "category": "hogar",
+                                         "stock": 5})
+    sell_out(client, product_id)
+
+    response = client.put(f"/cart/{product_id}", headers=headers, json={"quantity": 3})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("quantity", [0, -10])
+def test_add_to_cart_rejects_non_positive_quantities(client, quantity):
+    headers = register_and_login(client)
+    product_id = create_product(client, stock=5)
+
+    response = client.post("/cart", headers=headers, json={"product_id": product_id, "quantity": quantity})
+    assert response.status_code == 422
+    product = client.portal.call(app.state.db_connection.get_db()["products"].find_one, {"_id": ObjectId(product_id)})
+    assert product.get("reserved", 0) == 0
+
+
+def test_add_to_cart_with_reservations_reports_a_missing_product(client):
+    headers = register_and_login(client)
+
+    response = client.post("/cart", headers=headers, json={"product_id": str(ObjectId()), "quantity": 1})
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Producto no encontrado."
+
+
+def test_set_quantity_of_a_product_not_in_the_cart_is_404(client):
+    headers = register_and_login(client)
+    product_id = create_product(client, stock=5)
+
+    response = client.put(f"/cart/{product_id}", headers=headers, json={"quantity": 2})
+    assert response.status_code == 404
+    assert client.get("/cart", headers=headers).status_code == 404
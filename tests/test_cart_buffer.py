@@ -0,0 +1,133 @@
+import pytest
+from bson import ObjectId
+
+from app.models.cart import CartItem
+from app.repositories.cart_buffer import CartStore, CartWriteError, InMemoryCartStore, WriteBehindCarts
+from app.repositories.cart_repository import CartRepository
+from app.repositories.reservation_repository import ReservationRepository
+from tests.test_checkout import create_product
+
+pytestmark = pytest.mark.anyio
+
+
+class FlakyCollection:
+    """Colección cuyo `bulk_write` falla mientras `failing` es verdadero."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.failing = True
+
+    async def bulk_write(self, *args, **kwargs):
+        if self.failing:
+            raise ConnectionError("MongoDB no disponible")
+        return await self.collection.bulk_write(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def add_line(product_id: str, quantity: int = 1):
+    def change(items):
+        items.append({"product_id": product_id, "quantity": quantity})
+        return True
+    return change
+
+
+async def test_failed_forced_flush_keeps_the_change_pending(db):
+    carts = FlakyCollection(db["carts"])
+    buffer = WriteBehindCarts(carts, max_dirty=1)
+
+    assert await buffer.modify("u1", add_line("p1")) is True
+    assert buffer.peek_items("u1") == [{"product_id": "p1", "quantity": 1}]
+    assert buffer.stats()["dirty_carts"] == 1
+
+    carts.failing = False
+    assert await buffer.flush() == 1
+    assert (await db["carts"].find_one({"user_id": "u1"}))["items"] == [{"product_id": "p1", "quantity": 1}]
+
+
+async def test_write_through_persists_every_change(db):
+    buffer = WriteBehindCarts(db["carts"], durability="write-through")
+
+    await buffer.modify("u1", add_line("p1"))
+
+    assert (await db["carts"].find_one({"user_id": "u1"}))["items"] == [{"product_id": "p1", "quantity": 1}]
+    assert buffer.stats()["dirty_carts"] == 0
+
+
+async def test_write_through_failure_discards_the_change(db):
+    await db["carts"].insert_one({"user_id": "u1", "items": [{"product_id": "p0", "quantity": 1}]})
+    buffer = WriteBehindCarts(FlakyCollection(db["carts"]), durability="write-through")
+
+    with pytest.raises(CartWriteError):
+        await buffer.modify("u1", add_line("p1"))
+
+    assert buffer.peek_items("u1") is None
+    assert await buffer.get_items("u1") == [{"product_id": "p0", "quantity": 1}]
+
+
+async def test_write_through_failure_releases_the_reservation(db):
+    product_id = await create_product(db, stock=5)
+    buffer = WriteBehindCarts(FlakyCollection(db["carts"]), durability="write-through")
+    repo = CartRepository(db, reservations=ReservationRepository(db), buffer=buffer)
+
+    with pytest.raises(CartWriteError):
+        await repo.add_to_cart("u1", CartItem(product_id=product_id, quantity=2))
+
+    assert (await db["products"].find_one({"_id": ObjectId(product_id)}))["reserved"] == 0
+    assert await db["reservations"].count_documents({}) == 0
+
+
+def test_unknown_durability_is_rejected(db):
+    with pytest.raises(ValueError):
+        WriteBehindCarts(db["carts"], durability="eventually")
+
+
+def test_cart_store_requires_the_whole_interface():
+    class PartialStore(CartStore):
+        def get(self, user_id):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialStore()
+    assert len(InMemoryCartStore()) == 0
+
+
+async def test_changes_are_batched_into_one_write_per_cart(db):
+    buffer = WriteBehindCarts(db["carts"], max_dirty=100)
+    for index in range(5):
+        await buffer.modify("u1", add_line(f"p{index}"))
+    await buffer.modify("u2", add_line("p1"))
+    assert await db["carts"].count_documents({}) == 0
+
+    assert await buffer.flush() == 2
+
+    assert len((await db["carts"].find_one({"user_id": "u1"}))["items"]) == 5
+    stats = buffer.stats()
+    assert (stats["mutations"], stats["writes"], stats["flushes"], stats["writes_saved"]) == (6, 2, 1, 4)
+    assert await buffer.flush() == 0
+
+
+async def test_too_many_dirty_carts_force_a_flush(db):
+    buffer = WriteBehindCarts(db["carts"], max_dirty=3)
+    for user_id in ("u1", "u2"):
+        await buffer.modify(user_id, add_line("p1"))
+    assert await db["carts"].count_documents({}) == 0
+
+    await buffer.modify("u3", add_line("p1"))
+
+    assert await db["carts"].count_documents({}) == 3
+    assert buffer.stats()["dirty_carts"] == 0
+
+
+async def test_checkout_persists_the_buffered_cart_first(db):
+    product_id = await create_product(db, stock=5)
+    buffer = WriteBehindCarts(db["carts"], max_dirty=100)
+    repo = CartRepository(db, buffer=buffer)
+    await repo.add_to_cart("u1", CartItem(product_id=product_id, quantity=2))
+    assert await db["carts"].count_documents({}) == 0
+
+    await repo.checkout("u1")
+
+    assert (await db["carts"].find_one({"user_id": "u1"}))["items"] == []
+    assert (await db["products"].find_one({"_id": ObjectId(product_id)}))["stock"] == 3
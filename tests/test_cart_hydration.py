@@ -0,0 +1,68 @@
+import pytest
+from bson import ObjectId
+
+from app.repositories.cart_buffer import WriteBehindCarts
+from app.repositories.cart_repository import CartRepository
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed_products(db, count: int) -> list:
+    result = await db["products"].insert_many([
+        {"name": f"p{i}", "category": f"c{i % 3}", "price": 1.0 + i, "stock": 10} for i in range(count)
+    ])
+    return [str(product_id) for product_id in result.inserted_ids]
+
+
+async def test_buffered_cart_is_hydrated_in_one_round_trip(db):
+    product_ids = await seed_products(db, 40)
+    buffer = WriteBehindCarts(db[CartRepository.COLLECTION])
+    repo = CartRepository(db, buffer=buffer)
+    for product_id in reversed(product_ids):
+        await buffer.modify("u1", CartRepository._set_line(product_id, 2, add=True))
+
+    cart, stats = await repo.get_cart_with_stats("u1")
+
+    assert stats.round_trips == 1
+    assert stats.items == 40
+    assert [line.product_id for line in cart.items] == list(reversed(product_ids))
+    assert cart.items[0].name == "p39" and cart.items[0].quantity == 2
+
+
+async def test_dropped_products_are_skipped(db):
+    product_ids = await seed_products(db, 3)
+    await db["products"].delete_one({"_id": ObjectId(product_ids[1])})
+    buffer = WriteBehindCarts(db[CartRepository.COLLECTION])
+    repo = CartRepository(db, buffer=buffer)
+    for product_id in product_ids + ["no-es-un-id"]:
+        await buffer.modify("u1", CartRepository._set_line(product_id, 1, add=True))
+
+    cart, stats = await repo.get_cart_with_stats("u1")
+
+    assert [line.product_id for line in cart.items] == [product_ids[0], product_ids[2]]
+    assert stats.round_trips == 1
+
+
+async def test_cart_without_valid_products_needs_no_round_trip(db):
+    buffer = WriteBehindCarts(db[CartRepository.COLLECTION])
+    repo = CartRepository(db, buffer=buffer)
+    await buffer.modify("u1", CartRepository._set_line("no-es-un-id", 1, add=True))
+
+    cart, stats = await repo.get_cart_with_stats("u1")
+
+    assert cart.items == [] and stats.round_trips == 0
+
+
+@pytest.mark.mongod
+@pytest.mark.parametrize("size", [1, 40, 500])
+async def test_stored_cart_is_hydrated_with_a_single_lookup(mongod_db, size):
+    product_ids = await seed_products(mongod_db, size)
+    await mongod_db["products"].delete_one({"_id": ObjectId(product_ids[0])})
+    await mongod_db["carts"].insert_one({
+        "user_id": "u1", "items": [{"product_id": product_id, "quantity": 1} for product_id in product_ids],
+    })
+
+    cart, stats = await CartRepository(mongod_db).get_cart_with_stats("u1")
+
+    assert stats.round_trips == 1
+    assert [line.product_id for line in cart.items] == product_ids[1:]
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+from app.models.cart import CartItem
+from app.repositories.cart_buffer import WriteBehindCarts
+from app.repositories.cart_repository import CartRepository
+from app.repositories.reservation_repository import ReservationRepository
+from tests.test_checkout import create_product
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.mongod
+async def test_concurrent_adds_for_the_same_user_do_not_lose_updates(mongod_db):
+    # `$mergeObjects` en el update pipeline no existe en el stand-in
+    repo = CartRepository(mongod_db)
+    same_product = [repo.add_to_cart("ana", CartItem(product_id="p-hot", quantity=1)) for _ in range(50)]
+    other_products = [repo.add_to_cart("ana", CartItem(product_id=f"p-{index}", quantity=2)) for index in range(20)]
+    await asyncio.gather(*same_product, *other_products)
+
+    cart = await mongod_db[CartRepository.COLLECTION].find_one({"user_id": "ana"})
+    quantities = {line["product_id"]: line["quantity"] for line in cart["items"]}
+    assert len(cart["items"]) == 21
+    assert quantities["p-hot"] == 50
+    assert all(quantities[f"p-{index}"] == 2 for index in range(20))
+
+
+@pytest.mark.mongod
+async def test_product_ids_are_not_evaluated_as_field_paths(mongod_db):
+    repo = CartRepository(mongod_db)
+    await repo.add_to_cart("ana", CartItem(product_id="$user_id", quantity=1))
+    await repo.add_to_cart("ana", CartItem(product_id="$user_id", quantity=2))
+
+    cart = await mongod_db[CartRepository.COLLECTION].find_one({"user_id": "ana"})
+    assert cart["items"] == [{"product_id": "$user_id", "quantity": 3}]
+
+
+async def test_new_lines_keep_literal_product_ids(db):
+    # Solo la rama de línea nueva (`$concatArrays`) corre en el stand-in
+    repo = CartRepository(db)
+    await repo.add_to_cart("ana", CartItem(product_id="$user_id", quantity=1))
+    await repo.add_to_cart("ana", CartItem(product_id="p-1", quantity=2))
+
+    cart = await db[CartRepository.COLLECTION].find_one({"user_id": "ana"})
+    assert cart["items"] == [{"product_id": "$user_id", "quantity": 1}, {"product_id": "p-1", "quantity": 2}]
+
+
+async def test_remove_item_pulls_only_the_requested_line(db):
+    repo = CartRepository(db)
+    await repo.add_to_cart("ana", CartItem(product_id="p-1", quantity=1))
+    await repo.add_to_cart("ana", CartItem(product_id="p-2", quantity=1))
+
+    assert await repo.remove_item("ana", "p-1") is True
+    assert await repo.remove_item("ana", "p-1") is False
+
+    cart = await db[CartRepository.COLLECTION].find_one({"user_id": "ana"})
+    assert cart["items"] == [{"product_id": "p-2", "quantity": 1}]
+
+
+async def reserved_of(db, product_id: str) -> int:
+    return (await db["products"].find_one({"_id": ObjectId(product_id)})).get("reserved", 0)
+
+
+@pytest.mark.parametrize("buffered", [False, True])
+async def test_set_item_quantity_only_updates_existing_lines(db, buffered):
+    in_cart = await create_product(db, stock=10, name="in-cart")
+    missing = await create_product(db, stock=10, name="missing")
+    buffer = WriteBehindCarts(db[CartRepository.COLLECTION]) if buffered else None
+    repo = CartRepository(db, reservations=ReservationRepository(db), buffer=buffer)
+    await repo.add_to_cart("ana", CartItem(product_id=in_cart, quantity=1))
+
+    assert await repo.set_item_quantity("ana", in_cart, 4) is True
+    assert await repo.set_item_quantity("ana", missing, 3) is False
+    if buffer:
+        await buffer.flush("ana")
+
+    cart = await db[CartRepository.COLLECTION].find_one({"user_id": "ana"})
+    assert cart["items"] == [{"product_id": in_cart, "quantity": 4}]
+    assert await reserved_of(db, in_cart) == 4
+    assert await reserved_of(db, missing) == 0
+
+
+async def test_set_item_quantity_restores_the_reservation_when_the_cart_write_fails(db, monkeypatch):
+    product_id = await create_product(db, stock=10)
+    repo = CartRepository(db, reservations=ReservationRepository(db))
+    await repo.add_to_cart("ana", CartItem(product_id=product_id, quantity=2))
+
+    async def fail(*args, **kwargs):
+        raise RuntimeError("mongod caído")
+
+    monkeypatch.setattr(repo.collection, "update_one", fail)
+    with pytest.raises(RuntimeError):
+        await repo.set_item_quantity("ana", product_id, 5)
+    assert await reserved_of(db, product_id) == 2
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.models.cart import CartItem
+from app.repositories.cart_buffer import WriteBehindCarts
+from app.repositories.cart_repository import CartRepository
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_product(db, stock: int, name: str = "hot") -> str:
+    result = await db["products"].insert_one({"name": name, "category": "c", "price": 5.0, "stock": stock})
+    return str(result.inserted_id)
+
+
+async def stock_of(db, product_id: str) -> int:
+    return (await db["products"].find_one({"_id": ObjectId(product_id)}))["stock"]
+
+
+def buffered_repo(db) -> CartRepository:
+    # El stand-in no ejecuta el `$lookup` con `let`: los carritos se leen desde el buffer
+    return CartRepository(db, buffer=WriteBehindCarts(db[CartRepository.COLLECTION]))
+
+
+async def test_checkout_decrements_stock_and_empties_cart(db):
+    product_id = await create_product(db, stock=5)
+    repo = buffered_repo(db)
+    await repo.add_to_cart("u1", CartItem(product_id=product_id, quantity=2))
+
+    await repo.checkout("u1")
+
+    assert await stock_of(db, product_id) == 3
+    assert (await db["carts"].find_one({"user_id": "u1"}))["items"] == []
+    assert await db["products"].count_documents({"pending_checkouts": {"$exists": True, "$ne": []}}) == 0
+
+
+async def test_checkout_is_all_or_nothing(db):
+    plenty = await create_product(db, stock=10, name="plenty")
+    scarce = await create_product(db, stock=1, name="scarce")
+    repo = buffered_repo(db)
+    await repo.add_to_cart("u1", CartItem(product_id=plenty, quantity=3))
+    await repo.add_to_cart("u1", CartItem(product_id=scarce, quantity=2))
+
+    with pytest.raises(HTTPException) as error:
+        await repo.checkout("u1")
+
+    assert error.value.status_code == 400
+    assert await stock_of(db, plenty) == 10
+    assert await stock_of(db, scarce) == 1
+    assert len((await repo.get_cart("u1")).items) == 2
+
+
+async def test_concurrent_checkouts_of_a_hot_sku_never_oversell(db):
+    product_id = await create_product(db, stock=25)
+    repo = buffered_repo(db)
+    users = [f"u{i}" for i in range(100)]
+    for user_id in users:
+        await repo.add_to_cart(user_id, CartItem(product_id=product_id, quantity=1))
+
+    async def attempt(user_id: str) -> int:
+        try:
+            await repo.checkout(user_id)
+            return 200
+        except HTTPException as error:
+            return error.status_code
+
+    statuses = await asyncio.gather(*(attempt(user_id) for user_id in users))
+
+    assert statuses.count(200) == 25
+    assert set(statuses) <= {200, 400, 409}
+    assert await stock_of(db, product_id) == 0
+
+
+@pytest.mark.mongod
+async def test_transactional_checkouts_retry_write_conflicts(mongod_db):
+    repo = CartRepository(mongod_db)
+    if not repo._supports_transactions():
+        pytest.skip("Requiere un replica set")
+    product_id = await create_product(mongod_db, stock=20)
+    users = [f"u{i}" for i in range(100)]
+    for user_id in users:
+        await repo.add_to_cart(user_id, CartItem(product_id=product_id, quantity=1))
+
+    async def attempt(user_id: str) -> int:
+        try:
+            await repo.checkout(user_id)
+            return 200
+        except HTTPException as error:
+            return error.status_code
+
+    # Un `WriteConflict` sin reintentar llegaría aquí como excepción de pymongo, no como HTTPException
+    statuses = await asyncio.gather(*(attempt(user_id) for user_id in users))
+
+    assert statuses.count(200) == 20
+    assert await stock_of(mongod_db, product_id) == 0
+
+
+async def test_clearing_the_checkout_token_only_touches_the_checkout_products(db):
+    bought = await create_product(db, stock=5, name="bought")
+    other = await create_product(db, stock=5, name="other")
+    await db["products"].update_one({"_id": ObjectId(other)}, {"$set": {"pending_checkouts": ["t1"]}})
+
+    async def finalize(session=None):
+        pass
+
+    repo = CartRepository(db)
+    await repo._checkout_with_compensation({ObjectId(bought): 2}, {}, {}, finalize, token="t1")
+
+    assert await stock_of(db, bought) == 3
+    assert (await db["products"].find_one({"_id": ObjectId(bought)}))["pending_checkouts"] == []
+    assert (await db["products"].find_one({"_id": ObjectId(other)}))["pending_checkouts"] == ["t1"]
@@ -0,0 +1,61 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+from app.database import MongoDBConnection
+from app.dependencies import get_product_repository
+from main import app
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_connection_creates_its_client_lazily_and_again_after_a_fork(mock_backend, monkeypatch):
+    created = []
+    monkeypatch.setattr(MongoDBConnection, "_client_factory",
+                        lambda url, **options: created.append(url) or AsyncMongoMockClient())
+    connection = MongoDBConnection()
+    assert connection.client is None and created == []
+
+    db = connection.get_db()
+    assert connection.get_db() is db and len(created) == 1
+
+    # En un proceso hijo (fork de gunicorn) el cliente del padre no se reutiliza
+    monkeypatch.setattr("app.database.os.getpid", lambda: -1)
+    assert connection.get_db() is not db and len(created) == 2
+
+
+def test_importing_the_app_does_not_connect():
+    # En un intérprete nuevo: los repositorios y el cliente se crean en el lifespan, no al importar
+    code = ("from app.database import MongoDBConnection\n"
+            "def refuse(self):\n"
+            "    raise AssertionError('conexión al importar la app')\n"
+            "MongoDBConnection.get_db = refuse\n"
+            "from main import app\n"
+            "assert not hasattr(app.state, 'db_connection')\n")
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=ROOT)
+
+
+def test_routes_resolve_repositories_through_dependencies(mock_backend):
+    class StubProducts:
+        cache = None
+
+        async def get_facets(self):
+            return [{"category": "stub", "count": 1}]
+
+    app.dependency_overrides[get_product_repository] = lambda: StubProducts()
+    try:
+        with TestClient(app) as client:
+            assert client.get("/products/facets").json() == [{"category": "stub", "count": 1}]
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_each_lifespan_builds_its_own_state(mock_backend):
+    with TestClient(app):
+        first = app.state.product_repo
+    with TestClient(app) as client:
+        assert app.state.product_repo is not first
+        assert client.get("/health/ready").status_code == 200
@@ -0,0 +1,89 @@
+import pytest
+
+from app.repositories.facet_repository import CategoryFacetRepository
+from app.repositories.inventory_repository import StripedInventoryRepository
+
+pytestmark = pytest.mark.anyio
+
+
+async def insert(db, category: str, price: float, stock: int):
+    result = await db["products"].insert_one({"name": f"{category}-{price}", "category": category,
+                                              "price": price, "stock": stock})
+    return result.inserted_id
+
+
+async def test_rebuild_replaces_the_summary_and_narrows_price_bounds(db):
+    facets = CategoryFacetRepository(db)
+    cheap = await insert(db, "a", 1.0, 2)
+    await insert(db, "a", 3.0, 4)
+    await insert(db, "b", 10.0, 1)
+    assert await facets.rebuild() == 2
+
+    # Un precio a la baja solo se refleja en el resumen al reconstruir
+    await db["products"].update_one({"_id": cheap}, {"$set": {"price": 2.0}})
+    await db["products"].delete_many({"category": "b"})
+    assert await facets.rebuild() == 1
+
+    assert await facets.get_facets() == [
+        {"category": "a", "count": 2, "stock": 6, "price_min": 2.0, "price_max": 3.0, "price_avg": 2.5},
+    ]
+    assert set(await db.list_collection_names()) == {"products", CategoryFacetRepository.COLLECTION}
+
+
+async def test_incremental_changes_are_not_counted_twice_by_a_rebuild(db):
+    facets = CategoryFacetRepository(db)
+    product_id = await insert(db, "a", 1.0, 2)
+    await facets.rebuild()
+
+    # Cambio ya aplicado en `products` y en el resumen anterior: el nuevo lo cuenta una sola vez
+    await db["products"].update_one({"_id": product_id}, {"$inc": {"stock": 5}})
+    await facets.record(stock_deltas={"a": 5})
+    await facets.rebuild()
+
+    assert (await facets.get_facets())[0]["stock"] == 7
+
+
+async def test_rebuild_adds_striped_stock(db):
+    facets = CategoryFacetRepository(db)
+    product_id = await insert(db, "a", 1.0, 8)
+    await insert(db, "a", 2.0, 1)
+    await StripedInventoryRepository(db).enable(product_id, stripes=4)
+
+    await facets.rebuild()
+
+    assert (await facets.get_facets())[0]["stock"] == 9
+
+
+async def test_facets_are_computed_until_the_first_rebuild(db):
+    facets = CategoryFacetRepository(db)
+    await insert(db, "a", 1.0, 2)
+    await insert(db, "b", 4.0, 3)
+    # Un alta incremental sobre una base sin resumen deja un resumen parcial que no debe leerse
+    await facets.record(created=[{"category": "b", "price": 4.0, "stock": 3}])
+
+    assert [facet["category"] for facet in await facets.get_facets()] == ["a", "b"]
+
+    await facets.ensure_built()
+    assert [facet["category"] for facet in await facets.get_facets()] == ["a", "b"]
+    assert await db[CategoryFacetRepository.COLLECTION].count_documents({"rebuilt_at": {"$exists": True}}) == 2
+
+
+async def test_ensure_built_keeps_an_existing_summary(db):
+    facets = CategoryFacetRepository(db)
+    await insert(db, "a", 1.0, 2)
+    await facets.rebuild()
+    await insert(db, "b", 4.0, 3)
+
+    await facets.ensure_built()
+
+    assert [facet["category"] for facet in await facets.get_facets()] == ["a"]
+
+
+async def test_rebuild_of_an_empty_catalog_clears_the_summary(db):
+    facets = CategoryFacetRepository(db)
+    await insert(db, "a", 1.0, 2)
+    await facets.rebuild()
+    await db["products"].delete_many({})
+
+    assert await facets.rebuild() == 0
+    assert await facets.get_facets() == []
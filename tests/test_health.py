@@ -0,0 +1,52 @@
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import ServerSelectionTimeoutError
+
+from app.database import MongoDBConnection, client_options_from_env
+from main import app
+
+pytestmark = pytest.mark.anyio
+
+
+def test_pool_options_come_from_the_environment(monkeypatch):
+    monkeypatch.setenv("MONGODB_MAX_POOL_SIZE", "20")
+    monkeypatch.setenv("MONGODB_MIN_POOL_SIZE", "5")
+    monkeypatch.setenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "250")
+    monkeypatch.delenv("MONGODB_MAX_IDLE_TIME_MS", raising=False)
+    monkeypatch.delenv("MONGODB_COMPRESSORS", raising=False)
+
+    assert client_options_from_env() == {
+        "maxPoolSize": 20, "minPoolSize": 5, "serverSelectionTimeoutMS": 5000, "waitQueueTimeoutMS": 250,
+    }
+
+
+async def test_client_is_created_lazily_with_the_pool_options(mock_backend, monkeypatch):
+    monkeypatch.setenv("MONGODB_MIN_POOL_SIZE", "3")
+    created = []
+
+    def factory(url, **options):
+        created.append(options)
+        return AsyncMongoMockClient()
+
+    monkeypatch.setattr(MongoDBConnection, "_client_factory", factory)
+    connection = MongoDBConnection()
+    assert created == []
+
+    assert await connection.is_ready()
+    await connection.warmup()
+    assert len(created) == 1 and created[0]["minPoolSize"] == 3
+    connection.close()
+
+
+def test_readiness_follows_mongodb(client, monkeypatch):
+    assert client.get("/health/live").json() == {"status": "ok"}
+    assert client.get("/health/ready").status_code == 200
+
+    async def unreachable(timeout=None):
+        raise ServerSelectionTimeoutError("sin servidor")
+
+    monkeypatch.setattr(app.state.db_connection, "ping", unreachable)
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    # La app sigue viva aunque no esté lista para recibir tráfico
+    assert client.get("/health/live").status_code == 200
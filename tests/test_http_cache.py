@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+from tests.test_cart_api import create_product
+
+IDENTITY = {"Accept-Encoding": "identity"}
+
+
+def test_unchanged_page_answers_not_modified(client):
+    create_product(client, stock=1)
+    first = client.get("/products", headers=IDENTITY)
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"].startswith("public, max-age=")
+
+    for validator in (etag, f"W/{etag}", f'"otro", {etag}'):
+        response = client.get("/products", headers={**IDENTITY, "If-None-Match": validator})
+        assert response.status_code == 304
+        assert response.content == b"" and response.headers["ETag"] == etag
+
+    response = client.get("/products", headers={**IDENTITY, "If-Modified-Since": first.headers["Last-Modified"]})
+    assert response.status_code == 304
+    earlier = format_datetime(datetime.now(timezone.utc) - timedelta(days=1), usegmt=True)
+    assert client.get("/products", headers={**IDENTITY, "If-Modified-Since": earlier}).status_code == 200
+
+
+def test_a_catalog_write_changes_the_etag(client):
+    create_product(client, stock=1)
+    etag = client.get("/products", headers=IDENTITY).headers["ETag"]
+
+    # Mismo producto: el alta incrementa su stock
+    create_product(client, stock=1)
+
+    response = client.get("/products", headers={**IDENTITY, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()[0]["stock"] == 2
+
+
+def test_large_pages_are_served_gzipped_with_their_own_etag(client):
+    rows = [{"name": f"Producto {i}", "category": "hogar", "price": 10.0 + i, "stock": i} for i in range(40)]
+    assert client.post("/products/bulk", json=rows).status_code == 200
+
+    plain = client.get("/products", headers=IDENTITY)
+    compressed = client.get("/products", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in plain.headers
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["Vary"] == "Accept-Encoding"
+    assert compressed.headers["ETag"] == plain.headers["ETag"][:-1] + '-gzip"'
+    assert compressed.json() == plain.json()
+    response = client.get("/products", headers={"Accept-Encoding": "gzip",
+                                                "If-None-Match": compressed.headers["ETag"]})
+    assert response.status_code == 304
@@ -0,0 +1,78 @@
+import pytest
+from pymongo import ASCENDING, IndexModel
+
+from app import indexes
+from app.indexes import reconcile_indexes
+
+pytestmark = pytest.mark.anyio
+
+
+class Users:
+    COLLECTION = "users"
+    INDEXES = [
+        IndexModel([("email", ASCENDING)], name="email_1", unique=True),
+        IndexModel([("created_at", ASCENDING)], name="created_at_1"),
+    ]
+
+
+async def seed_duplicate_emails(db):
+    await db.users.insert_many([
+        {"email": "ana@example.com", "created_at": 1},
+        {"email": "ana@example.com", "created_at": 2},
+    ])
+
+
+async def test_unique_index_over_duplicates_does_not_block_the_others(db):
+    await seed_duplicate_emails(db)
+
+    await reconcile_indexes(db, [Users])
+
+    info = await db.users.index_information()
+    assert "email_1" not in info
+    assert "created_at_1" in info
+
+
+async def test_existing_index_is_kept_when_the_new_one_cannot_be_unique(db):
+    await seed_duplicate_emails(db)
+    await db.users.create_index([("email", ASCENDING)], name="email_1")
+
+    await reconcile_indexes(db, [Users])
+
+    info = await db.users.index_information()
+    assert "email_1" in info and not info["email_1"].get("unique", False)
+    assert "created_at_1" in info
+
+
+async def test_mismatched_index_is_recreated(db):
+    await db.users.insert_many([{"email": "ana@example.com"}, {"email": "beto@example.com"}])
+    await db.users.create_index([("email", ASCENDING)], name="email_1")
+
+    await reconcile_indexes(db, [Users])
+
+    assert (await db.users.index_information())["email_1"]["unique"] is True
+
+
+async def test_previous_index_is_restored_when_the_replacement_fails(db, monkeypatch):
+    await seed_duplicate_emails(db)
+    await db.users.create_index([("email", ASCENDING)], name="email_1")
+
+    async def no_duplicates(collection, spec):
+        return False
+
+    # Simula un duplicado que aparece entre la comprobación y la creación
+    monkeypatch.setattr(indexes, "_has_duplicates", no_duplicates)
+    await reconcile_indexes(db, [Users])
+
+    info = await db.users.index_information()
+    assert list(info["email_1"]["key"]) == [("email", ASCENDING)]
+    assert not info["email_1"].get("unique", False)
+
+
+async def test_duplicate_check_only_counts_documents_in_a_partial_index(db):
+    spec = IndexModel([("user_id", ASCENDING), ("key", ASCENDING)], name="user_id_1_key_1", unique=True,
+                      partialFilterExpression={"key": {"$exists": True}}).document
+    await db.orders.insert_many([{"user_id": "ana"}, {"user_id": "ana"}, {"user_id": "ana", "key": "k1"}])
+    assert not await indexes._has_duplicates(db.orders, spec)
+
+    await db.orders.insert_one({"user_id": "ana", "key": "k1"})
+    assert await indexes._has_duplicates(db.orders, spec)
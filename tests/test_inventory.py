@@ -0,0 +1,95 @@
+import pytest
+from bson import ObjectId
+
+from app.models.cart import CartItem
+from app.repositories.cart_buffer import WriteBehindCarts
+from app.repositories.cart_repository import CartRepository
+from app.repositories.inventory_repository import StripedInventoryRepository
+from app.repositories.reservation_repository import ReservationRepository
+from tests.test_checkout import create_product
+
+pytestmark = pytest.mark.anyio
+
+
+def striped_repo(db) -> CartRepository:
+    reservations = ReservationRepository(db)
+    return CartRepository(db, reservations=reservations,
+                          inventory=StripedInventoryRepository(db, reservations=reservations),
+                          buffer=WriteBehindCarts(db[CartRepository.COLLECTION]))
+
+
+async def product(db, product_id: str) -> dict:
+    return await db["products"].find_one({"_id": ObjectId(product_id)})
+
+
+async def test_reservations_of_striped_products_do_not_write_the_product(db):
+    product_id = await create_product(db, stock=10)
+    repo = striped_repo(db)
+    await repo.inventory.enable(ObjectId(product_id), stripes=4)
+    before = await product(db, product_id)
+
+    await repo.add_to_cart("u1", CartItem(product_id=product_id, quantity=3))
+    assert await product(db, product_id) == before
+    assert (await db["reservations"].find_one({"user_id": "u1"}))["quantity"] == 3
+
+    await repo.remove_item("u1", product_id)
+    assert await product(db, product_id) == before
+    assert await db["reservations"].count_documents({}) == 0
+
+
+async def test_striped_checkout_leaves_the_product_document_alone(db):
+    product_id = await create_product(db, stock=10)
+    repo = striped_repo(db)
+    await repo.inventory.enable(ObjectId(product_id), stripes=4)
+    await repo.add_to_cart("u1", CartItem(product_id=product_id, quantity=3))
+
+    await repo.checkout("u1")
+
+    assert await repo.inventory.get_stock(ObjectId(product_id)) == 7
+    assert "reserved" not in await product(db, product_id)
+    assert await db["reservations"].count_documents({}) == 0
+
+
+async def test_reserved_counter_moves_with_the_stripes(db):
+    product_id = await create_product(db, stock=10)
+    repo = striped_repo(db)
+    await repo.add_to_cart("u1", CartItem(product_id=product_id, quantity=2))
+    assert (await product(db, product_id))["reserved"] == 2
+
+    await repo.inventory.enable(ObjectId(product_id), stripes=4)
+    assert "reserved" not in await product(db, product_id)
+
+    await repo.add_to_cart("u2", CartItem(product_id=product_id, quantity=1))
+    await repo.inventory.disable(ObjectId(product_id))
+    document = await product(db, product_id)
+    assert document["stock"] == 10 and document["reserved"] == 3
+
+
+async def test_checkout_retries_on_stripes_enabled_by_another_process(db):
+    product_id = await create_product(db, stock=10)
+    repo = striped_repo(db)
+    await repo.add_to_cart("u1", CartItem(product_id=product_id, quantity=2))
+    # Este proceso cachea que el producto no tiene stripes; otro lo reparte después
+    assert await repo.inventory.stripe_counts([ObjectId(product_id)]) == {ObjectId(product_id): 0}
+    await StripedInventoryRepository(db).enable(ObjectId(product_id), stripes=4)
+
+    await repo.checkout("u1")
+
+    assert await repo.inventory.get_stock(ObjectId(product_id)) == 8
+    assert (await product(db, product_id))["stock"] == 0
+
+
+async def test_clear_only_touches_the_checkout_products(db):
+    bought = await create_product(db, stock=10, name="bought")
+    other = await create_product(db, stock=10, name="other")
+    inventory = StripedInventoryRepository(db)
+    for product_id in (bought, other):
+        await inventory.enable(ObjectId(product_id), stripes=2)
+        assert await inventory.decrement(ObjectId(product_id), 1, 2, token="t1")
+
+    await inventory.clear("t1", [ObjectId(bought)])
+
+    assert await db["inventory_stripes"].count_documents(
+        {"product_id": ObjectId(bought), "stripe_checkouts.token": "t1"}) == 0
+    assert await db["inventory_stripes"].count_documents(
+        {"product_id": ObjectId(other), "stripe_checkouts.token": "t1"}) == 1
@@ -0,0 +1,83 @@
+import logging
+import re
+from types import SimpleNamespace
+
+from app.metrics import (MONGO_COMMAND_DURATION, MONGO_COMMAND_FAILURES, Histogram, MongoCommandListener,
+                         RequestStats, _current_request)
+
+
+def sample(text: str, series: str) -> float:
+    """Valor de una serie en el texto de Prometheus, o 0 si todavía no existe."""
+    match = re.search(rf"^{re.escape(series)} (\S+)$", text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "Latencia.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(value, route="/a")
+
+    text = "\n".join(histogram.render())
+
+    assert sample(text, 'latency_seconds_bucket{route="/a",le="0.1"}') == 1
+    assert sample(text, 'latency_seconds_bucket{route="/a",le="1.0"}') == 3
+    assert sample(text, 'latency_seconds_bucket{route="/a",le="+Inf"}') == 4
+    assert sample(text, 'latency_seconds_count{route="/a"}') == 4
+    assert sample(text, 'latency_seconds_sum{route="/a"}') == 4.25
+
+
+def test_requests_are_measured_per_route_template(client):
+    series = 'http_request_duration_seconds_count{method="GET",route="/products/{category}",status="404"}'
+    before = sample(client.get("/metrics").text, series)
+
+    assert client.get("/products/no-existe").status_code == 404
+    assert client.get("/products/tampoco").status_code == 404
+
+    text = client.get("/metrics").text
+    assert sample(text, series) == before + 2
+    assert 'route="/products/no-existe"' not in text
+
+
+def event(request_id: int, command_name: str = "find", duration_ms: float = 1.0, **command):
+    return SimpleNamespace(connection_id=("localhost", 27017), request_id=request_id, command_name=command_name,
+                           database_name="shop", command={command_name: "products", **command},
+                           duration_micros=int(duration_ms * 1000))
+
+
+def test_command_listener_times_commands_counts_round_trips_and_logs_slow_ones(caplog):
+    listener = MongoCommandListener(slow_query_ms=50)
+    failures = 'mongodb_command_failures_total{collection="products",command="aggregate"}'
+    failures_before = sample("\n".join(MONGO_COMMAND_FAILURES.render()), failures)
+    stats = RequestStats()
+    token = _current_request.set(stats)
+    try:
+        with caplog.at_level(logging.WARNING, logger="app.mongo"):
+            listener.started(event(1))
+            listener.succeeded(event(1, duration_ms=2))
+            listener.started(event(2, "aggregate"))
+            listener.failed(event(2, "aggregate", duration_ms=80))
+    finally:
+        _current_request.reset(token)
+
+    assert stats.round_trips == 2
+    assert sample("\n".join(MONGO_COMMAND_FAILURES.render()), failures) == failures_before + 1
+    assert 'mongodb_command_duration_seconds_count{collection="products",command="find"}' in \
+        "\n".join(MONGO_COMMAND_DURATION.render())
+    assert [record.getMessage().split(" ")[:3] for record in caplog.records] == [
+        ["Consulta", "lenta:", "products.aggregate"]
+    ]
+
+
+def test_slow_query_log_omits_the_command_body(caplog):
+    listener = MongoCommandListener(slow_query_ms=0)
+    secret = {"email": "ana@example.com", "hashed_password": "$2b$04$secret"}
+    with caplog.at_level(logging.WARNING, logger="app.mongo"):
+        listener.started(event(7, "insert", documents=[secret]))
+        listener.succeeded(event(7, "insert", documents=[secret]))
+        listener.started(event(8, "find", filter={"email": "ana@example.com"}))
+        listener.succeeded(event(8, "find", filter={"email": "ana@example.com"}))
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert len(messages) == 2
+    assert "request_id=7" in messages[0]
+    assert not any("ana@example.com" in message or "secret" in message for message in messages)
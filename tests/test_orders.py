@@ -0,0 +1,235 @@
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.models.cart import CartItem
+from app.repositories.cart_buffer import WriteBehindCarts
+from app.repositories.cart_repository import CartRepository
+from app.repositories.inventory_repository import StripedInventoryRepository
+from app.repositories.order_repository import OrderRepository
+from app.repositories.reservation_repository import ReservationRepository
+from app.services.order_processor import OrderProcessor
+from main import app
+from tests.test_auth import register_and_login
+from tests.test_cart_api import create_product as create_product_via_api
+from tests.test_checkout import create_product, stock_of
+
+pytestmark = pytest.mark.anyio
+
+
+class Crash(Exception):
+    """Caída simulada del proceso en un punto del checkout."""
+
+
+def async_repo(db) -> CartRepository:
+    # Lease de 0 s: un pedido vuelve a estar disponible en cuanto su worker "cae"
+    reservations = ReservationRepository(db)
+    return CartRepository(db, reservations=reservations,
+                          inventory=StripedInventoryRepository(db, reservations=reservations),
+                          buffer=WriteBehindCarts(db[CartRepository.COLLECTION]),
+                          orders=OrderRepository(db, lease_seconds=0))
+
+
+async def striped_stock(repo: CartRepository, product_id: str) -> int:
+    return await repo.inventory.get_stock(ObjectId(product_id)) if await repo.inventory.stripe_counts(
+        [ObjectId(product_id)], use_cache=False) else 0
+
+
+async def order_with_two_products(db, repo: CartRepository):
+    """Pedido de 2 unidades de un producto con stripes y 3 de uno normal, con stock 10 cada uno."""
+    striped = await create_product(db, stock=10, name="striped")
+    regular = await create_product(db, stock=10, name="regular")
+    await repo.inventory.enable(ObjectId(striped), stripes=4)
+    await repo.add_to_cart("u1", CartItem(product_id=striped, quantity=2))
+    await repo.add_to_cart("u1", CartItem(product_id=regular, quantity=3))
+    order = await repo.place_order("u1", idempotency_key="k1")
+    return order, striped, regular
+
+
+async def test_worker_completes_a_placed_order(db):
+    repo = async_repo(db)
+    processor = OrderProcessor(repo, repo.orders)
+    order, striped, regular = await order_with_two_products(db, repo)
+    assert (await repo.collection.find_one({"user_id": "u1"}))["items"] == []
+
+    await processor.process(await repo.orders.claim_next())
+
+    assert (await db["orders"].find_one({"_id": order["_id"]}))["status"] == "completed"
+    assert await striped_stock(repo, striped) == 8
+    assert await stock_of(db, regular) == 7
+    assert await db["reservations"].count_documents({}) == 0
+    assert await db["inventory_stripes"].count_documents({"stripe_checkouts.0": {"$exists": True}}) == 0
+
+
+async def test_idempotency_key_replay_returns_the_same_order(db):
+    repo = async_repo(db)
+    order, _, _ = await order_with_two_products(db, repo)
+
+    replay = await repo.place_order("u1", idempotency_key="k1")
+
+    assert replay["_id"] == order["_id"]
+    assert await db["orders"].count_documents({}) == 1
+    with pytest.raises(Exception) as error:
+        await repo.place_order("u1", idempotency_key="k2")
+    assert error.value.status_code == 400
+
+
+async def test_retry_after_a_crash_does_not_decrement_stripes_twice(db, monkeypatch):
+    repo = async_repo(db)
+    processor = OrderProcessor(repo, repo.orders)
+    order, striped, regular = await order_with_two_products(db, repo)
+
+    # El worker cae después de descontar el stock y antes de cerrar el pedido
+    complete = repo.orders.complete
+
+    async def crash(*args, **kwargs):
+        raise Crash()
+
+    monkeypatch.setattr(repo.orders, "complete", crash)
+    with pytest.raises(Crash):
+        await processor.process(await repo.orders.claim_next())
+    assert await striped_stock(repo, striped) == 8
+    assert await stock_of(db, regular) == 7
+
+    # Otro worker lo retoma al vencer el lease
+    monkeypatch.setattr(repo.orders, "complete", complete)
+    retried = await repo.orders.claim_next()
+    assert retried["attempts"] == 2
+    await processor.process(retried)
+
+    assert (await db["orders"].find_one({"_id": order["_id"]}))["status"] == "completed"
+    assert await striped_stock(repo, striped) == 8
+    assert await stock_of(db, regular) == 7
+    assert await db["inventory_stripes"].count_documents({"stripe_checkouts.0": {"$exists": True}}) == 0
+    assert (await db["products"].find_one({"_id": ObjectId(regular)}))["pending_checkouts"] == []
+
+
+async def test_worker_that_lost_its_lease_cannot_close_the_order(db):
+    repo = async_repo(db)
+    processor = OrderProcessor(repo, repo.orders)
+    order, striped, regular = await order_with_two_products(db, repo)
+    stale = await repo.orders.claim_next()
+    current = await repo.orders.claim_next()
+    assert current["lease_id"] != stale["lease_id"]
+
+    # El worker con el lease vencido descuenta el stock pero no puede cerrar el pedido
+    await processor.process(stale)
+    assert (await db["orders"].find_one({"_id": order["_id"]}))["status"] == "processing"
+    await processor.process(current)
+
+    assert (await db["orders"].find_one({"_id": order["_id"]}))["status"] == "completed"
+    assert processor.stats()["completed"] == 1
+    assert await striped_stock(repo, striped) == 8
+    assert await stock_of(db, regular) == 7
+
+
+async def test_failed_order_returns_stock_left_by_a_crashed_attempt(db, monkeypatch):
+    repo = async_repo(db)
+    processor = OrderProcessor(repo, repo.orders, max_attempts=1)
+    order, striped, regular = await order_with_two_products(db, repo)
+
+    async def crash(*args, **kwargs):
+        raise Crash()
+
+    monkeypatch.setattr(repo.orders, "complete", crash)
+    with pytest.raises(Crash):
+        await processor.process(await repo.orders.claim_next())
+
+    # Se agotaron los reintentos: el pedido falla y devuelve lo descontado, también de las stripes
+    await processor.process(await repo.orders.claim_next())
+
+    assert (await db["orders"].find_one({"_id": order["_id"]}))["status"] == "failed"
+    assert await striped_stock(repo, striped) == 10
+    assert await stock_of(db, regular) == 10
+
+
+async def test_draft_of_a_checkout_that_crashed_before_emptying_the_cart_is_discarded(db, monkeypatch):
+    repo = async_repo(db)
+    processor = OrderProcessor(repo, repo.orders)
+    product_id = await create_product(db, stock=10)
+    await repo.add_to_cart("u1", CartItem(product_id=product_id, quantity=3))
+
+    # El proceso cae después de crear el pedido y antes de vaciar el carrito
+    async def crash(*args, **kwargs):
+        raise Crash()
+
+    monkeypatch.setattr(repo.collection, "update_one", crash)
+    with pytest.raises(Crash):
+        await repo.place_order("u1")
+    monkeypatch.undo()
+    assert (await db["orders"].find_one({}))["draft"] is True
+
+    await processor.process(await repo.orders.claim_next())
+
+    assert await db["orders"].count_documents({}) == 0
+    assert len((await repo.collection.find_one({"user_id": "u1"}))["items"]) == 1
+    assert (await db["reservations"].find_one({"user_id": "u1"}))["status"] == "active"
+    assert await stock_of(db, product_id) == 10
+
+
+async def test_draft_of_a_checkout_that_crashed_after_emptying_the_cart_is_processed(db, monkeypatch):
+    repo = async_repo(db)
+    processor = OrderProcessor(repo, repo.orders)
+    product_id = await create_product(db, stock=10)
+    await repo.add_to_cart("u1", CartItem(product_id=product_id, quantity=3))
+
+    # El proceso cae después de vaciar el carrito y antes de publicar el pedido
+    async def crash(*args, **kwargs):
+        raise Crash()
+
+    monkeypatch.setattr(repo.orders, "release", crash)
+    with pytest.raises(Crash):
+        await repo.place_order("u1")
+    monkeypatch.undo()
+
+    await processor.process(await repo.orders.claim_next())
+
+    order = await db["orders"].find_one({})
+    assert order["status"] == "completed"
+    assert "draft" not in order
+    assert await stock_of(db, product_id) == 7
+
+
+async def test_checkout_that_outlived_its_discarded_draft_gives_the_cart_back(db, monkeypatch):
+    repo = async_repo(db)
+    processor = OrderProcessor(repo, repo.orders)
+    product_id = await create_product(db, stock=10)
+    await repo.add_to_cart("u1", CartItem(product_id=product_id, quantity=3))
+    create = repo.orders.create
+
+    # Un worker descarta el borrador antes de que el checkout (lento) vacíe el carrito
+    async def create_then_discard(*args, **kwargs):
+        order = await create(*args, **kwargs)
+        await processor.process(await repo.orders.claim_next())
+        return order
+
+    monkeypatch.setattr(repo.orders, "create", create_then_discard)
+    with pytest.raises(Exception) as error:
+        await repo.place_order("u1")
+
+    assert error.value.status_code == 409
+    assert await db["orders"].count_documents({}) == 0
+    assert len((await repo.collection.find_one({"user_id": "u1"}))["items"]) == 1
+    assert await stock_of(db, product_id) == 10
+
+
+@pytest.fixture
+def async_client(mock_backend, monkeypatch):
+    monkeypatch.setenv("CHECKOUT_MODE", "async")
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def test_checkout_replayed_with_the_same_idempotency_key_returns_the_same_order(async_client):
+    client = async_client
+    headers = register_and_login(client)
+    product_id = create_product_via_api(client, stock=5)
+    assert client.post("/cart", headers=headers, json={"product_id": product_id, "quantity": 2}).status_code == 200
+
+    first = client.post("/checkout", headers={**headers, "Idempotency-Key": "k1"})
+    replay = client.post("/checkout", headers={**headers, "Idempotency-Key": "k1"})
+
+    assert first.status_code == replay.status_code == 202
+    assert replay.json()["order_id"] == first.json()["order_id"]
+    assert replay.headers["Location"] == f"/orders/{first.json()['order_id']}"
+    assert client.post("/checkout", headers={**headers, "Idempotency-Key": "k2"}).status_code == 400
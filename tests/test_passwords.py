@@ -0,0 +1,47 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+
+from app.auth import passwords
+from app.auth.passwords import PasswordHasher
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(ThreadPoolExecutor(max_workers=2), max_concurrency=1, max_queue=1)
+    yield hasher
+    hasher.shutdown()
+
+
+async def test_hash_and_verify_run_in_the_pool(hasher):
+    hashed = await hasher.hash("secret-password")
+
+    assert await hasher.verify_and_update("secret-password", hashed) == (True, None)
+    assert (await hasher.verify_and_update("wrong-password", hashed))[0] is False
+    assert hasher.stats()["completed"] == 3
+
+
+async def test_full_queue_is_rejected_without_blocking_the_loop(hasher, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(passwords, "_hash", lambda password: release.wait(5) and f"hash:{password}")
+
+    running = asyncio.ensure_future(hasher.hash("a"))
+    queued = asyncio.ensure_future(hasher.hash("b"))
+    # El event loop sigue atendiendo mientras bcrypt corre en el pool
+    while hasher.in_flight != 1 or hasher.waiting != 1:
+        await asyncio.sleep(0.01)
+
+    with pytest.raises(HTTPException) as error:
+        await hasher.hash("c")
+    assert error.value.status_code == 503
+    assert error.value.headers["Retry-After"] == "1"
+
+    release.set()
+    assert await asyncio.gather(running, queued) == ["hash:a", "hash:b"]
+    stats = hasher.stats()
+    assert (stats["completed"], stats["rejected"], stats["max_waiting"]) == (2, 1, 1)
@@ -0,0 +1,69 @@
+import pytest
+
+from app import cache as cache_module
+from app.cache import LRUCache, ProductCache
+from app.repositories.product_repository import ProductRepository
+from tests.test_checkout import create_product
+
+pytestmark = pytest.mark.anyio
+
+
+def test_lru_cache_evicts_the_least_recently_used_entry():
+    lru = LRUCache(max_size=2)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+
+    assert lru.get("b") is None
+    assert lru.get("a") == 1 and lru.get("c") == 3
+    assert lru.stats()["evictions"] == 1
+
+
+def test_lru_cache_entries_expire_after_their_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    lru = LRUCache(ttl_seconds=5)
+    lru.set("a", 1)
+
+    now[0] += 4
+    assert lru.get("a") == 1
+    now[0] += 1
+    assert lru.get("a") is None
+    assert len(lru) == 0
+
+
+def test_responses_built_before_a_write_are_not_cached():
+    cache = ProductCache()
+    version = cache.version
+    cache.invalidate_product("p1", "hogar")
+
+    cache.set_response(("hogar", "response"), b"stale", version)
+    assert cache.get_response(("hogar", "response")) is None
+
+
+def test_invalidating_a_product_keeps_the_lists_of_other_categories():
+    cache = ProductCache()
+    for key in [(None, "page"), ("hogar", "page"), ("libros", "page")]:
+        cache.set_list(key, [key])
+
+    cache.invalidate_product("p1", "hogar")
+
+    assert cache.get_list((None, "page")) is None
+    assert cache.get_list(("hogar", "page")) is None
+    assert cache.get_list(("libros", "page")) == [("libros", "page")]
+
+
+async def test_repository_serves_products_from_cache_until_a_write(db):
+    product_id = await create_product(db, stock=5)
+    repo = ProductRepository(db, cache=ProductCache())
+    assert (await repo.get_product_by_id(product_id)).stock == 5
+
+    # Cambio hecho por otro proceso: el cache sigue sirviendo la copia anterior
+    await db["products"].update_one({}, {"$set": {"stock": 1}})
+    assert (await repo.get_product_by_id(product_id)).stock == 5
+    assert (await repo.get_product_by_id(product_id, use_cache=False)).stock == 1
+
+    # Una escritura de este proceso invalida la entrada
+    await repo.update_stock(product_id, 1)
+    assert (await repo.get_product_by_id(product_id)).stock == 0
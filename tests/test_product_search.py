@@ -0,0 +1,51 @@
+import pytest
+
+from app.indexes import find_collscans, reconcile_indexes
+from app.repositories.product_repository import ProductRepository, _search_filter
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed(db):
+    await db["products"].insert_many([
+        {"name": "agotado", "category": "c", "price": 1.0, "stock": 0},
+        {"name": "disponible", "category": "c", "price": 2.0, "stock": 3},
+        # Con stripes el stock del documento es 0 y el real está en `inventory_stripes`
+        {"name": "repartido", "category": "c", "price": 3.0, "stock": 0, "stripes": 4},
+    ])
+
+
+def test_hot_queries_use_the_search_filter():
+    in_stock = _search_filter(in_stock=True)["$or"]
+    stock_queries = [query for query in ProductRepository.HOT_QUERIES if "stock" in str(query["filter"])]
+
+    assert stock_queries
+    for query in stock_queries:
+        # Ninguna consulta declarada usa una forma de `in_stock` que la búsqueda no ejecuta
+        assert "stock" not in query["filter"]
+        assert query["filter"]["$or"] == in_stock
+
+
+async def test_in_stock_includes_striped_products(db):
+    await seed(db)
+    products, _ = await ProductRepository(db).search_products(in_stock=True, sort="name")
+
+    assert [product["name"] for product in products] == ["disponible", "repartido"]
+
+
+async def test_name_sort_pages_by_cursor(db):
+    await seed(db)
+    repo = ProductRepository(db)
+    first, cursor = await repo.search_products(sort="name", limit=2)
+    second, last_cursor = await repo.search_products(sort="name", limit=2, after=cursor)
+
+    assert [product["name"] for product in first + second] == ["agotado", "disponible", "repartido"]
+    assert last_cursor is None
+
+
+@pytest.mark.mongod
+async def test_hot_queries_do_not_scan_the_collection(mongod_db):
+    await seed(mongod_db)
+    await reconcile_indexes(mongod_db, [ProductRepository])
+
+    assert await find_collscans(mongod_db, [ProductRepository]) == []
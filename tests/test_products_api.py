@@ -0,0 +1,54 @@
+import orjson
+
+from tests.test_cart_api import create_product
+
+
+def test_product_pages_include_ids_and_cursor(client):
+    created = []
+    for name in ("Taza", "Plato", "Vaso"):
+        response = client.post("/products", json={"name": name, "price": 10.0, "category": "hogar", "stock": 1})
+        assert response.status_code == 200, response.text
+        created.append(response.json()["_id"])
+
+    first = client.get("/products", params={"limit": 2})
+    assert first.status_code == 200, first.text
+    assert [product["_id"] for product in first.json()] == created[:2]
+    assert first.headers["X-Next-Cursor"] == created[1]
+
+    second = client.get("/products", params={"limit": 2, "after": first.headers["X-Next-Cursor"]})
+    assert [product["_id"] for product in second.json()] == created[2:]
+    assert "X-Next-Cursor" not in second.headers
+
+
+def test_category_page_and_stream_include_ids(client):
+    product_id = create_product(client, stock=4)
+
+    page = client.get("/products/hogar")
+    assert page.status_code == 200, page.text
+    assert page.json() == [{"_id": product_id, "name": "Taza", "category": "hogar", "price": 10.0, "stock": 4}]
+
+    # Una segunda petición sale del cache de respuestas con el mismo cuerpo
+    assert client.get("/products/hogar").content == page.content
+
+    stream = client.get("/products", params={"stream": "true"})
+    assert [orjson.loads(line)["_id"] for line in stream.content.splitlines()] == [product_id]
+
+
+def test_category_pages_follow_the_cursor_and_bad_parameters_are_rejected(client):
+    rows = [{"name": f"Producto {i}", "category": "hogar" if i % 2 else "libros", "price": 1.0, "stock": 1}
+            for i in range(6)]
+    assert client.post("/products/bulk", json=rows).status_code == 200
+
+    seen, after = [], None
+    while True:
+        page = client.get("/products/hogar", params={"limit": 2, **({"after": after} if after else {})})
+        assert page.status_code == 200, page.text
+        seen.extend(product["name"] for product in page.json())
+        after = page.headers.get("X-Next-Cursor")
+        if after is None:
+            break
+    assert seen == ["Producto 1", "Producto 3", "Producto 5"]
+
+    assert client.get("/products", params={"after": "no-es-un-id"}).status_code == 400
+    assert client.get("/products", params={"limit": 0}).status_code == 422
+    assert client.get("/products", params={"limit": 1001}).status_code == 422
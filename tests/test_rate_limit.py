@@ -0,0 +1,78 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.rate_limit import RateLimitBackend, RateLimitMiddleware, RouteLimit
+
+pytestmark = pytest.mark.anyio
+
+
+def limited_app(limits):
+    app = FastAPI()
+    release = asyncio.Event()
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    @app.get("/slow")
+    async def slow():
+        await release.wait()
+        return {"ok": True}
+
+    app.add_middleware(RateLimitMiddleware, router=app.router, limits=limits)
+    return app, release
+
+
+def client_for(app) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+async def test_bucket_exhaustion_returns_429_with_retry_after():
+    app, _ = limited_app({"GET /ping": RouteLimit(per_minute=6, burst=2)})
+    async with client_for(app) as client:
+        statuses = [(await client.get("/ping")).status_code for _ in range(3)]
+        response = await client.get("/ping")
+
+    assert statuses == [200, 200, 429]
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+async def test_buckets_are_per_client():
+    app, _ = limited_app({"GET /ping": RouteLimit(per_minute=6, burst=1)})
+    async with client_for(app) as client:
+        assert (await client.get("/ping")).status_code == 200
+        assert (await client.get("/ping")).status_code == 429
+        # Un token inválido se limita por IP, igual que sin token
+        assert (await client.get("/ping", headers={"Authorization": "Bearer x"})).status_code == 429
+
+
+async def test_concurrency_cap_returns_503_immediately():
+    app, release = limited_app({"GET /slow": RouteLimit(per_minute=600, burst=100, max_concurrency=1)})
+    async with client_for(app) as client:
+        first = asyncio.create_task(client.get("/slow"))
+        await asyncio.sleep(0.05)
+        rejected = await client.get("/slow")
+        release.set()
+        assert (await first).status_code == 200
+
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"] == "1"
+
+
+async def test_unlimited_routes_pass_through():
+    app, _ = limited_app({})
+    async with client_for(app) as client:
+        statuses = {(await client.get("/ping")).status_code for _ in range(20)}
+    assert statuses == {200}
+
+
+def test_backend_requires_take():
+    class NoTake(RateLimitBackend):
+        pass
+
+    with pytest.raises(TypeError):
+        NoTake()
@@ -0,0 +1,199 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ASCENDING
+
+from app.indexes import reconcile_indexes
+from app.models.cart import CartItem
+from app.repositories.cart_buffer import WriteBehindCarts
+from app.repositories.cart_repository import CartRepository
+from app.repositories.inventory_repository import StripedInventoryRepository
+from app.repositories.reservation_repository import ReservationRepository
+from tests.test_checkout import create_product
+
+pytestmark = pytest.mark.anyio
+
+LONG_AGO = datetime.utcnow() - timedelta(hours=1)
+
+
+async def reserved_of(db, product_id: str) -> int:
+    return (await db["products"].find_one({"_id": ObjectId(product_id)})).get("reserved", 0)
+
+
+async def abandon(db, status: str, **fields):
+    """Deja las reservas como las dejaría un proceso que cayó a mitad de un reclamo."""
+    await db["reservations"].update_many({}, {"$set": {"status": status, "claimed_at": LONG_AGO, **fields}})
+
+
+async def test_sweeper_releases_expired_reservations(db):
+    product_id = await create_product(db, stock=10)
+    reservations = ReservationRepository(db, ttl_seconds=-1)
+    await reservations.reserve("u1", product_id, 3)
+    assert await reserved_of(db, product_id) == 3
+
+    assert await reservations.sweep_expired() == 1
+    assert await reserved_of(db, product_id) == 0
+    assert await db["reservations"].count_documents({}) == 0
+
+
+async def test_stale_release_is_completed_once(db):
+    product_id = await create_product(db, stock=10)
+    reservations = ReservationRepository(db)
+    await reservations.reserve("u1", product_id, 3)
+    await reservations.reserve("u2", product_id, 2)
+    await abandon(db, "releasing")
+    # u1 cayó después de devolver su `reserved` al producto y antes de borrar la reserva
+    first = await db["reservations"].find_one({"user_id": "u1"})
+    await db["products"].update_one({"_id": ObjectId(product_id)},
+                                    {"$inc": {"reserved": -3}, "$push": {"released_reservations": first["_id"]}})
+
+    assert await reservations.recover_stale() == 2
+    product = await db["products"].find_one({"_id": ObjectId(product_id)})
+    assert product["reserved"] == 0
+    assert product["released_reservations"] == []
+    assert await db["reservations"].count_documents({}) == 0
+
+
+async def test_stale_checkout_that_never_reached_the_stock_is_restored(db):
+    product_id = await create_product(db, stock=10)
+    reservations = ReservationRepository(db)
+    await reservations.reserve("u1", product_id, 3)
+    await abandon(db, "checkout", token="t1")
+
+    assert await reservations.recover_stale() == 1
+    reservation = await db["reservations"].find_one({"user_id": "u1"})
+    assert reservation["status"] == "active" and "token" not in reservation and "claimed_at" not in reservation
+    assert await reserved_of(db, product_id) == 3
+
+
+async def test_stale_checkout_that_reached_the_stock_is_consumed(db):
+    product_id = await create_product(db, stock=10)
+    leftover_id = await create_product(db, stock=10, name="leftover")
+    reservations = ReservationRepository(db)
+    await reservations.reserve("u1", product_id, 3)
+    await reservations.reserve("u1", leftover_id, 1)
+    await abandon(db, "checkout", token="t1")
+    # El checkout descontó el stock y convirtió lo reservado, y cayó antes de confirmar
+    await db["products"].update_one({"_id": ObjectId(product_id)},
+                                    {"$inc": {"stock": -3, "reserved": -3}, "$push": {"pending_checkouts": "t1"}})
+
+    assert await reservations.recover_stale() == 2
+    assert await reserved_of(db, product_id) == 0
+    assert (await db["products"].find_one({"_id": ObjectId(product_id)}))["pending_checkouts"] == []
+    remaining = await db["reservations"].find({}).to_list(length=None)
+    assert [(row["product_id"], row["status"]) for row in remaining] == [(leftover_id, "active")]
+    assert await reserved_of(db, leftover_id) == 1
+
+
+async def test_stale_checkout_that_reached_the_stripes_is_consumed(db):
+    product_id = await create_product(db, stock=10)
+    reservations = ReservationRepository(db)
+    inventory = StripedInventoryRepository(db, reservations=reservations)
+    await inventory.enable(ObjectId(product_id), stripes=2)
+    await reservations.reserve("u1", product_id, 3)
+    await abandon(db, "checkout", token="t1")
+    # El checkout descontó las stripes con su marca y cayó antes de confirmar
+    assert await inventory.decrement(ObjectId(product_id), 3, 2, token="t1")
+
+    assert await reservations.recover_stale() == 1
+    assert await db["reservations"].count_documents({}) == 0
+    assert await db["inventory_stripes"].count_documents({"stripe_checkouts.token": "t1"}) == 0
+    assert await inventory.get_stock(ObjectId(product_id)) == 7
+
+
+async def test_stale_checkout_follows_its_order(db):
+    pending_id = await create_product(db, stock=10, name="pending")
+    done_id = await create_product(db, stock=10, name="done")
+    reservations = ReservationRepository(db)
+    await reservations.reserve("u1", pending_id, 1)
+    await reservations.reserve("u2", done_id, 2)
+    await abandon(db, "checkout")
+    await db["reservations"].update_one({"user_id": "u1"}, {"$set": {"token": "t-pending"}})
+    await db["reservations"].update_one({"user_id": "u2"}, {"$set": {"token": "t-done"}})
+    await db["orders"].insert_many([
+        {"reservation_token": "t-pending", "status": "pending", "items": [{"product_id": pending_id}]},
+        {"reservation_token": "t-done", "status": "completed", "items": [{"product_id": done_id}]},
+    ])
+
+    assert await reservations.recover_stale() == 1
+    # El pedido en cola conserva su reserva para el worker; la del completado se confirma
+    assert await db["reservations"].count_documents({"token": "t-pending", "status": "checkout"}) == 1
+    assert await db["reservations"].count_documents({"token": "t-done"}) == 0
+
+
+async def test_recent_claims_are_left_alone(db):
+    product_id = await create_product(db, stock=10)
+    reservations = ReservationRepository(db)
+    await reservations.reserve("u1", product_id, 3)
+    await reservations.claim("u1")
+
+    assert await reservations.recover_stale() == 0
+    assert await db["reservations"].count_documents({"status": "checkout"}) == 1
+
+
+async def test_retired_ttl_index_is_dropped(db):
+    await db["reservations"].create_index([("expires_at", ASCENDING)], name="expires_at_1", expireAfterSeconds=3600)
+
+    await reconcile_indexes(db, [ReservationRepository])
+
+    info = await db["reservations"].index_information()
+    assert "expires_at_1" not in info
+    assert "status_1_claimed_at_1" in info
+
+
+async def test_checkout_confirms_reservations_with_the_cart(db):
+    product_id = await create_product(db, stock=10)
+    repo = CartRepository(db, reservations=ReservationRepository(db),
+                          buffer=WriteBehindCarts(db[CartRepository.COLLECTION]))
+    await repo.add_to_cart("u1", CartItem(product_id=product_id, quantity=4))
+
+    await repo.checkout("u1")
+
+    product = await db["products"].find_one({"_id": ObjectId(product_id)})
+    assert (product["stock"], product["reserved"]) == (6, 0)
+    assert product["pending_checkouts"] == []
+    assert await db["reservations"].count_documents({}) == 0
+
+
+@pytest.mark.parametrize("quantity", [0, -10])
+async def test_reserve_rejects_non_positive_quantities(db, quantity):
+    product_id = await create_product(db, stock=5)
+    reservations = ReservationRepository(db)
+
+    with pytest.raises(HTTPException) as error:
+        await reservations.reserve("u1", product_id, quantity)
+    assert error.value.status_code == 400
+    assert await reserved_of(db, product_id) == 0
+    assert await db["reservations"].count_documents({}) == 0
+
+
+async def test_add_to_cart_rejects_non_positive_quantities(db):
+    product_id = await create_product(db, stock=5)
+    repo = CartRepository(db, reservations=ReservationRepository(db))
+
+    with pytest.raises(HTTPException):
+        await repo.add_to_cart("u1", CartItem.model_construct(product_id=product_id, quantity=-10))
+    assert await reserved_of(db, product_id) == 0
+    assert await db["carts"].count_documents({}) == 0
+
+
+async def test_reserve_reports_a_missing_product(db):
+    with pytest.raises(HTTPException) as error:
+        await ReservationRepository(db).reserve("u1", str(ObjectId()), 1)
+    assert error.value.status_code == 404
+
+
+async def test_stale_checkout_only_inspects_the_reserved_products(db):
+    reserved_id = await create_product(db, stock=10, name="reserved")
+    other_id = await create_product(db, stock=10, name="other")
+    reservations = ReservationRepository(db)
+    await reservations.reserve("u1", reserved_id, 2)
+    await abandon(db, "checkout", token="t1")
+    await db["products"].update_many({}, {"$set": {"pending_checkouts": ["t1"]}})
+
+    assert await reservations.recover_stale() == 1
+    assert await db["reservations"].count_documents({}) == 0
+    assert (await db["products"].find_one({"_id": ObjectId(reserved_id)}))["pending_checkouts"] == []
+    assert (await db["products"].find_one({"_id": ObjectId(other_id)}))["pending_checkouts"] == ["t1"]
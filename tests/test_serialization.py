@@ -0,0 +1,56 @@
+from datetime import datetime
+
+import orjson
+from bson import ObjectId
+
+from app.models.cart import CartItem
+from app.models.product import Product
+from app.models.rows import CartLine, ProductRow
+from app.serialization import MongoJSONResponse, dumps, stringify_id
+from tests.test_auth import register_and_login
+from tests.test_cart_api import create_product
+
+
+def test_dumps_encodes_mongo_types_models_and_rows():
+    product_id = ObjectId()
+    content = {
+        "id": product_id,
+        "at": datetime(2024, 1, 2, 3, 4, 5),
+        "model": Product(_id=str(product_id), name="Taza", category="hogar", price=10.0, stock=1),
+        "row": ProductRow(str(product_id), "Taza", "hogar", 10.0, 1),
+        "line": CartLine(str(product_id), 2, "Taza", 10.0, "hogar"),
+    }
+
+    assert orjson.loads(dumps(content)) == {
+        "id": str(product_id),
+        "at": "2024-01-02T03:04:05",
+        "model": {"_id": str(product_id), "name": "Taza", "category": "hogar", "price": 10.0, "stock": 1},
+        "row": {"_id": str(product_id), "name": "Taza", "category": "hogar", "price": 10.0, "stock": 1},
+        "line": {"product_id": str(product_id), "quantity": 2, "name": "Taza", "price": 10.0, "category": "hogar"},
+    }
+
+
+def test_stringify_id_converts_in_place():
+    document = {"_id": ObjectId("0" * 24), "name": "Taza"}
+    assert stringify_id(document) is document
+    assert document["_id"] == "0" * 24
+
+
+def test_mongo_json_response_renders_with_orjson():
+    response = MongoJSONResponse({"items": [CartItem(product_id="p1", quantity=1)], "id": ObjectId("0" * 24)})
+    body = orjson.loads(response.body)
+    assert body["id"] == "0" * 24
+    assert body["items"][0]["product_id"] == "p1" and body["items"][0]["quantity"] == 1
+
+
+def test_cart_lines_are_served_without_a_model_round_trip(client):
+    headers = register_and_login(client)
+    product_id = create_product(client, stock=5)
+    assert client.post("/cart", headers=headers, json={"product_id": product_id, "quantity": 2}).status_code == 200
+
+    response = client.get("/cart", headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["items"] == [
+        {"product_id": product_id, "quantity": 2, "name": "Taza", "price": 10.0, "category": "hogar"},
+    ]
@@ -0,0 +1,77 @@
+import pytest
+from fastapi import HTTPException
+
+from app.auth.auth import (create_access_token, create_user_access_token, get_current_token_user,
+                           revoke_user_tokens, token_versions)
+from app.models.user import User
+from app.repositories.user_repository import UserRepository
+
+pytestmark = pytest.mark.anyio
+
+
+class CountingUsers(UserRepository):
+    """`UserRepository` que cuenta las consultas a MongoDB del camino de autenticación."""
+
+    def __init__(self, db):
+        super().__init__(db)
+        self.lookups = 0
+
+    async def get_user_by_id(self, user_id: str):
+        self.lookups += 1
+        return await super().get_user_by_id(user_id)
+
+    async def get_token_version(self, user_id: str):
+        self.lookups += 1
+        return await super().get_token_version(user_id)
+
+
+@pytest.fixture
+async def users(db):
+    token_versions.clear()
+    repo = CountingUsers(db)
+    user = await repo.create_user(User(name="Ana", email="ana@example.com", hashed_password="x"))
+    yield repo, user
+    token_versions.clear()
+
+
+async def test_token_claims_authenticate_without_reading_the_user(users):
+    repo, user = users
+    token = create_user_access_token(user)
+
+    for _ in range(3):
+        current = await get_current_token_user(token, repo)
+
+    assert (current.id, current.name, current.email) == (user.id, "Ana", "ana@example.com")
+    # Solo la primera petición consulta la versión vigente de los tokens
+    assert repo.lookups == 1
+
+
+async def test_revoked_tokens_are_rejected(users):
+    repo, user = users
+    token = create_user_access_token(user)
+    await get_current_token_user(token, repo)
+
+    await revoke_user_tokens(repo, user.id)
+
+    with pytest.raises(HTTPException) as error:
+        await get_current_token_user(token, repo)
+    assert error.value.status_code == 401
+    fresh = create_user_access_token(user.model_copy(update={"token_version": 1}))
+    assert (await get_current_token_user(fresh, repo)).token_version == 1
+
+
+async def test_tokens_without_claims_fall_back_to_the_user_lookup(users):
+    repo, user = users
+    legacy = create_access_token({"sub": user.id})
+
+    current = await get_current_token_user(legacy, repo)
+
+    assert current.email == "ana@example.com"
+    assert repo.lookups == 1
+
+
+async def test_invalid_tokens_are_rejected(users):
+    repo, _ = users
+    with pytest.raises(HTTPException) as error:
+        await get_current_token_user("not-a-token", repo)
+    assert error.value.status_code == 401